@@ -0,0 +1,236 @@
+'''
+Benchmarks of the CPGminer pipeline on synthetic prokaryotes.txt files, fully offline.
+
+    python -m benchmark --rows 10000 100000 1000000 --output results.json
+    python -m benchmark --rows 100000 --compare results.json
+
+Each stage is timed over --repeat runs (the fastest is kept) and run once more under tracemalloc for its
+peak memory. --compare reports the stages slower than a previous results file by more than --threshold
+and exits with 1 if there is any.
+'''
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+from cache_backend import NoCache, set_cache_backend
+from charts import box_statistics, density_bins
+from ncbi import NCBIdata, count_tableMaker_groupby
+from rollup import RollupCube
+from synthetic import write_synthetic
+from taxonomy import CompactTaxonomy
+
+RESULTS_VERSION = 1
+
+
+def measure(fn, repeat=3, memory=True, setup=None):
+    '''
+    Function to time fn and measure its peak memory
+    :param fn: function without arguments
+    :param repeat: number of timed runs
+    :param memory: run fn once more under tracemalloc
+    :param setup: function called before every run, not timed
+    :return: (result of the last run, {'seconds': fastest run, 'mean_seconds', 'peak_mb': None unless memory})
+    '''
+    timings = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+
+    peak_mb = None
+    if memory:
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            result = fn()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return (result, {'seconds': min(timings), 'mean_seconds': sum(timings) / len(timings), 'peak_mb': peak_mb})
+
+
+def prepare_data(workdir, n_rows, seed=0):
+    '''
+    return (prokaryotes.txt, taxdump.tar.gz) of n_rows rows in workdir, written only if missing
+    '''
+    data_path = os.path.join(workdir, 'rows-{}-seed-{}'.format(n_rows, seed))
+    source = os.path.join(data_path, 'prokaryotes.txt')
+    taxdump_file = os.path.join(data_path, 'taxdump.tar.gz')
+    if not (os.path.exists(source) and os.path.exists(taxdump_file)):
+        print('writing {:,} synthetic rows to {}...'.format(n_rows, data_path), file=sys.stderr)
+        write_synthetic(data_path, n_rows, seed)
+    return (source, taxdump_file)
+
+
+def run_scale(workdir, n_rows, repeat=3, memory=True, seed=0):
+    '''
+    Function to benchmark every stage on a synthetic prokaryotes.txt of n_rows rows
+    :return: a list of {'rows', 'stage', 'items', 'seconds', 'mean_seconds', 'items_per_second', 'peak_mb'}
+    '''
+    (source, taxdump_file) = prepare_data(workdir, n_rows, seed)
+    cache_path = tempfile.mkdtemp(prefix='cache-', dir=workdir)
+    ncbi_data = NCBIdata(cache_path=cache_path, url=source)
+    ncbi_data.taxdump_file = taxdump_file
+    results = []
+
+    def stage(name, fn, items, setup=None):
+        (result, metrics) = measure(fn, repeat, memory, setup)
+        n_items = items(result) if callable(items) else items
+        metrics.update({'rows': n_rows, 'stage': name, 'items': n_items, 'items_per_second': n_items / metrics['seconds'] if metrics['seconds'] else None})
+        results.append(metrics)
+        print('{:>9,} rows  {:<26} {:>9.3f} s  {:>12,.0f} items/s  {}'.format(
+            n_rows, name, metrics['seconds'], metrics['items_per_second'] or 0,
+            '' if metrics['peak_mb'] is None else '{:,.1f} MB'.format(metrics['peak_mb'])), file=sys.stderr)
+        return result
+
+    ## snapshot build
+    genome_df = stage('ingest', lambda: ncbi_data.read_complete_genomes(source, chunksize=ncbi_data.ingest_chunksize), n_rows)
+    genome_df = stage('count_chro_plas', lambda: ncbi_data.count_chro_plas(genome_df), len(genome_df))
+    stage('taxonomy', lambda: CompactTaxonomy.from_taxdump(taxdump_file), len)
+    ncbi_data.get_taxonomy()   # the compact taxonomy of making_final_df, loaded once per process
+    lineage_file = ncbi_data.lineage_store.path
+
+    def forget_lineages():
+        if os.path.exists(lineage_file):
+            os.remove(lineage_file)
+
+    final_df = stage('making_final_df', lambda: ncbi_data.making_final_df(genome_df), len(genome_df), setup=forget_lineages)
+    published = []
+
+    def forget_snapshot():
+        while published:
+            path = published.pop()
+            for filename in (path, path + '.stats.npz'):
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+    def publish_and_open():
+        published.append(ncbi_data.snapshots.publish(final_df.reset_index(drop=True)))
+        ncbi_data.open_snapshot()
+
+    stage('publish_and_open_snapshot', publish_and_open, len(final_df), setup=forget_snapshot)
+
+    ## queries of the dashboard
+    n_snapshot = ncbi_data.row_count()
+    genus = ncbi_data.rank_counts('genus')['genus'].iloc[0]   # the largest genus
+    (gc_min, gc_max) = ncbi_data.size_menus['GC%']['range']
+    filters = [
+        ('genus', [genus], []),
+        ('superkingdom', ['Bacteria'], []),
+        (None, [], [('GC%', gc_min + (gc_max - gc_min) / 4, gc_max - (gc_max - gc_min) / 4)]),
+        ('superkingdom', ['Bacteria'], [('Genome size (Mb)', 2.0, 6.0), ('Plasmid', 1, 100)]),
+    ]
+
+    def new_sessions():
+        ncbi_data.result_cache.clear()
+        sessions = []
+        for (rank, values, ranges) in filters:
+            session = ncbi_data.new_session()
+            if rank is not None:
+                session.set_rank_filter(rank, values)
+            for range_filter in ranges:
+                session.set_range_filter(*range_filter)
+            sessions.append(session)
+        return sessions
+
+    stage('apply_filter', lambda: [len(session.filtered_df) for session in new_sessions()], n_snapshot * len(filters))
+    full_df = ncbi_data.genome_df
+    stage('count_tableMaker_groupby', lambda: count_tableMaker_groupby('Genus', full_df), n_snapshot)
+
+    def rank_counts():
+        ncbi_data.rollup = RollupCube(ncbi_data.columns, ncbi_data.desired_ranks)
+        return [session.rank_counts(level) for session in new_sessions() for level in ['genus', 'species', 'TaxID']]
+
+    stage('rank_counts', rank_counts, n_snapshot * len(filters))
+
+    def chart_data():
+        for session in new_sessions():
+            session.year_counts()
+            session.correlation()
+            df = session.filtered_columns(['GC%', 'Genome size (Mb)'])
+            box_statistics(df['GC%'].to_numpy())
+            if len(df):
+                density_bins(df['Genome size (Mb)'], df['GC%'])
+
+    stage('chart_data', chart_data, n_snapshot * len(filters))
+    return results
+
+
+def compare(baseline, results, threshold=1.25):
+    '''
+    Function to compare results with a baseline of the same stages and scales
+    :param threshold: a stage regressed if it is this many times slower than in the baseline
+    :return: a list of (rows, stage, baseline seconds, seconds, ratio), and the regressed ones
+    '''
+    baseline_seconds = {(result['rows'], result['stage']): result['seconds'] for result in baseline['results']}
+    rows = []
+    for result in results['results']:
+        key = (result['rows'], result['stage'])
+        if key in baseline_seconds and baseline_seconds[key] > 0:
+            rows.append(key + (baseline_seconds[key], result['seconds'], result['seconds'] / baseline_seconds[key]))
+    return (rows, [row for row in rows if row[4] > threshold])
+
+
+def run(row_counts, workdir, repeat=3, memory=True, seed=0):
+    '''
+    Function to benchmark every scale
+    :return: {'version', 'created', 'python', 'platform', 'numpy', 'repeat', 'results'}
+    '''
+    set_cache_backend(NoCache())   # each run computes its result
+    try:
+        results = [result for n_rows in row_counts for result in run_scale(workdir, n_rows, repeat, memory, seed)]
+    finally:
+        set_cache_backend(None)
+    return {'version': RESULTS_VERSION, 'created': datetime.now().isoformat(), 'python': platform.python_version(),
+            'platform': platform.platform(), 'numpy': np.__version__, 'repeat': repeat, 'results': results}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='benchmark', description='Benchmark the CPGminer pipeline on synthetic data.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help='rows of prokaryotes.txt, e.g., 10000 2000000')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run of each stage')
+    parser.add_argument('--workdir', help='keep the synthetic files (and reuse them) in this directory')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='save the results as JSON')
+    parser.add_argument('--compare', help='results JSON of a previous run')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown reported as a regression by --compare')
+    return parser.parse_args(argv)
+
+
+def main(argv=None, stdout=None):
+    args = parse_args(argv)
+    stdout = stdout or sys.stdout
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = args.workdir or tmpdir
+        os.makedirs(workdir, exist_ok=True)
+        results = run(args.rows, workdir, args.repeat, not args.no_memory, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if not args.compare:
+        return 0
+
+    with open(args.compare) as f:
+        (rows, regressions) = compare(json.load(f), results, args.threshold)
+    for (n_rows, stage, baseline_seconds, seconds, ratio) in rows:
+        print('{:>9,} rows  {:<26} {:>9.3f} s -> {:>9.3f} s  x{:.2f}{}'.format(
+            n_rows, stage, baseline_seconds, seconds, ratio, '  REGRESSION' if ratio > args.threshold else ''), file=stdout)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def hash_arguments(func, signature, args, kwargs):
+    '''
+    Function to make the cache key of a call; as with st.cache_data, parameters starting with '_' are not hashed
+    :return: a hex digest
+    '''
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    digest = hashlib.sha1((func.__module__ + '.' + func.__qualname__).encode())
+    for name, value in bound.arguments.items():
+        if name.startswith('_'):
+            continue
+        digest.update(name.encode())
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            dtypes = value.dtypes if isinstance(value, pd.DataFrame) else pd.Series([value.dtype], index=[value.name])
+            digest.update(pickle.dumps((type(value).__name__, list(dtypes.index), [str(dtype) for dtype in dtypes])))
+            digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        else:
+            digest.update(pickle.dumps(value))
+    return digest.hexdigest()
+
+
+class CacheBackend:
+    '''
+    Interface of the cache used by the cached functions of ncbi.py
+    '''
+    def wrap(self, func):
+        '''
+        return func wrapped with this cache
+        '''
+        raise NotImplementedError
+
+
+class NoCache(CacheBackend):
+    def wrap(self, func):
+        return func
+
+
+class MemoryCache(CacheBackend):
+    '''
+    In-process cache of the most recent results; cached values are returned as is, not copied
+    '''
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+
+    def wrap(self, func):
+        signature = inspect.signature(func)
+        entries = OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = hash_arguments(func, signature, args, kwargs)
+            with lock:
+                if key in entries:
+                    entries.move_to_end(key)
+                    return entries[key]
+            value = func(*args, **kwargs)
+            with lock:
+                entries[key] = value
+                while len(entries) > self.max_entries:
+                    entries.popitem(last=False)
+            return value
+        return wrapper
+
+
+class DiskCache(CacheBackend):
+    '''
+    Cache of pickled results in a directory, shared by every process using the same directory
+    '''
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+
+    def wrap(self, func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            path = os.path.join(self.cache_path, hash_arguments(func, signature, args, kwargs) + '.pickle')
+            try:
+                with open(path, 'rb') as f:
+                    value = pickle.load(f)
+                os.utime(path)   # last use, for the least-recently-used eviction of CacheManager
+                return value
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+            value = func(*args, **kwargs)
+            os.makedirs(self.cache_path, exist_ok=True)
+            tmp_file = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(value, f)
+            os.replace(tmp_file, path)
+            return value
+        return wrapper
+
+
+class StreamlitCache(CacheBackend):
+    def __init__(self, persist='disk'):
+        self.persist = persist
+
+    def wrap(self, func):
+        import streamlit as st
+        return st.cache_data(persist=self.persist)(func)
+
+
+_backend = None
+
+
+def set_cache_backend(backend):
+    '''
+    Function to choose the cache of the cached functions, e.g., set_cache_backend(DiskCache('./cache/functions'))
+    :param backend: a CacheBackend, or None to go back to the default
+    '''
+    global _backend
+    _backend = backend
+
+
+def get_cache_backend():
+    '''
+    return the chosen backend; by default Streamlit's cache inside a Streamlit app and a MemoryCache elsewhere
+    '''
+    global _backend
+    if _backend is None:
+        # streamlit is only imported by the app, so a headless process never pays for importing it here
+        if 'streamlit' in sys.modules and sys.modules['streamlit'].runtime.exists():
+            _backend = StreamlitCache()
+        else:
+            _backend = MemoryCache()
+    return _backend
+
+
+def cache_data(func):
+    '''
+    Decorator caching func with the current backend; the backend is looked up on every call,
+    so it can be chosen after the module defining func was imported
+    '''
+    wrapped = {}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        backend = get_cache_backend()
+        cached_func = wrapped.get(id(backend))
+        if cached_func is None or cached_func[0] is not backend:
+            cached_func = wrapped[id(backend)] = (backend, backend.wrap(func))
+        return cached_func[1](*args, **kwargs)
+    return wrapper
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import re
+import time
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+## (category, pattern of the path relative to the cache directory) of every file the app writes, first match wins
+ARTIFACT_PATTERNS = [
+    ('temporary', r'\.(tmp|part)$'),   # files being written, and downloads in progress (or interrupted)
+    ('snapshot', r'^genome_df-[^/]*\.feather(\.stats\.npz)?$'),
+    ('state', r'^snapshot\.json$'),
+    ('intermediate', r'^(original|step\d+)\.feather$'),
+    ('lineage', r'^lineage\.feather$'),
+    ('taxonomy', r'^(taxdump\.tar\.gz|taxonomy(-ete3)?\.npz)$'),
+    ('history', r'^history/'),
+    ('functions', r'^functions/'),
+]
+
+## never evicted: the state of the snapshots, the compact history and the inputs of the next build;
+## unrecognized files ('other') are evicted as any other artifact
+PINNED_CATEGORIES = {'state', 'lineage', 'taxonomy', 'history'}
+
+
+def artifact_category(relative_path):
+    return next((category for (category, pattern) in ARTIFACT_PATTERNS if re.search(pattern, relative_path)), 'other')
+
+
+class CacheManager:
+    '''
+    Keeps the cache directory within a byte budget and an age budget.
+
+    Every file is classified by ARTIFACT_PATTERNS; a snapshot and its .stats.npz are one artifact. Artifacts are
+    evicted least recently used first (by modification time: DiskCache touches its files on a hit), except the
+    categories of PINNED_CATEGORIES, the keep_snapshots latest snapshots (the current one included) and
+    temporary files younger than temporary_age, which may belong to a build in progress.
+    '''
+    def __init__(self, cache_path, max_bytes=None, max_age=30 * 24 * 3600, keep_snapshots=1, temporary_age=24 * 3600, extra_paths=None):
+        '''
+        :param max_bytes: byte budget of the evictable artifacts and the pinned ones together; None for no budget
+        :param max_age: evict artifacts unused for this many seconds; None for no age budget
+        :param extra_paths: {category: directory} of other caches of the app, e.g., {'streamlit': '~/.streamlit/cache'};
+                            all their files are evictable
+        '''
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep_snapshots = keep_snapshots
+        self.temporary_age = temporary_age
+        self.extra_paths = dict(extra_paths or {})
+
+    def current_snapshot(self):
+        try:
+            with open(os.path.join(self.cache_path, 'snapshot.json')) as f:
+                return json.load(f).get('file')
+        except (OSError, ValueError):
+            return None
+
+    def walk(self, path):
+        for (dirpath, dirnames, filenames) in os.walk(path):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:   # removed meanwhile
+                    continue
+                yield (full_path, os.path.relpath(full_path, path).replace(os.sep, '/'), stat)
+
+    def artifacts(self, now=None):
+        '''
+        Function to list the artifacts of the cache directory and of extra_paths
+        :return: a list of {'key', 'category', 'paths', 'bytes', 'last_used', 'pinned'}, oldest first
+        '''
+        now = now or time.time()
+        artifacts = {}
+
+        def add(key, category, path, stat):
+            artifact = artifacts.setdefault(key, {'key': key, 'category': category, 'paths': [], 'bytes': 0, 'last_used': 0, 'pinned': category in PINNED_CATEGORIES})
+            artifact['paths'].append(path)
+            artifact['bytes'] += stat.st_size
+            artifact['last_used'] = max(artifact['last_used'], stat.st_mtime)
+
+        for (path, relative_path, stat) in self.walk(self.cache_path):
+            category = artifact_category(relative_path)
+            key = relative_path[:-len('.stats.npz')] if category == 'snapshot' and relative_path.endswith('.stats.npz') else relative_path
+            add(key, category, path, stat)
+        for (category, extra_path) in self.extra_paths.items():
+            for (path, relative_path, stat) in self.walk(os.path.expanduser(extra_path)):
+                add(category + ':' + relative_path, category, path, stat)
+
+        snapshots = sorted((artifact for artifact in artifacts.values() if artifact['category'] == 'snapshot'), key=lambda artifact: artifact['key'], reverse=True)
+        current = self.current_snapshot()
+        for (i, artifact) in enumerate(snapshots):
+            artifact['pinned'] = artifact['key'] == current or i < self.keep_snapshots
+        for artifact in artifacts.values():
+            if artifact['category'] == 'temporary' and now - artifact['last_used'] < self.temporary_age:
+                artifact['pinned'] = True
+        return sorted(artifacts.values(), key=lambda artifact: artifact['last_used'])
+
+    def usage(self, now=None):
+        '''
+        return a dataframe of the files, bytes (all and pinned) and last use of each category
+        '''
+        artifacts = pd.DataFrame(self.artifacts(now), columns=['key', 'category', 'paths', 'bytes', 'last_used', 'pinned'])
+        artifacts['files'] = artifacts['paths'].str.len()
+        artifacts['pinned_bytes'] = artifacts['bytes'].where(artifacts['pinned'], 0)
+        usage_df = artifacts.groupby('category').agg(files=('files', 'sum'), bytes=('bytes', 'sum'), pinned_bytes=('pinned_bytes', 'sum'),
+                                                    oldest=('last_used', 'min'), newest=('last_used', 'max'))
+        usage_df[['oldest', 'newest']] = usage_df[['oldest', 'newest']].apply(pd.to_datetime, unit='s')
+        return usage_df.sort_values('bytes', ascending=False)
+
+    def enforce(self, now=None, dry_run=False):
+        '''
+        Function to evict the artifacts older than max_age, then the least recently used ones until the cache
+        fits in max_bytes
+        :param dry_run: only list the artifacts that would be evicted
+        :return: the evicted artifacts
+        '''
+        now = now or time.time()
+        artifacts = self.artifacts(now)
+        total_bytes = sum(artifact['bytes'] for artifact in artifacts)
+        evicted = []
+        for artifact in artifacts:   # least recently used first
+            if artifact['pinned']:
+                continue
+            too_old = self.max_age is not None and now - artifact['last_used'] > self.max_age
+            too_large = self.max_bytes is not None and total_bytes > self.max_bytes
+            if not (too_old or too_large):
+                continue
+            if not dry_run and not self.remove(artifact):
+                continue
+            total_bytes -= artifact['bytes']
+            evicted.append(artifact)
+        return evicted
+
+    def remove(self, artifact):
+        '''
+        remove the files of an artifact; returns False if one of them could not be removed (e.g., still open on Windows)
+        '''
+        removed = True
+        for path in artifact['paths']:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning('cache file not evicted: %s', e)
+                removed = False
+        return removed
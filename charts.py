@@ -1,11 +1,20 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-from scipy import stats
-import plotly.express as px
-import seaborn as sns
 
+## plotly is imported by the functions drawing with it, on the first chart of a session
 
-@st.cache_data(persist="disk")  
+## the browser receives at most this many points per chart, however many genomes are selected
+MAX_BOX_OUTLIERS = 1000
+MAX_SCATTER_POINTS = 10000   # above it, a 2d scatter plot is drawn as a density of DENSITY_BINS x DENSITY_BINS bins
+DENSITY_BINS = 100
+MAX_SCATTER_3D_POINTS = 5000
+
+## charts are cached in memory only: they are cheap to redraw and keyed by whole dataframes
+CHART_CACHE_ENTRIES = 64
+
+
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES)
 def barchart_maker(dataframe, column_name):
     '''
     Function to make a input dataframe for barchart plotting of genomic data
@@ -14,9 +23,9 @@ def barchart_maker(dataframe, column_name):
     '''
     if column_name == 'Release Date':
         ## No. of genome per year
-        dataframe['Release Date'] = pd.to_datetime(dataframe['Release Date'])
-        dataframe['year'] = dataframe['Release Date'].dt.year   # extract year from date datatype
-        year_series = dataframe['year'].value_counts()    # count year values and save it to a Series dattype
+        ## the dataframe is shared between sessions, so the years are not stored in it
+        year = pd.to_datetime(dataframe['Release Date']).dt.year   # extract year from date datatype
+        year_series = year.value_counts()    # count year values and save it to a Series dattype
         year_df = pd.DataFrame({'Year': year_series.index, 'Count': year_series.values})
         year_index_df = year_df.set_index('Year')
         # st.bar_chart(year_index_df)
@@ -28,68 +37,129 @@ def barchart_maker(dataframe, column_name):
         column_index_df = column_name_df.set_index(column_name)
         return column_index_df
 
-@st.cache_data(persist="disk")
-def boxplot_maker(graph_choice, genome_dataframe):
-    
+def spread_sample(values, max_points):
     '''
-    Function to draw a boxplot of the genomic features selected
-    argument 1: graph_choice
-    argument 2: genome dataframe
+    return at most max_points of the values, spread evenly over their sorted order (the smallest and
+    the largest are always kept), so that the sample follows the distribution of the values
     '''
-    fig = px.box(genome_dataframe, y=graph_choice, points='all')
-    return fig
+    values = np.sort(values)
+    if len(values) <= max_points:
+        return values
+    return values[np.linspace(0, len(values) - 1, max_points).round().astype(np.int64)]
+
+
+def box_statistics(values, max_outliers=MAX_BOX_OUTLIERS):
+    '''
+    Function to compute a boxplot server-side, as plotly does from all the points (linear quartiles,
+    whiskers at the most extreme values within 1.5 IQR of the box)
+    :param values: numeric values; missing values are ignored
+    :param max_outliers: the outliers beyond the whiskers are sampled down to this many, in proportion
+                         to the number below and above the box
+    :return: dict of q1, median, q3, mean, lowerfence, upperfence, outliers (sampled), n_outliers (all) and count,
+             or None if there are no values
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return None
+
+    (q1, median, q3) = np.quantile(values, [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+    low = np.sort(values[values < inside.min()])
+    high = np.sort(values[values > inside.max()])
+    n_outliers = len(low) + len(high)
+    if n_outliers > max_outliers:
+        n_low = int(round(max_outliers * len(low) / n_outliers))
+        (low, high) = (spread_sample(low, n_low), spread_sample(high, max_outliers - n_low))
+    return {'q1': q1, 'median': median, 'q3': q3, 'mean': values.mean(),
+            'lowerfence': inside.min(), 'upperfence': inside.max(),
+            'outliers': np.concatenate([low, high]), 'n_outliers': n_outliers, 'count': len(values)}
+
+
+def linear_fit(x, y):
+    '''
+    Function to fit y = slope * x + intercept by least squares (closed form)
+    :return: (slope, intercept, R^2), or None if x does not vary
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    dx = x - x.mean()
+    dy = y - y.mean()
+    sxx = (dx * dx).sum()
+    if len(x) < 2 or sxx == 0:
+        return None
+    sxy = (dx * dy).sum()
+    syy = (dy * dy).sum()
+    slope = sxy / sxx
+    r2 = sxy * sxy / (sxx * syy) if syy > 0 else 1.0
+    return (slope, y.mean() - slope * x.mean(), r2)
+
 
-@st.cache_data(persist="disk")
-def scatterplot_maker(scatter_items_selected, genome_dataframe):
+def density_bins(x, y, bins=DENSITY_BINS):
+    '''
+    Function to count the points of a 2d scatter plot in bins x bins bins
+    :return: (x bin centers, y bin centers, counts indexed [y bin, x bin])
+    '''
+    (counts, x_edges, y_edges) = np.histogram2d(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), bins=bins)
+    return ((x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2, counts.T)
+
+
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES)
+def boxplot_maker(graph_choice, genome_dataframe, max_outliers=MAX_BOX_OUTLIERS):
+    
     '''
     Function to draw a boxplot of the genomic features selected
-    argument 1: scatter_items_selected (datatype: list)
+    argument 1: graph_choice
     argument 2: genome dataframe
+    argument 3: max_outliers, the number of outlier points drawn at most
     '''
-    
-    if len(scatter_items_selected) == 2:
-        fig = px.scatter(genome_dataframe, x=scatter_items_selected[0], y=scatter_items_selected[1], trendline='ols', trendline_color_override="red", color='superkingdom')
-        # fig = px.scatter(genome_dataframe, x=scatter_items_selected[0], y=scatter_items_selected[1])
-        # fig = sns.jointplot(data=genome_dataframe, x = scatter_items_selected[0], y = scatter_items_selected[1], kind='reg')
+    import plotly.graph_objects as go
+    box = box_statistics(genome_dataframe[graph_choice].to_numpy(), max_outliers)
+    fig = go.Figure()
+    if box is None:
         return fig
+    fig.add_trace(go.Box(name=graph_choice, x=[graph_choice], q1=[box['q1']], median=[box['median']], q3=[box['q3']],
+                         mean=[box['mean']], lowerfence=[box['lowerfence']], upperfence=[box['upperfence']]))
+    fig.add_trace(go.Scatter(name='outliers', x=[graph_choice] * len(box['outliers']), y=box['outliers'], mode='markers'))
+    if len(box['outliers']) < box['n_outliers']:
+        fig.update_layout(title='{:,} genomes ({:,} of {:,} outliers drawn)'.format(box['count'], len(box['outliers']), box['n_outliers']))
+    fig.update_layout(showlegend=False, yaxis_title=graph_choice)
+    return fig
 
-    elif len(scatter_items_selected) == 3:
-        fig = px.scatter_3d(genome_dataframe, x=scatter_items_selected[0], y=scatter_items_selected[1], z=scatter_items_selected[2], opacity=0.5)
-        return fig
-    
-@st.cache_data(persist="disk")
-def scatterplot_maker_3(scatter_items_selected, genome_dataframe):
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES)
+def scatterplot_maker(scatter_items_selected, genome_dataframe, max_points=MAX_SCATTER_POINTS):
     '''
-    Function to draw a boxplot of the genomic features selected
+    Function to draw a scatter plot of the genomic features selected
     argument 1: scatter_items_selected (datatype: list)
     argument 2: genome dataframe
+    argument 3: max_points, above it a 2d plot shows the density of the points and a 3d plot a sample of them
     '''
+    import plotly.express as px
+    import plotly.graph_objects as go
+    genome_dataframe = genome_dataframe.dropna(subset=scatter_items_selected)
     
     if len(scatter_items_selected) == 2:
-        # st.subheader(f'2d scatter plot of {scatter_items_selected[0]} and {scatter_items_selected[1]}')
-        # fig = px.scatter(genome_dataframe, x=scatter_items_selected[0], y=scatter_items_selected[1], trendline='ols', trendline_color_override="red", color='superkingdom')
-        # fig = px.scatter(genome_dataframe, x=scatter_items_selected[0], y=scatter_items_selected[1])
-
-        classes = genome_dataframe['superkingdom']
-        x = scatter_items_selected[0]
-        y = scatter_items_selected[1]
-        ## calculation of R2 value
-        slope, intercept, r_value, p_value, std_err = stats.linregress(genome_dataframe[x], genome_dataframe[y])
-        R2 = r_value ** 2
-        title = "y={0:.1f}x+{1:.1f} (R^2 value: {2:.2})".format(slope, intercept, R2)
-
-        # fig = sns.jointplot(data=genome_dataframe, x = scatter_items_selected[0], y = scatter_items_selected[1], kind='reg', ratio=7, height=7, scatter=False)
-        fig = sns.jointplot(data=genome_dataframe, x = scatter_items_selected[0], y = scatter_items_selected[1], kind='reg')
-        fig.ax_joint.scatter(x, y, c=classes)
-        fig.fig.suptitle(title)
-        fig.ax_joint.collections[0].set_alpha(1)
-        fig.fig.tight_layout()
-        fig.fig.subplots_adjust(top=0.95)
-        
+        (x, y) = scatter_items_selected
+        if len(genome_dataframe) <= max_points:
+            fig = px.scatter(genome_dataframe, x=x, y=y, color='superkingdom', render_mode='webgl')
+        else:
+            (x_centers, y_centers, counts) = density_bins(genome_dataframe[x], genome_dataframe[y])
+            fig = go.Figure(go.Heatmap(x=x_centers, y=y_centers, z=np.where(counts > 0, counts, np.nan),
+                                       colorscale='Viridis', colorbar={'title': 'Genomes'}))
+            fig.update_layout(xaxis_title=x, yaxis_title=y)
+
+        fit = linear_fit(genome_dataframe[x].to_numpy(), genome_dataframe[y].to_numpy())
+        if fit is not None:
+            (slope, intercept, r2) = fit
+            x_range = np.array([genome_dataframe[x].min(), genome_dataframe[x].max()], dtype=np.float64)
+            fig.add_trace(go.Scatter(x=x_range, y=slope * x_range + intercept, mode='lines', name='OLS trendline', line={'color': 'red'}))
+            fig.update_layout(title="y={0:.3g}x+{1:.3g} (R^2 value: {2:.2})".format(slope, intercept, r2))
         return fig
 
     elif len(scatter_items_selected) == 3:
-        # st.subheader(f'3d scatter plot of {scatter_items_selected[0]}, {scatter_items_selected[1]}, and {scatter_items_selected[2]}')
+        max_points = min(max_points, MAX_SCATTER_3D_POINTS)   # 3d plots are drawn with WebGL, but not binned
+        if len(genome_dataframe) > max_points:
+            genome_dataframe = genome_dataframe.sample(n=max_points, random_state=0)
         fig = px.scatter_3d(genome_dataframe, x=scatter_items_selected[0], y=scatter_items_selected[1], z=scatter_items_selected[2], opacity=0.5)
-        # st.plotly_chart(fig)
-        return fig
\ No newline at end of file
+        return fig
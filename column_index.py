@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+
+class ColumnIndex:
+    '''
+    Row-position indices of genome_df built once per snapshot: an inverted index (value -> rows) for each
+    taxonomic rank and a sorted order for each numeric column, so that a filter costs O(selected rows)
+    '''
+    def __init__(self, genome_df, rank_columns, numeric_columns):
+        self.n_rows = len(genome_df)
+        self.ranks = {}
+        self.numerics = {}
+
+        for col_name in rank_columns:
+            codes, uniques = pd.factorize(genome_df[col_name])
+            codes = codes.astype(np.int32)
+            order = np.argsort(codes, kind='stable').astype(np.int32)
+            order = order[np.count_nonzero(codes < 0):]   # missing values are never selected
+            offsets = np.zeros(len(uniques) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(codes[codes >= 0], minlength=len(uniques)), out=offsets[1:])
+            self.ranks[col_name] = {'values': pd.Index(uniques), 'codes': codes, 'order': order, 'offsets': offsets}
+
+        for col_name in numeric_columns:
+            self.add_numeric(col_name, genome_df[col_name])
+
+    def add_numeric(self, col_name, values):
+        '''
+        index one more numeric column (a Series or an array with one value per row)
+        '''
+        values = pd.Series(values) if not isinstance(values, pd.Series) else values
+        array = values.to_numpy()   # kept in the column's own dtype, without a copy
+        if array.dtype.kind not in 'iuf':
+            array = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        order = np.argsort(array, kind='stable').astype(np.int32)   # NaN sorts last and is never selected
+        self.numerics[col_name] = {'values': array, 'sorted': array[order], 'order': order}
+
+    def rank_codes(self, col_name, values):
+        codes = self.ranks[col_name]['values'].get_indexer(pd.Index(values))
+        return np.unique(codes[codes >= 0])
+
+    def rank_size(self, col_name, codes):
+        offsets = self.ranks[col_name]['offsets']
+        return int((offsets[codes + 1] - offsets[codes]).sum())
+
+    def rank_positions(self, col_name, codes):
+        rank = self.ranks[col_name]
+        return np.concatenate([rank['order'][rank['offsets'][c]:rank['offsets'][c + 1]] for c in codes] or [np.empty(0, dtype=np.int32)])
+
+    def range_bounds(self, col_name, min_v, max_v):
+        sorted_values = self.numerics[col_name]['sorted']
+        return (np.searchsorted(sorted_values, min_v, side='left'), np.searchsorted(sorted_values, max_v, side='right'))
+
+    def bound(self, col_name, v):
+        '''
+        return a range bound in the precision of a float column, so that e.g. 50.6 selects the float32 value shown as 50.6
+        '''
+        dtype = self.numerics[col_name]['values'].dtype
+        return dtype.type(v) if dtype.kind == 'f' else v
+
+    def select(self, rank_filter=None, ranges=(), any_ranges=()):
+        '''
+        Function to get the rows selected by a rank filter and numeric ranges
+        :param rank_filter: (rank column, values) or None
+        :param ranges: [(numeric column, min value, max value), ...], bounds included
+        :param any_ranges: [(numeric column, [(min value, max value), ...]), ...]: rows within any of the disjoint ranges
+        :return: sorted row positions
+        '''
+        # candidate sets are sized from the index alone; only the smallest one is materialized
+        candidates = []
+        if rank_filter is not None:
+            (col_name, values) = rank_filter
+            codes = self.rank_codes(col_name, values)
+            candidates.append((self.rank_size(col_name, codes), 'rank', col_name, codes))
+        for (col_name, min_v, max_v) in ranges:
+            (min_v, max_v) = (self.bound(col_name, min_v), self.bound(col_name, max_v))
+            (start, stop) = self.range_bounds(col_name, min_v, max_v)
+            candidates.append((max(stop - start, 0), 'range', col_name, (start, stop, min_v, max_v)))
+        for (col_name, col_ranges) in any_ranges:
+            bounds = [self.range_bounds(col_name, self.bound(col_name, min_v), self.bound(col_name, max_v)) for (min_v, max_v) in col_ranges]
+            candidates.append((sum(max(stop - start, 0) for (start, stop) in bounds), 'any', col_name, (bounds, sorted(col_ranges))))
+        if not candidates:
+            return np.arange(self.n_rows, dtype=np.int32)
+
+        candidates.sort(key=lambda candidate: candidate[0])
+        (size, kind, col_name, args) = candidates[0]
+        if kind == 'rank':
+            positions = self.rank_positions(col_name, args)
+        elif kind == 'any':
+            order = self.numerics[col_name]['order']
+            positions = np.concatenate([order[start:stop] for (start, stop) in args[0] if stop > start] or [np.empty(0, dtype=np.int32)])
+        else:
+            positions = self.numerics[col_name]['order'][args[0]:max(args[1], args[0])]
+
+        # the other filters are checked on the candidate rows only
+        for (size, kind, col_name, args) in candidates[1:]:
+            if len(positions) == 0:
+                break
+            if kind == 'rank':
+                selected_codes = np.zeros(len(self.ranks[col_name]['values']) + 1, dtype=bool)
+                selected_codes[args] = True   # code -1 (missing) maps to the last, unselected entry
+                positions = positions[selected_codes[self.ranks[col_name]['codes'][positions]]]
+            elif kind == 'any':
+                values = self.numerics[col_name]['values'][positions]
+                min_values = np.array([self.bound(col_name, min_v) for (min_v, max_v) in args[1]])
+                max_values = np.array([self.bound(col_name, max_v) for (min_v, max_v) in args[1]])
+                i = np.searchsorted(min_values, values, side='right') - 1   # the last range starting at or below each value
+                positions = positions[(i >= 0) & (values <= max_values[np.maximum(i, 0)])]
+            else:
+                values = self.numerics[col_name]['values'][positions]
+                positions = positions[(values >= args[2]) & (values <= args[3])]
+
+        return np.sort(positions)
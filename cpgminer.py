@@ -0,0 +1,222 @@
+'''
+Headless entry point of CPGminer: build snapshots on a scheduler and query them without Streamlit.
+
+    python -m cpgminer build --cache ./cache
+    python -m cpgminer query --rank genus --values Escherichia --range 'GC%' 50 60 --count-by species
+    python -m cpgminer export --rank phylum --values Firmicutes --output firmicutes.tsv.gz
+    python -m cpgminer cache --max-bytes 5G --max-age-days 30
+    python -m cpgminer --metrics metrics.json build --cache ./cache
+
+The same functions can be used from Python:
+
+    ncbi_data = cpgminer.open_snapshot('./cache')
+    genome_df = cpgminer.select(ncbi_data, rank='genus', values=['Escherichia'], ranges={'GC%': (50, 60)})
+'''
+import argparse
+import logging
+import os
+import sys
+
+from cache_backend import DiskCache, NoCache, set_cache_backend
+from cache_manager import CacheManager
+from export import EXPORT_FORMATS, format_of, write_export
+from metrics import StageMetrics, configure_from_environment, set_metrics, write_metrics
+from ncbi import NCBIdata
+
+DEFAULT_URL = 'https://ftp.ncbi.nlm.nih.gov/genomes/GENOME_REPORTS/prokaryotes.txt'
+
+
+def new_ncbi_data(cache_path='./cache', url=DEFAULT_URL, taxdb_file=None, taxdump_file=None):
+    ncbi_data = NCBIdata(cache_path=cache_path, url=url)
+    ncbi_data.taxdb_file = taxdb_file
+    if taxdump_file is not None:
+        ncbi_data.taxdump_file = taxdump_file
+    return ncbi_data
+
+
+def build(cache_path='./cache', url=DEFAULT_URL, taxdb_file=None, force=False, workers=1, taxdump_file=None):
+    '''
+    Function to build a new snapshot if the source changed since the last one
+    :param taxdb_file: resolve lineages with this ete3 taxa.sqlite instead of the compact taxonomy
+    :param force: rebuild even if the source is unchanged
+    :param workers: number of processes resolving lineages with ete3; None uses one per CPU
+    :param taxdump_file: taxdump.tar.gz of the compact taxonomy (default: <cache_path>/taxdump.tar.gz)
+    :return: True if a new snapshot was swapped in
+    '''
+    ncbi_data = new_ncbi_data(cache_path, url, taxdb_file, taxdump_file)
+    ncbi_data.lineage_workers = workers
+    if force:
+        state = ncbi_data.snapshots.read_state()
+        state['source'] = {}
+        ncbi_data.snapshots.write_state(state)
+    return ncbi_data.snapshots.rebuild(ncbi_data.load_from_ncbi)
+
+
+def open_snapshot(cache_path='./cache', taxdb_file=None, taxdump_file=None):
+    '''
+    Function to load the current snapshot without contacting NCBI
+    :param taxdb_file, taxdump_file: the taxonomy of clade filters, as for build
+    :return: NCBIdata
+    '''
+    ncbi_data = new_ncbi_data(cache_path, taxdb_file=taxdb_file, taxdump_file=taxdump_file)
+    if not ncbi_data.open_snapshot():
+        raise FileNotFoundError('no snapshot in {}; run "python -m cpgminer build" first'.format(cache_path))
+    return ncbi_data
+
+
+def select(ncbi_data, rank=None, values=(), ranges=None, columns=None, clades=()):
+    '''
+    Function to apply the filters of the dashboard sidebar
+    :param rank: 'TaxID' or a taxonomic rank, e.g., 'genus'
+    :param values: selected values of the rank
+    :param ranges: {column name: (min, max)}, e.g., {'GC%': (50, 60)}
+    :param clades: keep the genomes under these taxa (TaxIDs or scientific names), at any depth
+    :param columns: return only these columns
+    :return: a dataframe of the selected genomes
+    '''
+    if rank is not None:
+        ncbi_data.set_rank_filter(rank, values)
+    for col_name, (min_v, max_v) in (ranges or {}).items():
+        ncbi_data.set_range_filter(col_name, min_v, max_v)
+    if clades:
+        ncbi_data.set_clade_filter(clades)
+    if columns is not None:
+        return ncbi_data.filtered_columns(list(columns))
+    return ncbi_data.filtered_df
+
+
+def count_by(ncbi_data, rank):
+    '''
+    Function to count the selected genomes per TaxID or taxonomic group, as in "Distribution by Taxonomic Groups"
+    :param rank: 'TaxID' or a taxonomic rank, e.g., 'genus' (grouped by superkingdom, ..., genus)
+    :return: a dataframe sorted by count
+    '''
+    return ncbi_data.rank_counts(rank)
+
+
+def clean_cache(cache_path='./cache', max_bytes=None, max_age_days=30, keep_snapshots=1, dry_run=False):
+    '''
+    Function to evict the artifacts of the cache directory over budget
+    :param max_bytes: byte budget of the cache directory, None for no budget
+    :param max_age_days: evict artifacts unused for this many days, None for no age budget
+    :param keep_snapshots: number of latest snapshots never evicted
+    :param dry_run: only list the artifacts that would be evicted
+    :return: (usage before eviction, see CacheManager.usage; the evicted artifacts)
+    '''
+    manager = CacheManager(cache_path, max_bytes=max_bytes, max_age=max_age_days * 24 * 3600 if max_age_days is not None else None,
+                           keep_snapshots=keep_snapshots)
+    return (manager.usage(), manager.enforce(dry_run=dry_run))
+
+
+def parse_size(text):
+    '''
+    return a number of bytes from e.g. '500M' or '5G'
+    '''
+    units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def add_filter_arguments(parser):
+    parser.add_argument('--cache', default='./cache', help='directory of the snapshots')
+    parser.add_argument('--rank', help="'TaxID' or a taxonomic rank, e.g., genus")
+    parser.add_argument('--values', nargs='*', default=[], help='selected values of --rank')
+    parser.add_argument('--range', nargs=3, action='append', default=[], metavar=('COLUMN', 'MIN', 'MAX'),
+                        help="keep genomes with MIN <= COLUMN <= MAX, e.g., --range 'GC%%' 50 60")
+    parser.add_argument('--clade', nargs='*', default=[], help='keep the genomes under these TaxIDs or scientific names')
+    parser.add_argument('--taxdump', help='taxonomy of --clade, as for build')
+    parser.add_argument('--taxdb', help='taxonomy of --clade, as for build')
+    parser.add_argument('--columns', nargs='*', help='output only these columns')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='cpgminer', description='Build and query CPGminer snapshots without the dashboard.')
+    parser.add_argument('--cache-backend', choices=['memory', 'disk', 'none'], default='memory',
+                        help='cache of the lineage and table functions (disk: <cache>/functions)')
+    parser.add_argument('--metrics', help='write the time, rows and memory of every stage to this file (.prom: Prometheus text, else JSON)')
+    parser.add_argument('--metrics-memory', action='store_true', help='also trace the peak memory of every stage (slower)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='build a new snapshot if prokaryotes.txt changed')
+    build_parser.add_argument('--cache', default='./cache', help='directory of the snapshots')
+    build_parser.add_argument('--url', default=DEFAULT_URL, help='url or local path of prokaryotes.txt')
+    build_parser.add_argument('--taxdump', help='taxdump.tar.gz or an unpacked taxdump directory (default: <cache>/taxdump.tar.gz, downloaded if missing)')
+    build_parser.add_argument('--taxdb', help='resolve lineages with this ete3 taxa.sqlite instead of the taxdump')
+    build_parser.add_argument('--force', action='store_true', help='rebuild even if the source is unchanged')
+    build_parser.add_argument('--workers', type=int, default=1, help='processes resolving lineages with --taxdb (0: one per CPU)')
+
+    query_parser = commands.add_parser('query', help='write the selected genomes or their counts to stdout (tsv)')
+    add_filter_arguments(query_parser)
+    query_parser.add_argument('--count-by', help="count the selected genomes per 'TaxID' or taxonomic rank")
+    query_parser.add_argument('--limit', type=int, help='write at most this many rows')
+
+    export_parser = commands.add_parser('export', help='write the selected genomes to a file')
+    add_filter_arguments(export_parser)
+    export_parser.add_argument('--output', required=True, help='output file')
+    export_parser.add_argument('--format', choices=list(EXPORT_FORMATS), help='default: the extension of --output, else csv')
+
+    cache_parser = commands.add_parser('cache', help='report the usage of the cache directory and evict what is over budget')
+    cache_parser.add_argument('--cache', default='./cache', help='directory of the snapshots')
+    cache_parser.add_argument('--max-bytes', type=parse_size, help='byte budget, e.g., 5G (default: none)')
+    cache_parser.add_argument('--max-age-days', type=float, default=30, help='evict artifacts unused for this many days')
+    cache_parser.add_argument('--keep-snapshots', type=int, default=1, help='number of latest snapshots never evicted')
+    cache_parser.add_argument('--dry-run', action='store_true', help='only list what would be evicted')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None, stdout=None):
+    args = parse_args(argv)
+    stdout = stdout or sys.stdout
+
+    if args.cache_backend == 'disk':
+        set_cache_backend(DiskCache(os.path.join(args.cache, 'functions')))
+    elif args.cache_backend == 'none':
+        set_cache_backend(NoCache())
+
+    if args.metrics:
+        set_metrics(StageMetrics(args.metrics, memory=args.metrics_memory))
+    else:
+        configure_from_environment()
+    try:
+        return run_command(args, stdout)
+    finally:
+        write_metrics()
+        if args.metrics:
+            set_metrics(None)
+
+
+def run_command(args, stdout):
+    if args.command == 'build':
+        rebuilt = build(args.cache, args.url, args.taxdb, args.force, args.workers or None, args.taxdump)
+        print('new snapshot built' if rebuilt else 'snapshot is up to date', file=stdout)
+        return 0
+
+    if args.command == 'cache':
+        (usage_df, evicted) = clean_cache(args.cache, args.max_bytes, args.max_age_days, args.keep_snapshots, args.dry_run)
+        usage_df.to_csv(stdout, sep='\t')
+        for artifact in evicted:
+            print('{} {} ({:,} bytes)'.format('would evict' if args.dry_run else 'evicted', artifact['key'], artifact['bytes']), file=stdout)
+        return 0
+
+    ncbi_data = open_snapshot(args.cache, args.taxdb, args.taxdump)
+    ranges = {col_name: (float(min_v), float(max_v)) for col_name, min_v, max_v in args.range}
+    genome_df = select(ncbi_data, args.rank, args.values, ranges, args.columns, args.clade)
+
+    if args.command == 'query':
+        if args.count_by:
+            genome_df = count_by(ncbi_data, args.count_by)
+        if args.limit is not None:
+            genome_df = genome_df.head(args.limit)
+        genome_df.to_csv(stdout, sep='\t', index=False)
+    else:
+        write_export(genome_df, args.output, args.format or format_of(args.output))
+        print('{} genomes written to {}'.format(len(genome_df), args.output), file=stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')   # progress of builds, on stderr
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import io
+import tempfile
+import zlib
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+## file format -> (field separator or None for parquet, gzip'd, mime type)
+EXPORT_FORMATS = {
+    'csv.gz': (',', True, 'application/gzip'),
+    'tsv.gz': ('\t', True, 'application/gzip'),
+    'parquet': (None, False, 'application/vnd.apache.parquet'),
+    'csv': (',', False, 'text/csv'),
+    'tsv': ('\t', False, 'text/tab-separated-values'),
+}
+
+
+def format_of(filename, default='csv'):
+    '''
+    return the export format of a file name from its extension, e.g., 'tsv.gz' for genome.tsv.gz
+    '''
+    return next((file_format for file_format in EXPORT_FORMATS if filename.endswith('.' + file_format)), default)
+
+
+def iter_text_chunks(df, sep, chunk_rows):
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(sep=sep, index=False, header=(start == 0)).encode()
+
+
+def iter_parquet_chunks(df, chunk_rows):
+    sink = io.BytesIO()
+    writer = None
+    for start in range(0, max(len(df), 1), chunk_rows):
+        table = pa.Table.from_pandas(df.iloc[start:start + chunk_rows], preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema, compression='zstd')
+        writer.write_table(table)   # one row group per chunk
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
+
+
+def iter_export(df, file_format, chunk_rows=50000):
+    '''
+    Function to serialize a dataframe chunk by chunk, so that only one chunk is held in memory at a time
+    :param df: dataframe to export (its index is not exported)
+    :param file_format: one of EXPORT_FORMATS
+    :param chunk_rows: rows serialized at a time
+    :return: an iterator of bytes
+    '''
+    (sep, gzipped, mime) = EXPORT_FORMATS[file_format]
+    chunks = iter_parquet_chunks(df, chunk_rows) if sep is None else iter_text_chunks(df, sep, chunk_rows)
+    if not gzipped:
+        yield from chunks
+        return
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)   # gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def write_export(df, output, file_format, chunk_rows=50000):
+    '''
+    Function to write a dataframe to a path or a binary file
+    :return: number of bytes written
+    '''
+    f = open(output, 'wb') if isinstance(output, str) else output
+    try:
+        size = 0
+        for chunk in iter_export(df, file_format, chunk_rows):
+            f.write(chunk)
+            size += len(chunk)
+        return size
+    finally:
+        if isinstance(output, str):
+            f.close()
+
+
+def export_file(df, file_format, chunk_rows=50000, max_memory=8 * 1024 * 1024):
+    '''
+    Function to export a dataframe to a temporary file, kept in memory while smaller than max_memory
+    :return: the file, positioned at its start
+    '''
+    f = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    write_export(df, f, file_format, chunk_rows)
+    f.seek(0)
+    return f
@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+## the column identifying a genome from one snapshot to the next (one assembly per FTP path)
+HISTORY_KEY = 'Genome download (FTP Path)'
+
+## kinds of row changes stored in the Change column of a delta
+ADDED, CHANGED, REMOVED = 'added', 'changed', 'removed'
+
+
+def row_hashes(genome_df, columns):
+    return pd.util.hash_pandas_object(genome_df[columns], index=False).to_numpy()
+
+
+class SnapshotHistory:
+    '''
+    History of the published snapshots as row-level deltas keyed by HISTORY_KEY, in <cache_path>/history:
+
+    - history.json lists the versions in order with their build time and number of rows added, changed and removed
+    - delta-<version>.feather holds the rows added or changed by a version (with their new values) and the rows
+      it removed (with their last values), in a Change column; the first version is all added rows
+    - full-<version>.feather is a complete table, written every keyframe_interval versions, so that
+      reconstructing a version applies at most keyframe_interval - 1 deltas
+    - hashes-<version>.feather holds the key and a hash of every row of the latest version, to find the changed
+      rows of the next version without reconstructing its table
+    '''
+    def __init__(self, path, key=HISTORY_KEY, keyframe_interval=30):
+        self.path = path
+        self.key = key
+        self.keyframe_interval = keyframe_interval
+        self.manifest_file = os.path.join(path, 'history.json')
+        self.lock = threading.Lock()
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'versions': []}
+
+    def write_manifest(self, manifest):
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_file, self.manifest_file)
+
+    def versions(self):
+        '''
+        return the recorded versions, oldest first: [{'version', 'built', 'rows', 'added', 'changed', 'removed', 'full'}, ...]
+        '''
+        return self.read_manifest()['versions']
+
+    def summary(self):
+        '''
+        return a dataframe of the recorded versions, indexed by build time, read from the manifest only
+        '''
+        summary_df = pd.DataFrame(self.versions(), columns=['version', 'built', 'rows', 'added', 'changed', 'removed'])
+        summary_df['built'] = pd.to_datetime(summary_df['built'])
+        return summary_df.set_index('built')
+
+    def keyed(self, genome_df):
+        '''
+        return genome_df without its positional 'index' column and with unique keys (repeated keys get a #n suffix)
+        '''
+        genome_df = genome_df.drop(columns=['index'], errors='ignore').reset_index(drop=True)
+        repeat = genome_df.groupby(self.key, sort=False, observed=True).cumcount()
+        if repeat.any():
+            genome_df[self.key] = genome_df[self.key].where(repeat == 0, genome_df[self.key] + '#' + repeat.astype(str))
+        return genome_df
+
+    def record(self, genome_df, version, built=None):
+        '''
+        Function to record a published snapshot as a delta from the previous version
+        :param genome_df: the snapshot
+        :param version: name of the version, e.g., the snapshot file name
+        :param built: build time (datetime), default now
+        :return: the manifest entry of the version
+        '''
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            manifest = self.read_manifest()
+            genome_df = self.keyed(genome_df)
+            columns = list(genome_df.columns)
+            hashes = pd.DataFrame({'key': genome_df[self.key].to_numpy(), 'hash': row_hashes(genome_df, columns)})
+
+            last_version = manifest['versions'][-1]['version'] if manifest['versions'] else None
+            if last_version is not None:
+                old_hashes = self.read_hashes(last_version, manifest)
+                merged = hashes.merge(old_hashes, on='key', how='outer', suffixes=('', '_old'), indicator=True)
+                added = genome_df[genome_df[self.key].isin(merged.loc[merged['_merge'] == 'left_only', 'key'])]
+                changed_keys = merged.loc[(merged['_merge'] == 'both') & (merged['hash'] != merged['hash_old']), 'key']
+                changed = genome_df[genome_df[self.key].isin(changed_keys)]
+                removed_keys = merged.loc[merged['_merge'] == 'right_only', 'key']
+                removed = self.table(last_version, keys=removed_keys, manifest=manifest) if len(removed_keys) else genome_df.iloc[:0]
+            else:
+                (added, changed, removed) = (genome_df, genome_df.iloc[:0], genome_df.iloc[:0])
+
+            delta = pd.concat([added.assign(Change=ADDED), changed.assign(Change=CHANGED), removed[columns].assign(Change=REMOVED)], ignore_index=True)
+            delta.to_feather(os.path.join(self.path, 'delta-{}.feather'.format(version)), compression='zstd')
+            full = len(manifest['versions']) % self.keyframe_interval == 0
+            if full:
+                genome_df.to_feather(os.path.join(self.path, 'full-{}.feather'.format(version)), compression='zstd')
+            hashes.to_feather(self.hashes_file(version))
+
+            entry = {'version': version, 'built': (built or datetime.now()).isoformat(), 'rows': len(genome_df),
+                     'added': len(added), 'changed': len(changed), 'removed': len(removed), 'full': full}
+            manifest['versions'].append(entry)
+            self.write_manifest(manifest)
+            if last_version is not None and os.path.exists(self.hashes_file(last_version)):
+                os.remove(self.hashes_file(last_version))
+            return entry
+
+    def hashes_file(self, version):
+        return os.path.join(self.path, 'hashes-{}.feather'.format(version))
+
+    def read_hashes(self, version, manifest=None):
+        '''
+        return the key and row hash of every row of a version, from its hashes file or its reconstructed table
+        '''
+        if os.path.exists(self.hashes_file(version)):
+            return pd.read_feather(self.hashes_file(version))
+        genome_df = self.table(version, manifest=manifest)
+        return pd.DataFrame({'key': genome_df[self.key].to_numpy(), 'hash': row_hashes(genome_df, list(genome_df.columns))})
+
+    def position(self, version, manifest=None):
+        versions = [entry['version'] for entry in (manifest or self.read_manifest())['versions']]
+        if version not in versions:
+            raise KeyError('version not in the history: {}'.format(version))
+        return versions.index(version)
+
+    def version_at(self, when):
+        '''
+        return the last version built at or before when (a datetime, or a date for the end of that day), or None
+        '''
+        if not isinstance(when, datetime):
+            when = datetime(when.year, when.month, when.day, 23, 59, 59, 999999)
+        built = [entry for entry in self.versions() if datetime.fromisoformat(entry['built']) <= when]
+        return built[-1]['version'] if built else None
+
+    def read_delta(self, version, columns=None):
+        return pd.read_feather(os.path.join(self.path, 'delta-{}.feather'.format(version)), columns=columns)
+
+    def table(self, version, keys=None, manifest=None):
+        '''
+        Function to reconstruct the table of a version from the last keyframe at or before it and the deltas after it
+        :param keys: reconstruct only the rows of these keys
+        :return: a dataframe in key order, without the 'index' column of the snapshot
+        '''
+        manifest = manifest or self.read_manifest()
+        versions = manifest['versions']
+        end = self.position(version, manifest)
+        start = max(i for i in range(end + 1) if versions[i]['full'])
+        genome_df = pd.read_feather(os.path.join(self.path, 'full-{}.feather'.format(versions[start]['version'])))
+        categories = {col_name: 'category' for (col_name, dtype) in genome_df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)}
+        if keys is not None:
+            keys = pd.Index(keys)
+            genome_df = genome_df[genome_df[self.key].isin(keys)]
+
+        for entry in versions[start + 1:end + 1]:
+            delta = self.read_delta(entry['version'])
+            if keys is not None:
+                delta = delta[delta[self.key].isin(keys)]
+            genome_df = genome_df[~genome_df[self.key].isin(delta[self.key])]
+            rows = delta[delta['Change'] != REMOVED].drop(columns=['Change'])
+            genome_df = pd.concat([genome_df, rows], ignore_index=True)
+        # concatenated categories of different deltas fall back to object
+        return genome_df.astype(categories).sort_values(self.key, kind='stable').reset_index(drop=True)
+
+    def diff(self, old_version, new_version=None):
+        '''
+        Function to find the genomes added, changed or removed between two versions from the deltas between them
+        :param old_version: the older version
+        :param new_version: the newer version, default the latest
+        :return: a dataframe of the rows of the new version that were added or changed and of the last values of the
+                 removed rows, with a Change column; empty if the versions are the same
+        '''
+        manifest = self.read_manifest()
+        versions = manifest['versions']
+        new_version = new_version or versions[-1]['version']
+        (start, end) = (self.position(old_version, manifest), self.position(new_version, manifest))
+        if start > end:
+            raise ValueError('{} is newer than {}'.format(old_version, new_version))
+        deltas = [self.read_delta(entry['version']) for entry in versions[start + 1:end + 1]]
+        if not deltas:
+            return self.read_delta(versions[start]['version']).iloc[:0]
+
+        changes = pd.concat(deltas, ignore_index=True)
+        first_change = changes.groupby(self.key, sort=False)['Change'].transform('first')
+        existed = (first_change != ADDED).to_numpy()   # rows of keys that were in the old version
+        last = changes.groupby(self.key, sort=False).tail(1)
+        existed = existed[last.index]
+        exists = (last['Change'] != REMOVED).to_numpy()
+        change = np.select([existed & exists, ~existed & exists, existed & ~exists], [CHANGED, ADDED, REMOVED], default='')
+        result = last.assign(Change=change)
+        return result[result['Change'] != ''].sort_values(['Change', self.key]).reset_index(drop=True)
@@ -1,18 +1,15 @@
-from numpy.lib.function_base import select
 import streamlit as st
+from streamlit.file_util import get_streamlit_file_path
 import pandas as pd
-from ncbi import NCBIdata, download_link, count_tableMaker_groupby
-from datetime import date
-import base64
-import matplotlib.pyplot as plt
-import seaborn as sns
+from ncbi import NCBIdata
+from export import EXPORT_FORMATS, export_file
+from metrics import configure_from_environment, get_metrics, stage, write_metrics
+from datetime import datetime
 
 
-from charts import barchart_maker, boxplot_maker, scatterplot_maker, scatterplot_maker_3
+from charts import boxplot_maker, scatterplot_maker
 
 def create_sidebar(ncbi_data):
-    print('sidebar rendering started...')
-
     st.sidebar.image('./images/CPGlogo1.png')
 
     # Taxonomic Ranks
@@ -26,6 +23,10 @@ def create_sidebar(ncbi_data):
     
     subitems_selected = st.sidebar.multiselect(f'Select a {selected_text}', ncbi_data.tax_items[selected_text])
     ncbi_data.setFilter(first_menu, {'menu':selected_text, 'values': subitems_selected})
+
+    # Clade: every genome under the given taxa, at any depth of the taxonomy
+    clade_text = st.sidebar.text_input('Clade (TaxIDs or scientific names, comma separated)')
+    ncbi_data.set_clade_filter([taxon.strip() for taxon in clade_text.split(',') if taxon.strip()])
         
     # Genome Features
     # second_menu = 'Genome Features'
@@ -58,53 +59,115 @@ def create_sidebar(ncbi_data):
     
     # clicked = st.sidebar.button('Apply')
 
-    print('sidebar rendering complete.')
     # return clicked
     
 
-# @st.cache(allow_output_mutation=True) 
+@st.cache_resource(max_entries=2)
+def load_shared_data(snapshot_version):
+    '''
+    Function to load a snapshot once per process; every session reads the same copy
+    argument: snapshot_version (the cache key, loaded again only when a new snapshot is swapped in)
+    '''
+    ncbi_data = NCBIdata()
+    ncbi_data.open_snapshot()
+    return ncbi_data
+
 def initialize_data():
     pd.set_option('mode.chained_assignment', None)
 
-    ncbi_data = NCBIdata()
-    ncbi_df = ncbi_data.load()
+    # build the first snapshot, or revalidate the current one in the background
+    loader = NCBIdata()
+    # Streamlit's disk cache of the lineage functions is evicted with the cache directory
+    loader.cache_manager.extra_paths['streamlit'] = get_streamlit_file_path('cache')
+    loader.snapshots.refresh(loader.load_from_ncbi)
+
+    ncbi_data = load_shared_data(loader.snapshots.version()).new_session()
 
     return ncbi_data
 
+def export_button(df, basename, key, file_format=None, label='Prepare download'):
+    '''
+    Function to offer a dataframe for download; the file is only generated when the user asks for it
+    argument: df (a dataframe, or a function returning it, called only when the user asks for the file)
+    argument: basename (file name without extension)
+    argument: key (unique key of the widgets)
+    argument: file_format (one of EXPORT_FORMATS; None lets the user choose)
+    '''
+    if file_format is None:
+        file_format = st.selectbox('Format', list(EXPORT_FORMATS), key=key + '_format')
+    if st.button(label, key=key + '_prepare'):
+        with st.spinner('Preparing {}.{}...'.format(basename, file_format)):
+            # download_button takes bytes, not the spooled file
+            with export_file(df() if callable(df) else df, file_format) as f:
+                data = f.read()
+        st.download_button('Download ({})'.format(file_format), data, file_name='{}.{}'.format(basename, file_format),
+                           mime=EXPORT_FORMATS[file_format][2], key=key + '_download')
+
+## rows per page of the results table; only the rows of the visible page are converted and sent to the browser
+PAGE_SIZES = [25, 100, 500, 1000]
+SNAPSHOT_ORDER = '(snapshot order)'
+
+def paginated_table(ncbi_data, key):
+    '''
+    Function to display one page of the selected genomes, sorted on the server by any column
+    argument: key (unique key of the widgets)
+    return: (number of selected genomes, number of columns), counted without converting the selection
+    '''
+    total = ncbi_data.selected_count()
+    col_names = ncbi_data.display_columns()
+    col1, col2, col3, col4 = st.columns([3, 2, 2, 2])
+    sort_by = col1.selectbox('Sort by', [SNAPSHOT_ORDER] + col_names, key=key + '_sort')
+    order = col2.selectbox('Order', ['Ascending', 'Descending'], key=key + '_order')
+    page_size = col3.selectbox('Rows per page', PAGE_SIZES, key=key + '_page_size')
+    n_pages = max(1, -(-total // page_size))
+    if st.session_state.get(key + '_page', 1) > n_pages:   # the selection shrank below the page shown
+        st.session_state[key + '_page'] = n_pages
+    page = int(col4.number_input('Page (of {:,})'.format(n_pages), min_value=1, max_value=n_pages, step=1, key=key + '_page'))
+
+    start = (page - 1) * page_size
+    page_df = ncbi_data.page(start, page_size, None if sort_by == SNAPSHOT_ORDER else sort_by, order == 'Ascending')
+    st.dataframe(page_df)
+    st.caption('rows {:,}-{:,} of {:,}'.format(min(start + 1, total), start + len(page_df), total))
+    return (total, len(col_names))
+
 def display_filters(ncbi_data):
     st.header('Selected Complete Genomes')
     for title, filter in ncbi_data.filters.items():
         if title == 'Taxonomic Ranks':
             if filter['values']: 
                 filter_menu = filter['menu']
-                filter_values = str(', '.join(filter['values']))
+                filter_values = str(', '.join(map(str, filter['values'])))
                 st.markdown(f'**{filter_menu}** : {filter_values}')
+        elif title == 'Clade':
+            if filter['values']:
+                st.markdown(f"**Clade** : {', '.join(map(str, filter['values']))}")
         elif 'checked' in filter and filter['checked']:
             filter_values = str(filter['values'][0]) + ' - ' + str(filter['values'][1])
             st.markdown(f"**{filter['menu']}**: {filter_values}")
     
-    st.dataframe(data=ncbi_data.filtered_df)
+    (n_rows, n_columns) = paginated_table(ncbi_data, 'genome_table')
         
     col1, col2 = st.columns(2)
     with col1:
-        st.write(ncbi_data.filtered_df.shape[0], 'rows x', ncbi_data.filtered_df.shape[1], 'columns')
+        st.write(n_rows, 'rows x', n_columns, 'columns')
     with col2:
-        tmp_download_link = download_link(ncbi_data.filtered_df, 'genome.csv', 'Download (csv)')
-        st.markdown(tmp_download_link, unsafe_allow_html=True)
+        export_button(lambda: ncbi_data.filtered_df, 'genome', 'genome_export')
     
 
-def analysis_num_submission(ncbi_df):
+def analysis_num_submission(ncbi_data):
     ## Data 1:
     st.header('Number of Submissions to NCBI')
-    year_index_df = barchart_maker(ncbi_df, 'Release Date')
+    year_index_df = ncbi_data.year_counts()
     
     st.bar_chart(year_index_df)
 
-def analysis_descriptive(ncbi_df):
+def analysis_descriptive(ncbi_data):
     ## Data 2: Descriptive statistics of genomes
     st.header('Box plot')
     graph_menu = ['Genome size (Mb)', 'GC%', 'Number of Chromosomes', 'Number of Plasmids', 'Number of Genes', 'Number of Proteins']
     graph_choice = st.selectbox('Select one', graph_menu, key = 'descriptive_selectbox', index = 0)
+    col_names = {'Number of Chromosomes': 'Chromosome', 'Number of Plasmids': 'Plasmid', 'Number of Genes': 'Genes', 'Number of Proteins': 'Proteins'}
+    ncbi_df = ncbi_data.filtered_columns([col_names.get(graph_choice, graph_choice)])
     
     with st.spinner('Please wait...'):
         if graph_choice == 'Select one':
@@ -134,15 +197,18 @@ def analysis_descriptive(ncbi_df):
             fig = boxplot_maker('Proteins', ncbi_df)
             st.plotly_chart(fig)
 
-def analysis_heatmap(ncbi_df):
+def analysis_heatmap(ncbi_data):
     ## Data 3: Descriptive statistics of genomes (scatter plot)
     st.header('Pearson Correlation Heatmap')
+    import matplotlib.pyplot as plt   # plotting libraries are imported by the sections drawing with them
+    import seaborn as sns
     fig, ax = plt.subplots()
-    corrMatrix = ncbi_df.iloc[:, 0:-1].corr(numeric_only=True)
+    heatmap_columns = [menu['col_name'] for menu in ncbi_data.size_menus.values()]
+    corrMatrix = ncbi_data.correlation(heatmap_columns)
     sns.heatmap(corrMatrix, annot=True, cmap='BrBG')
     st.pyplot(fig)
     
-def analysis_scatterplot(ncbi_df):
+def analysis_scatterplot(ncbi_data):
     st.header('Scatter plot [2d or 3d]')
     scatter_items = ['Genome size (Mb)', 'GC%', 'Chromosome','Plasmid','Genes', 'Proteins']
     scatter_items_selected = st.multiselect('Select 2 or 3 items', scatter_items, key = 'scatter', default=['Genome size (Mb)', 'GC%'])
@@ -152,13 +218,17 @@ def analysis_scatterplot(ncbi_df):
         st.write('Select two or three items') 
     
     elif 2 <= len(scatter_items_selected) <= 3:
+        ncbi_df = ncbi_data.filtered_columns(scatter_items_selected + ['superkingdom'])
         fig = scatterplot_maker(scatter_items_selected, ncbi_df)
         st.plotly_chart(fig)
             
     else:
         st.write('Select two or three items')
 
-def analysis_section4(ncbi_df):
+## larger tables are shown without highlighting: styles are sent to the browser cell by cell
+MAX_STYLED_ROWS = 2000
+
+def analysis_section4(ncbi_data):
     ## Data 4: Descriptive statistics of genomes (table data)
     st.header('Distribution by Taxonomic Groups')
     # st.write('<Table data>')        
@@ -169,101 +239,79 @@ def analysis_section4(ncbi_df):
         if df_choice == 'Select data':
             st.write('Please select table data') 
         
-        elif df_choice == 'TaxID':
-            TaxID_series = ncbi_df['TaxID'].value_counts()    # count year values and save it to a Series dattype
-            TaxID_df = pd.DataFrame({'TaxID': TaxID_series.index, 'Count': TaxID_series.values})
-            st.dataframe(TaxID_df.style.highlight_max(axis=0))
-            
-            # ## download table data
-            if st.button('Download the selected complete genome data as CSV', key = 'descriptive4_download_taxid'):
-                tmp_download_link = download_link(TaxID_df, 'selectGenome_{}_count.csv'.format(df_choice), 'Click here to download your data!')
-                st.markdown(tmp_download_link, unsafe_allow_html=True)
-            
-        
-        elif df_choice == 'Superkingdom':
-            Superkingdom_series = ncbi_df['superkingdom'].value_counts()    # count year values and save it to a Series dattype
-            Superkingdom_df = pd.DataFrame({'Superkingdom': Superkingdom_series.index, 'Count': Superkingdom_series.values})
-            st.dataframe(Superkingdom_df.style.highlight_max(axis=0))
-            
-            # ## download table data
-            if st.button('Download the selected complete genome data as CSV', key = 'descriptive4_download_superkingdom'):
-                tmp_download_link = download_link(Superkingdom_df, 'selectGenome_{}_count.csv'.format(df_choice), 'Click here to download your data!')
-                st.markdown(tmp_download_link, unsafe_allow_html=True)
-        
-        elif df_choice == 'Phylum':
-            Taxlank_df_dsend_reindex = count_tableMaker_groupby (df_choice, ncbi_df)
-            st.write(Taxlank_df_dsend_reindex.style.highlight_max(axis=0))
-            
-            # ## download table data
-            if st.button('Download the selected complete genome data as CSV', key = 'descriptive4_download_phylum'):
-                tmp_download_link = download_link(Taxlank_df_dsend_reindex, 'selectGenome_{}_count.csv'.format(df_choice), 'Click here to download your data!')
-                st.markdown(tmp_download_link, unsafe_allow_html=True)        
-        
-        elif df_choice == 'Class':
-            Taxlank_df_dsend_reindex = count_tableMaker_groupby (df_choice, ncbi_df)
-            st.write(Taxlank_df_dsend_reindex.style.highlight_max(axis=0))
-            
-            # ## download table data
-            if st.button('Download the selected complete genome data as CSV', key = 'descriptive4_download_class'):
-                tmp_download_link = download_link(Taxlank_df_dsend_reindex, 'selectGenome_{}_count.csv'.format(df_choice), 'Click here to download your data!')
-                st.markdown(tmp_download_link, unsafe_allow_html=True)
-            
-        elif df_choice == 'Order':
-            Taxlank_df_dsend_reindex = count_tableMaker_groupby (df_choice, ncbi_df)
-            st.write(Taxlank_df_dsend_reindex.style.highlight_max(axis=0))
-            
-            # ## download table data
-            if st.button('Download the selected complete genome data as CSV', key = 'descriptive4_download_order'):
-                tmp_download_link = download_link(Taxlank_df_dsend_reindex, 'selectGenome_{}_count.csv'.format(df_choice), 'Click here to download your data!')
-                st.markdown(tmp_download_link, unsafe_allow_html=True)
-            
-        elif df_choice == 'Family':
-            Taxlank_df_dsend_reindex = count_tableMaker_groupby (df_choice, ncbi_df)
-            st.write(Taxlank_df_dsend_reindex.style.highlight_max(axis=0))
-            
-            # ## download table data
-            if st.button('Download the selected complete genome data as CSV', key = 'descriptive4_download_family'):
-                tmp_download_link = download_link(Taxlank_df_dsend_reindex, 'selectGenome_{}_count.csv'.format(df_choice), 'Click here to download your data!')
-                st.markdown(tmp_download_link, unsafe_allow_html=True)
-            
-        elif df_choice == 'Genus':
-            Taxlank_df_dsend_reindex = count_tableMaker_groupby (df_choice, ncbi_df)
-            st.write(Taxlank_df_dsend_reindex.style.highlight_max(axis=0))
-            
-            # ## download table data
-            if st.button('Download the selected complete genome data as CSV', key = 'descriptive4_download_genus'):
-                tmp_download_link = download_link(Taxlank_df_dsend_reindex, 'selectGenome_{}_count.csv'.format(df_choice), 'Click here to download your data!')
-                st.markdown(tmp_download_link, unsafe_allow_html=True)
-            
-        elif df_choice == 'Species':
-            Taxlank_df_dsend_reindex = count_tableMaker_groupby (df_choice, ncbi_df) 
-            st.write(Taxlank_df_dsend_reindex.style.highlight_max(axis=0))
+        else:
+            # counts per TaxID, or per taxonomic group from superkingdom down to the chosen rank
+            level = 'TaxID' if df_choice == 'TaxID' else df_choice.lower()
+            count_df = ncbi_data.rank_counts(level)
+            if df_choice == 'Superkingdom':
+                count_df = count_df.rename(columns={'superkingdom': 'Superkingdom'})
+
+            if len(count_df) <= MAX_STYLED_ROWS:
+                st.dataframe(count_df.style.highlight_max(axis=0))
+            else:
+                st.dataframe(count_df)
             
             # ## download table data
-            if st.button('Download the selected complete genome data as CSV', key = 'descriptive4_download_species'):
-                tmp_download_link = download_link(Taxlank_df_dsend_reindex, 'selectGenome_{}_count.csv'.format(df_choice), 'Click here to download your data!')
-                st.markdown(tmp_download_link, unsafe_allow_html=True)
+            export_button(count_df, 'selectGenome_{}_count'.format(df_choice), 'descriptive4_download_' + level.lower(), file_format='csv', label='Download the selected complete genome data as CSV')
     except:
         st.write('Please select genome(s)')  
 
+def analysis_whats_new(ncbi_data):
+    ## Data 5: genomes added, changed or removed since an earlier snapshot
+    st.header("What's New")
+    periods = {'Since the previous update': None, 'Last 7 days': 7, 'Last 30 days': 30, 'Last 365 days': 365}
+    period = st.selectbox('Changes', list(periods), key='whats_new_selectbox')
+    changes_df = ncbi_data.changes_since(periods[period])
+    if changes_df is None:
+        st.write('The snapshot history starts with the current snapshot; changes are listed from the next update.')
+        return
+
+    counts = changes_df['Change'].value_counts()
+    col1, col2, col3 = st.columns(3)
+    col1.metric('Added genomes', int(counts.get('added', 0)))
+    col2.metric('Changed genomes', int(counts.get('changed', 0)))
+    col3.metric('Removed genomes', int(counts.get('removed', 0)))
+    st.dataframe(changes_df.head(MAX_STYLED_ROWS))
+    export_button(changes_df, 'genome_changes', 'whats_new_download')
+
+    # genomes added, changed and removed by each update, read from the history manifest only
+    summary_df = ncbi_data.history.summary()
+    if len(summary_df) > 1:
+        st.line_chart(summary_df[['added', 'changed', 'removed']].iloc[1:])
+
+def run_section(section, ncbi_data):
+    '''
+    Function to render a section of the page, measured as a stage with the number of selected genomes and the filters
+    '''
+    with stage(section.__name__, rows_in=ncbi_data.selected_count, selection=ncbi_data.filter_signature):
+        section(ncbi_data)
+
+def display_metrics():
+    ## the stages of this process, slowest first, when metrics are on
+    metrics = get_metrics()
+    if metrics is not None:
+        with st.expander('Stage metrics'):
+            st.dataframe(pd.DataFrame(metrics.summary()).sort_values('seconds_total', ascending=False))
+            st.dataframe(pd.DataFrame(metrics.by_selection()).head(MAX_STYLED_ROWS))
+
 def main():
     # Page Title/Favicon
     st.set_page_config(page_title="CPGminer", page_icon="./images/CPGFav.png")
+
+    configure_from_environment()   # once per process: later reruns find the metrics on
     
     # Main Logo
     st.image('./images/CPGlogo2.png', use_column_width=True)
     
 
 
-    with st.spinner('Downloading data from NCBI...'):
+    with st.spinner('Downloading data from NCBI...'), stage('initialize_data'):
         ncbi_data = initialize_data()
-        ncbi_df = ncbi_data.genome_df
 
-    create_sidebar(ncbi_data)
+    with stage('create_sidebar'):   # the filters are only known once the sidebar is rendered
+        create_sidebar(ncbi_data)
     # print('apply_clicked = ', apply_clicked)
 
-    print('page rendering started...')
-
     ## Introduction; reference; data sources; etc
     with st.expander("How to use this app"):
 
@@ -287,26 +335,28 @@ def main():
         """)
     
     ## Data 1: Date and the no. of genomes
-    today = date.today()
-    d1 = today.strftime("%B %d, %Y")
+    built = ncbi_data.snapshots.read_state().get('built')
+    d1 = (datetime.fromisoformat(built) if built else datetime.now()).strftime("%B %d, %Y")
     
     ## No. of genomes
-    (no_genomes, no_columns) = ncbi_df.shape
+    no_genomes = ncbi_data.row_count()
     st.write(f'**Data sourece:** GenBank prokaryotes.txt file downloaded **_{d1}_** **(a total of {no_genomes} completed genomes) (https://ftp.ncbi.nlm.nih.gov/genomes/GENOME_REPORTS/)**')
         
     st.write('')
     st.write('')
 
-    display_filters(ncbi_data)
+    run_section(display_filters, ncbi_data)
  
 
-    analysis_num_submission(ncbi_data.filtered_df)
-    analysis_descriptive(ncbi_data.filtered_df)
-    analysis_scatterplot(ncbi_data.filtered_df)
-    analysis_heatmap(ncbi_data.filtered_df)
-    analysis_section4(ncbi_data.filtered_df)
-    
-    print('page rendering complete.')
+    run_section(analysis_num_submission, ncbi_data)
+    run_section(analysis_descriptive, ncbi_data)
+    run_section(analysis_scatterplot, ncbi_data)
+    run_section(analysis_heatmap, ncbi_data)
+    run_section(analysis_section4, ncbi_data)
+    run_section(analysis_whats_new, ncbi_data)
+
+    display_metrics()
+    write_metrics()
     
 
     
@@ -0,0 +1,358 @@
+'''
+Wall time, rows in/out and peak memory of the pipeline stages and of the dashboard sections.
+
+Metrics are off unless a StageMetrics is chosen with set_metrics, or by the environment of the dashboard and of the
+command line (read by configure_from_environment):
+
+    CPGMINER_METRICS=./cache/metrics.prom    write them after every page run (.prom: Prometheus text, else JSON)
+    CPGMINER_METRICS_PORT=9464               serve them on http://localhost:9464/metrics (and /metrics.json)
+    CPGMINER_METRICS_MEMORY=1                also trace the peak memory of every stage (slower)
+
+While they are off, stage() returns a shared no-op context and timed functions only check one global,
+so instrumented code runs as if it was not instrumented.
+'''
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from datetime import datetime
+
+METRICS_ENV = 'CPGMINER_METRICS'
+PORT_ENV = 'CPGMINER_METRICS_PORT'
+MEMORY_ENV = 'CPGMINER_METRICS_MEMORY'
+
+## aggregates of every stage: (name, Prometheus type, help)
+PROMETHEUS_METRICS = [
+    ('calls', 'counter', 'Number of runs of a stage.'),
+    ('errors', 'counter', 'Number of runs of a stage that raised an exception.'),
+    ('seconds_total', 'counter', 'Total wall time of a stage in seconds.'),
+    ('seconds_max', 'gauge', 'Longest wall time of a stage in seconds.'),
+    ('seconds_last', 'gauge', 'Wall time of the last run of a stage in seconds.'),
+    ('rows_in', 'gauge', 'Rows given to the last run of a stage.'),
+    ('rows_out', 'gauge', 'Rows returned by the last run of a stage.'),
+    ('peak_bytes', 'gauge', 'Largest memory allocated by a run of a stage above its start, in bytes.'),
+]
+
+
+def count_rows(value):
+    '''
+    return the number of rows of a dataframe, series or array, None for anything else
+    '''
+    shape = getattr(value, 'shape', None)
+    return int(shape[0]) if shape else None
+
+
+def resolve(value):
+    return value() if callable(value) else value
+
+
+class StageRecord:
+    '''
+    One run of a stage; rows_out (and rows_in) can be set inside the with block
+    '''
+    __slots__ = ('name', 'rows_in', 'rows_out', 'selection', 'started', 'seconds', 'memory_start', 'peak', 'error')
+
+    def __init__(self, name, rows_in, selection):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.selection = selection
+        self.started = None
+        self.seconds = None
+        self.memory_start = None
+        self.peak = None
+        self.error = None
+
+    def as_dict(self):
+        return {'stage': self.name, 'started': self.started, 'seconds': self.seconds, 'rows_in': self.rows_in,
+                'rows_out': self.rows_out, 'peak_bytes': self.peak, 'selection': self.selection, 'error': self.error}
+
+
+class NullStage:
+    '''
+    stage of disabled metrics: a context manager doing nothing, whose record ignores what is set on it
+    '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage:
+    def __init__(self, metrics, record):
+        self.metrics = metrics
+        self.record = record
+
+    def __enter__(self):
+        record = self.record
+        record.rows_in = resolve(record.rows_in)
+        record.selection = resolve(record.selection)
+        if self.metrics.memory:
+            self.metrics.enter_memory(record)
+        record.started = datetime.now().isoformat(timespec='milliseconds')
+        self.start = time.perf_counter()
+        return record
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record = self.record
+        record.seconds = time.perf_counter() - self.start
+        if self.metrics.memory:
+            self.metrics.exit_memory(record)
+        if exc_type is not None:
+            record.error = '{}: {}'.format(exc_type.__name__, exc_value) if str(exc_value) else exc_type.__name__
+        self.metrics.add(record)
+        return False
+
+
+class StageMetrics:
+    '''
+    Thread-safe registry of the runs of the stages of one process: an aggregate per stage and the last
+    max_events runs, to find out which selections make a stage slow.
+
+    With memory, every stage runs under tracemalloc and reports the largest memory it allocated above what was
+    allocated when it started; the peaks of nested stages are folded into the stages around them.
+    '''
+    def __init__(self, path=None, memory=False, max_events=1000):
+        '''
+        :param path: file written by write() (.prom: Prometheus text format, else JSON); None to only keep them in memory
+        :param memory: trace the peak memory of every stage
+        :param max_events: number of runs kept
+        '''
+        self.path = path
+        self.memory = memory
+        self.started_tracing = False
+        self.stages = OrderedDict()
+        self.events = deque(maxlen=max_events)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def stage(self, name, rows_in=None, selection=None):
+        '''
+        return a context manager measuring a run of a stage
+        :param rows_in: number of rows given to the stage, or a function returning it
+        :param selection: description of the selected genomes, or a function returning it
+        '''
+        return Stage(self, StageRecord(name, rows_in, selection))
+
+    def enter_memory(self, record):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        stack = self.local.__dict__.setdefault('stack', [])
+        (current, peak) = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, peak)
+        if hasattr(tracemalloc, 'reset_peak'):   # Python 3.9+; before, peaks are counted from the start of the tracing
+            tracemalloc.reset_peak()
+        record.memory_start = record.peak = current
+        stack.append(record)
+
+    def exit_memory(self, record):
+        stack = self.local.stack
+        record.peak = max(record.peak, tracemalloc.get_traced_memory()[1])
+        stack.pop()
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, record.peak)
+        record.peak -= record.memory_start
+
+    def add(self, record):
+        with self.lock:
+            stage = self.stages.get(record.name)
+            if stage is None:
+                stage = self.stages[record.name] = {'stage': record.name, 'calls': 0, 'errors': 0, 'seconds_total': 0.0,
+                                                    'seconds_max': 0.0, 'seconds_last': None, 'rows_in': None, 'rows_out': None, 'peak_bytes': None, 'last_error': None}
+            stage['calls'] += 1
+            if record.error is not None:
+                stage['errors'] += 1
+                stage['last_error'] = record.error   # in the JSON metrics only
+            stage['seconds_total'] += record.seconds
+            stage['seconds_max'] = max(stage['seconds_max'], record.seconds)
+            stage['seconds_last'] = record.seconds
+            stage['rows_in'] = record.rows_in
+            stage['rows_out'] = record.rows_out
+            if record.peak is not None:
+                stage['peak_bytes'] = max(stage['peak_bytes'] or 0, record.peak)
+            self.events.append(record.as_dict())
+
+    def summary(self):
+        '''
+        return the aggregate of every stage, in the order they first ran
+        '''
+        with self.lock:
+            return [dict(stage) for stage in self.stages.values()]
+
+    def by_selection(self):
+        '''
+        return the runs kept, grouped by stage and selection: [{'stage', 'selection', 'calls', 'seconds_mean', 'seconds_max', 'rows_in'}, ...],
+        slowest first
+        '''
+        with self.lock:
+            events = list(self.events)
+        groups = OrderedDict()
+        for event in events:
+            group = groups.setdefault((event['stage'], event['selection']), {'stage': event['stage'], 'selection': event['selection'],
+                                                                             'calls': 0, 'seconds_total': 0.0, 'seconds_max': 0.0, 'rows_in': None})
+            group['calls'] += 1
+            group['seconds_total'] += event['seconds']
+            group['seconds_max'] = max(group['seconds_max'], event['seconds'])
+            group['rows_in'] = event['rows_in']
+        for group in groups.values():
+            group['seconds_mean'] = group.pop('seconds_total') / group['calls']
+        return sorted(groups.values(), key=lambda group: group['seconds_max'], reverse=True)
+
+    def to_json(self):
+        with self.lock:
+            events = list(self.events)
+        return json.dumps({'pid': os.getpid(), 'stages': self.summary(), 'by_selection': self.by_selection(), 'events': events}, indent=2)
+
+    def to_prometheus(self):
+        stages = self.summary()
+        lines = []
+        for (name, metric_type, help_text) in PROMETHEUS_METRICS:
+            metric = 'cpgminer_stage_' + name
+            lines += ['# HELP {} {}'.format(metric, help_text), '# TYPE {} {}'.format(metric, metric_type)]
+            for stage in stages:
+                if stage[name] is not None:
+                    lines.append('{}{{stage="{}"}} {}'.format(metric, stage['stage'].replace('\\', '\\\\').replace('"', '\\"'), stage[name]))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path=None):
+        '''
+        write the metrics to path (default: self.path), replacing the file atomically
+        '''
+        path = path or self.path
+        text = self.to_prometheus() if path.endswith('.prom') else self.to_json()
+        tmp_file = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_file, 'w') as f:
+            f.write(text)
+        os.replace(tmp_file, path)
+
+
+_metrics = None
+_server = None
+_server_lock = threading.Lock()
+
+
+def set_metrics(metrics):
+    '''
+    Function to turn the metrics on, e.g., set_metrics(StageMetrics('metrics.json')), or off with None
+    '''
+    global _metrics
+    if _metrics is not None and _metrics.started_tracing and tracemalloc.is_tracing():
+        tracemalloc.stop()   # tracing slows down every allocation
+    _metrics = metrics
+
+
+def get_metrics():
+    '''
+    return the current StageMetrics, or None if metrics are off
+    '''
+    return _metrics
+
+
+def stage(name, rows_in=None, selection=None):
+    '''
+    return a context manager measuring a run of a stage with the current metrics, e.g.,
+
+        with stage('apply_filter', rows_in=ncbi_data.row_count) as record:
+            ...
+            record.rows_out = len(filtered_df)
+
+    :param rows_in: number of rows, or a function returning it, called only while metrics are on
+    :param selection: description of the selected genomes, or a function returning it, called only while metrics are on
+    '''
+    metrics = _metrics
+    if metrics is None:
+        return NULL_STAGE
+    return metrics.stage(name, rows_in, selection)
+
+
+def timed(name):
+    '''
+    Decorator measuring every call of a function as a stage; rows_in are the rows of its first argument having
+    rows (a dataframe, series or array) and rows_out the rows of its result
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = _metrics
+            if metrics is None:
+                return func(*args, **kwargs)
+            rows_in = next((rows for rows in map(count_rows, args) if rows is not None), None)
+            with metrics.stage(name, rows_in) as record:
+                result = func(*args, **kwargs)
+                record.rows_out = count_rows(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def write_metrics():
+    '''
+    write the current metrics to their file, if metrics are on and have one
+    '''
+    metrics = _metrics
+    if metrics is not None and metrics.path:
+        metrics.write()
+
+
+def serve(port, host=''):
+    '''
+    Function to serve the current metrics over HTTP from a daemon thread (once per process):
+    /metrics in the Prometheus text format, /metrics.json as JSON
+    :return: the server
+    '''
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer   # only processes serving metrics pay for it
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            metrics = get_metrics()
+            if metrics is None or self.path not in ('/metrics', '/metrics.json'):
+                self.send_error(404)
+                return
+            (body, content_type) = ((metrics.to_json(), 'application/json') if self.path == '/metrics.json'
+                                    else (metrics.to_prometheus(), 'text/plain; version=0.0.4'))
+            body = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
+
+
+def configure_from_environment(environ=os.environ):
+    '''
+    Function to turn the metrics on if CPGMINER_METRICS or CPGMINER_METRICS_PORT is set and they are still off;
+    called by the entry points (main.py, cpgminer.main), never on import, so that worker processes inheriting the
+    environment do not serve the port again
+    :return: the current StageMetrics, or None
+    '''
+    (path, port) = (environ.get(METRICS_ENV), environ.get(PORT_ENV))
+    if _metrics is None and (path or port):
+        set_metrics(StageMetrics(path or None, memory=environ.get(MEMORY_ENV, '') not in ('', '0')))
+    if _metrics is not None and port:
+        serve(int(port))
+    return _metrics
+
@@ -1,12 +1,34 @@
-import streamlit as st
 import pandas as pd
-import pprint
-from ete3 import NCBITaxa
-import base64
+import copy
+import logging
 import re
-from datetime import date
 import os
+import threading
+import multiprocessing
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from urllib.request import pathname2url
 import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from cache_backend import cache_data
+from cache_manager import CacheManager
+from snapshot import SnapshotManager
+from column_index import ColumnIndex
+from history import SnapshotHistory
+from metrics import stage, timed
+from result_cache import ResultCache
+from rollup import RollupCube
+from snapshot_stats import SnapshotStats
+from schema import SnapshotTable, apply_schema, write_genome_df
+from taxonomy import CompactTaxonomy, open_compact_taxonomy
+
+logger = logging.getLogger(__name__)
+
+## ColumnIndex column of the clade_start of each genome's TaxID, selecting whole clades by a range
+CLADE_KEY = 'Clade key'
 
 def change_ftp(ftp_path):
     '''
@@ -17,30 +39,7 @@ def change_ftp(ftp_path):
     new_ftp_path = 'https' + ftp_path[3:]  
     return new_ftp_path
 
-## download data
-@st.cache_data(persist="disk")
-def download_link(object_to_download, download_filename, download_link_text):
-    """
-    Generates a link to download the given object_to_download.
-
-    object_to_download (str, pd.DataFrame):  The object to be downloaded.
-    download_filename (str): filename and extension of file. e.g. mydata.csv, some_txt_output.txt
-    download_link_text (str): Text to display for download link.
-
-    Examples:
-    download_link(YOUR_DF, 'YOUR_DF.csv', 'Click here to download data!')
-    download_link(YOUR_STRING, 'YOUR_STRING.txt', 'Click here to download your text!')
-
-    """
-    if isinstance(object_to_download,pd.DataFrame):
-        object_to_download = object_to_download.to_csv(index=False)
-
-    # some strings <-> bytes conversions necessary here
-    b64 = base64.b64encode(object_to_download.encode()).decode()
-
-    return f'<a href="data:file/txt;base64,{b64}" download="{download_filename}">{download_link_text}</a>'
-
-@st.cache_data(persist="disk")
+@cache_data
 def count_tableMaker_groupby (Taxlank, genome_df):
 
     '''
@@ -62,7 +61,7 @@ def count_tableMaker_groupby (Taxlank, genome_df):
     elif Taxlank == 'Species':
         groupby_list = ['superkingdom','phylum', 'class', 'order', 'family', 'genus', 'species'] 
                     
-    Taxlank_series = genome_df.groupby(groupby_list).size()
+    Taxlank_series = genome_df.groupby(groupby_list, observed=True).size()
     Taxlank_df = Taxlank_series.to_frame()
     Taxlank_df_reindex = Taxlank_df.reset_index()
     Taxlank_df_final = Taxlank_df_reindex.rename(columns={0: 'Count'})
@@ -70,7 +69,73 @@ def count_tableMaker_groupby (Taxlank, genome_df):
     Taxlank_df_dsend_reindex = Taxlank_df_dsend.reset_index(drop=True)
     return Taxlank_df_dsend_reindex
 
-@st.cache_data(persist="disk")
+def resolve_desired_ranks(taxids, desired_ranks, ncbi=None, chunk_size=5000):
+    '''
+    function to get taxonomical information of many taxIDs with a few bulk queries on one connection
+    :param taxids: e.g., ['257', '562']
+    :param desired_ranks: taxonimical ranks
+    :param ncbi: an open NCBITaxa or a CompactTaxonomy; a new NCBITaxa is created if not given
+    :param chunk_size: number of taxIDs per SQL query
+    :return: lineage_df: a dataframe of taxids and their taxonomical information, missed_taxID: number of taxids not found
+    '''
+    if isinstance(ncbi, CompactTaxonomy):
+        return ncbi.resolve_desired_ranks(taxids, desired_ranks)
+    if ncbi is None:
+        from ete3 import NCBITaxa   # imported on first use: ete3 is slow to import and only needed with taxdb_file
+        ncbi = NCBITaxa()
+
+    ## taxid as given -> int taxid (unparsable taxids are missed)
+    taxid2int = {}
+    for taxid in taxids:
+        try:
+            if taxid and int(taxid) > 0:
+                taxid2int[taxid] = int(taxid)
+        except (TypeError, ValueError):
+            pass
+    int_ids = list(set(taxid2int.values()))
+
+    ## lineage tracks in bulk, then obsolete taxids through the merged table
+    id2lineage = {}
+    for i in range(0, len(int_ids), chunk_size):
+        id2lineage.update(ncbi.get_lineage_translator(int_ids[i:i + chunk_size]))
+    not_found = [taxid for taxid in int_ids if taxid not in id2lineage]
+    for i in range(0, len(not_found), chunk_size):
+        _, old2new = ncbi._translate_merged(not_found[i:i + chunk_size])
+        new2lineage = ncbi.get_lineage_translator(list(set(old2new.values())))
+        for old, new in old2new.items():
+            if new in new2lineage:
+                id2lineage[old] = new2lineage[new]
+
+    ## ranks of every node on the lineages, then names of the nodes at desired ranks only
+    lineage_nodes = list(set(node for lineage in id2lineage.values() for node in lineage))
+    node2rank = {}
+    for i in range(0, len(lineage_nodes), chunk_size):
+        node2rank.update(ncbi.get_rank(lineage_nodes[i:i + chunk_size]))
+    desired = set(desired_ranks)
+    ranked_nodes = [node for node in lineage_nodes if node2rank.get(node) in desired]
+    node2name = {}
+    for i in range(0, len(ranked_nodes), chunk_size):
+        node2name.update(ncbi.get_taxid_translator(ranked_nodes[i:i + chunk_size], try_synonyms=False))
+
+    missed_taxID = 0
+    lineage_dict = {}   ## key=row, value=[lineage]
+    for i, taxid in enumerate(taxids):
+        lineage = id2lineage.get(taxid2int.get(taxid))
+        if lineage is None:
+            lineage_dict[i] = [taxid] + [None] * len(desired_ranks)
+            missed_taxID += 1
+            continue
+        ranks2lineage = dict((node2rank.get(node), node) for node in lineage)
+        lineage_list = [taxid]
+        for rank in desired_ranks:
+            node = ranks2lineage.get(rank)
+            lineage_list.append(node2name.get(node, '<not present>') if node is not None else '<not present>')
+        lineage_dict[i] = lineage_list
+
+    lineage_df = pd.DataFrame.from_dict(lineage_dict, orient='index', columns=['TaxID'] + list(desired_ranks))
+    return (lineage_df, missed_taxID)
+
+@cache_data
 def get_desired_ranks(taxid, desired_ranks):
     '''
     function to get taxonomical information from taxID
@@ -78,55 +143,172 @@ def get_desired_ranks(taxid, desired_ranks):
     :param desired_ranks: taxonimical ranks
     :return:
     '''
-    ncbi = NCBITaxa()
-    count = 0   
-    lineage_list = [taxid]
-    try:
-        lineage = ncbi.get_lineage(taxid)
-        lineage2ranks = ncbi.get_rank(lineage)
-        ranks2lineage = dict((rank, taxid) for (taxid, rank) in lineage2ranks.items())
-        rank_dict = {'{}_id'.format(rank): ranks2lineage.get(rank, '<not present>') for rank in desired_ranks}
-                
-        for k, v in rank_dict.items():
-            if v != "<not present>":
-                try:
-                    new_v = ncbi.get_taxid_translator([v])  ## new_v is dictionary key=pylum_id, value=xxxxxx
-                    lineage_list.append(new_v[v])
-                except:
-                    pass
-            else: 
-                lineage_list.append("<not present>")
-            
-    except:
-        count = 1
+    lineage_df, count = resolve_desired_ranks([taxid], desired_ranks)
+    lineage_list = [v for v in lineage_df.iloc[0].tolist() if v is not None]
     return (lineage_list, count)
 
-@st.cache_data(persist="disk")
-def taxID_lineage_df(taxids, desired_ranks):
+@cache_data
+def taxID_lineage_df(taxids, desired_ranks, _ncbi=None):
     '''
     Function to make a taxonomical information dtatframe of taxids
     :param taxids:
     :param desired_ranks: superkingdom, phylum, class, order, family, genus, species
+    :param _ncbi: an open NCBITaxa to reuse (not part of the cache key)
     :return: lineage_df: a dataframe of taxids and their taxonomical information
     '''
+    return resolve_desired_ranks(taxids, desired_ranks, ncbi=_ncbi)
 
-    missed_taxID = 0
-    lineage_dict = {}   ## key=taxid, value=[lineage]
-    for i, taxid in enumerate(taxids):
-        (lineage_list, count) = get_desired_ranks(taxid, desired_ranks)
-        lineage_dict[i] = lineage_list
-        if count == 1:
-            missed_taxID +=1
-    
-    desired_ranks.insert(0, 'TaxID')
-    lineage_df = pd.DataFrame.from_dict(lineage_dict, orient='index', columns=desired_ranks)
+## the taxonomy connection of a lineage worker process, opened once by init_lineage_worker
+_worker_ncbi = None
+
+def init_lineage_worker(dbfile):
+    global _worker_ncbi
+    from ete3 import NCBITaxa
+    _worker_ncbi = NCBITaxa(dbfile=dbfile)
+    # the workers only read, so their connection is opened read-only
+    _worker_ncbi.db.close()
+    _worker_ncbi.db = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(os.path.abspath(dbfile))), uri=True)
+
+def resolve_lineage_shard(taxids, desired_ranks, chunk_size):
+    return resolve_desired_ranks(taxids, desired_ranks, ncbi=_worker_ncbi, chunk_size=chunk_size)[0]
+
+def resolve_desired_ranks_parallel(taxids, desired_ranks, dbfile, workers=None, chunk_size=5000):
+    '''
+    function to get taxonomical information of many taxIDs in a pool of processes, each with its own connection
+    :param taxids: e.g., ['257', '562']
+    :param desired_ranks: taxonimical ranks
+    :param dbfile: path of the taxonomy database (ete3 taxa.sqlite)
+    :param workers: number of processes; None uses one per CPU
+    :param chunk_size: number of taxIDs per SQL query
+    :return: the same (lineage_df, missed_taxID) as resolve_desired_ranks
+    '''
+    workers = workers or os.cpu_count() or 1
+    unique_taxids = list(dict.fromkeys(taxids))
+    ## a few shards per worker, so that a slow shard does not hold up the others
+    n_shards = max(1, min(workers * 4, -(-len(unique_taxids) // chunk_size)))
+    shards = [unique_taxids[i::n_shards] for i in range(n_shards)]
+
+    # spawn, not fork: the app builds snapshots from a background thread
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_lineage_worker, initargs=(dbfile,)) as pool:
+        shard_dfs = list(pool.map(resolve_lineage_shard, shards, [list(desired_ranks)] * n_shards, [chunk_size] * n_shards))
+
+    ## results are merged in the order of taxids, whatever order the shards finished in
+    row_of = {}
+    for shard_df in shard_dfs:
+        for row in shard_df.itertuples(index=False):
+            row_of[row[0]] = list(row)
+    lineage_df = pd.DataFrame([row_of[taxid] for taxid in taxids], columns=['TaxID'] + list(desired_ranks))
+    missed_taxID = int(lineage_df[list(desired_ranks)].isna().all(axis=1).sum())
     return (lineage_df, missed_taxID)
 
 
+def parse_replicons(replicons, accessions=True):
+    '''
+    Function to parse the Replicons column of prokaryotes.txt with column-level string operations
+    :param replicons: a Series, e.g., 'chromosome:NC_000913.3/U00096.3; plasmid F:NC_002483.1/AP001918.1'
+    :param accessions: also extract the accession of each replicon
+    :return: a dataframe of Chromosome and Plasmid (counts) and Accessions (a list with the accession of each replicon)
+    '''
+    replicons = replicons.fillna('').astype(str)   # missing Replicons count as no replicon
+    replicons_df = pd.DataFrame({
+        'Chromosome': replicons.str.count(r'\bchromosome\b', flags=re.IGNORECASE),
+        'Plasmid': replicons.str.count(r'\bplasmid\b', flags=re.IGNORECASE),
+    }, index=replicons.index)
+    if accessions:
+        replicons_df['Accessions'] = replicons.str.findall(r':\s*([^;:\s]+)')
+    return replicons_df
+
+
+def sort_order(series):
+    '''
+    Function to sort the rows of a column, categories by their values rather than their codes
+    :return: (row positions in ascending order, rank of each row in that order); equal values keep their row order
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        category_ranks = np.argsort(np.argsort(series.cat.categories.to_numpy(), kind='stable'), kind='stable')
+        keys = np.where(series.cat.codes.to_numpy() < 0, -1, category_ranks[series.cat.codes.to_numpy()])
+    else:
+        keys = series.to_numpy()
+    order = np.argsort(keys, kind='stable').astype(np.int32)
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order), dtype=np.int32)
+    return (order, ranks)
+
+
+def taxonomy_version(ncbi):
+    '''
+    function to get a stamp that changes whenever the taxonomy database is rebuilt
+    :param ncbi: NCBITaxa or CompactTaxonomy
+    :return: e.g., '1687512345-2187657216'
+    '''
+    stat = os.stat(ncbi.dbfile)
+    return '{}-{}'.format(int(stat.st_mtime), stat.st_size)
+
+
+class LineageStore:
+    '''
+    TaxID -> lineage table persisted as a feather file and stamped with the taxonomy version,
+    so that only TaxIDs not seen before are resolved against the taxonomy database
+    '''
+    def __init__(self, path, desired_ranks):
+        self.path = path
+        self.desired_ranks = list(desired_ranks)
+        self.columns = ['TaxID'] + self.desired_ranks
+        self.parallel_min_taxids = 5000  # fewer new taxIDs are resolved in this process, a pool costs more to start
+
+    def load(self, version):
+        '''
+        return the stored lineage table, or an empty one if it was built from another taxonomy version
+        '''
+        if os.path.exists(self.path):
+            table = feather.read_table(self.path)
+            metadata = table.schema.metadata or {}
+            if metadata.get(b'taxonomy_version', b'').decode() == version and table.column_names == self.columns:
+                return table.to_pandas()
+        return pd.DataFrame(columns=self.columns, dtype=object)
+
+    def save(self, lineage_df, version):
+        table = pa.Table.from_pandas(lineage_df.reset_index(drop=True), preserve_index=False)
+        table = table.replace_schema_metadata({'taxonomy_version': version})
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        feather.write_feather(table, tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def lookup(self, taxids, ncbi, workers=1):
+        '''
+        Function to get the lineages of taxids, resolving and storing only the new ones
+        :param taxids: e.g., ['257', '562']
+        :param ncbi: NCBITaxa or CompactTaxonomy
+        :param workers: number of processes resolving new taxIDs with NCBITaxa; None uses one per CPU
+        :return: lineage_df: a dataframe of taxids and their taxonomical information, missed_taxID: number of taxids not found
+        '''
+        version = taxonomy_version(ncbi)
+        stored_df = self.load(version)
+
+        new_taxids = list(set(taxids) - set(stored_df['TaxID']))
+        if new_taxids:
+            logger.info('resolving %d new taxIDs', len(new_taxids))
+            with stage('resolve_lineages', rows_in=len(new_taxids)) as record:
+                # the compact taxonomy resolves all taxIDs in a few array operations, a pool would only add overhead
+                if workers != 1 and len(new_taxids) >= self.parallel_min_taxids and not isinstance(ncbi, CompactTaxonomy):
+                    new_df, _ = resolve_desired_ranks_parallel(new_taxids, self.desired_ranks, ncbi.dbfile, workers)
+                else:
+                    new_df, _ = resolve_desired_ranks(new_taxids, self.desired_ranks, ncbi=ncbi)
+                record.rows_out = len(new_df)
+            stored_df = pd.concat([stored_df, new_df], ignore_index=True) if len(stored_df) else new_df
+            self.save(stored_df, version)
+
+        lineage_df = stored_df.loc[stored_df['TaxID'].isin(set(taxids))].reset_index(drop=True)
+        missed_taxID = int(lineage_df[self.desired_ranks].isna().any(axis=1).sum())
+        return (lineage_df, missed_taxID)
+
+
 
 class NCBIdata:
-    def __init__(self):
-        self.url = "https://ftp.ncbi.nlm.nih.gov/genomes/GENOME_REPORTS/prokaryotes.txt"
+    def __init__(self, cache_path='./cache', url="https://ftp.ncbi.nlm.nih.gov/genomes/GENOME_REPORTS/prokaryotes.txt"):
+        self.url = url
         self.tax_item_texts = ['TaxID', 'superkingdom', 'phylum', 'class', 'order', 'family','genus', 'species']
         self.column_names = ['#Organism/Name', 'TaxID', 'Size (Mb)', 'GC%', 'Replicons', 'Genes', 'Proteins', 'Release Date', 'Status', 'FTP Path']
         
@@ -134,9 +316,29 @@ class NCBIdata:
         self.filters = {}
 
         self.genome_df = None
+        self.snapshot_table = None
+        self.snapshot_version = None
+        self.column_index = None
+        self.rollup = None
+        self.stats = None  # SnapshotStats of the snapshot
+        self.clade_index = {}  # 'taxonomy' and 'keys', filled on the first clade filter; shared by all sessions
+        self.clade_lock = threading.Lock()
+        self.sort_orders = {}  # col_name -> sort_order() of the snapshot, computed on the first sort by the column; shared by all sessions
+        self.result_cache = ResultCache()  # shared by all sessions of this data
         self.filtered_df = None
 
-        self.cache_path = './cache'
+        self.cache_path = cache_path
+        self.ingest_chunksize = 100000  # rows of prokaryotes.txt parsed at a time; None reads the whole file at once
+        self.history = SnapshotHistory(os.path.join(self.cache_path, 'history'))
+        self.cache_manager = CacheManager(self.cache_path)  # default budgets: unused for 30 days, only the current snapshot kept
+        self.snapshots = SnapshotManager(self.url, self.cache_path, write_snapshot=write_genome_df, history=self.history, cache_manager=self.cache_manager)
+
+        self.taxdump_file = os.path.join(self.cache_path, 'taxdump.tar.gz')  # downloaded from NCBI if missing
+        self.taxdb_file = None  # ete3 taxa.sqlite; if set, lineages are resolved with ete3 instead of taxdump_file
+        self.lineage_workers = 1  # processes resolving new taxIDs of a build; None uses one per CPU
+        self.local = threading.local()
+        self.desired_ranks = self.tax_item_texts[1:]
+        self.lineage_store = LineageStore(os.path.join(self.cache_path, 'lineage.feather'), self.desired_ranks)
 
         self.size_menus = { 
             'Genome Size': {
@@ -171,26 +373,75 @@ class NCBIdata:
                 },
        }
 
-    def get_cache_filename(self):
-        today = date.today()
+    def get_taxonomy(self):
+        '''
+        return the taxonomy lineages are resolved with: the compact taxonomy built from taxdump_file, or ete3 if taxdb_file is set
+        '''
+        if self.taxdb_file is not None:
+            return self.get_ncbi_taxa()
+        return open_compact_taxonomy(os.path.join(self.cache_path, 'taxonomy.npz'), self.taxdump_file)
 
-        filename = 'genome_df' + today.strftime("-%Y-%m-%d") + ".feather"
-        return os.path.join(self.cache_path, filename)
+    def get_clade_taxonomy(self):
+        '''
+        return the CompactTaxonomy of the taxonomy lineages are resolved with
+        '''
+        if self.taxdb_file is None:
+            return self.get_taxonomy()
+        return open_compact_taxonomy(os.path.join(self.cache_path, 'taxonomy-ete3.npz'), self.get_ncbi_taxa().dbfile)
+
+    def get_ncbi_taxa(self):
+        '''
+        return the NCBITaxa connection shared by all lineage lookups of this object in the current thread
+        '''
+        ncbi = getattr(self.local, 'ncbi_taxa', None)
+        if ncbi is None:
+            from ete3 import NCBITaxa
+            ncbi = NCBITaxa(dbfile=self.taxdb_file)
+            self.local.ncbi_taxa = ncbi
+        return ncbi
+
+    @property
+    def genome_df(self):
+        # a loaded snapshot is converted to one pandas frame only when the whole table is needed
+        if self._genome_df is None and self.snapshot_table is not None:
+            return self.snapshot_table.to_pandas()
+        return self._genome_df
+
+    @genome_df.setter
+    def genome_df(self, genome_df):
+        self._genome_df = genome_df
+
+    def columns(self, col_names):
+        '''
+        return a dataframe of only the given columns of genome_df
+        '''
+        if self._genome_df is None and self.snapshot_table is not None:
+            return self.snapshot_table.columns(col_names)
+        return self._genome_df[col_names]
+
+    def row_count(self):
+        if self._genome_df is None and self.snapshot_table is not None:
+            return len(self.snapshot_table)
+        return len(self._genome_df)
+
+    def get_cache_filename(self):
+        return self.snapshots.snapshot_file()
 
     def save_to_cache(self, overwrite=False): 
         cache_file = self.get_cache_filename()
-        if (not os.path.exists(cache_file)) or (os.path.exists(cache_file) and overwrite):
-            if not os.path.exists(self.cache_path):
-                os.makedirs(self.cache_path)
-            self.genome_df.to_feather(cache_file)
+        if (cache_file is None) or overwrite:
+            self.snapshots.publish(self.genome_df)
 
     def load_from_cache(self):
+        '''
+        return the current snapshot as a memory-mapped SnapshotTable, or None if there is no snapshot yet
+        '''
         cache_file = self.get_cache_filename()
-        if os.path.exists(cache_file):
-            print('load from cache...')
-            genome_df = pd.read_feather(cache_file)
-            genome_df.set_index('index', inplace=True)
-            return genome_df
+        if cache_file is not None:
+            snapshot_table = SnapshotTable(cache_file)
+            self.snapshot_version = os.path.basename(cache_file)
+            self.result_cache.clear()
+            return snapshot_table
         else:
             return None
     
@@ -231,8 +482,14 @@ class NCBIdata:
         self.save_df(self.genome_df.reset_index(), 'step5')
 
 
-    def load_from_ncbi(self):
-        print('load from ncbi...')
+    @timed('read_complete_genomes')
+    def read_complete_genomes(self, source, chunksize=None):
+        '''
+        Function to read prokaryotes.txt keeping only the complete genomes
+        :param source: url or path of prokaryotes.txt
+        :param chunksize: number of rows parsed at a time; the whole file is parsed at once if None
+        :return: genome_df of complete genomes without the column "Status"
+        '''
         dtype_data = {
             '#Organism/Name':np.string_, 
             'TaxID':np.string_, 
@@ -245,15 +502,33 @@ class NCBIdata:
             'Status':np.string_, 
             'FTP Path':np.string_
         }
-        data = pd.read_table(self.url, usecols=self.column_names, dtype=dtype_data)
-        # print(data.shape)
-        # print(data.columns)
-        # self.save_df(data, 'original')
-        
-        complete_genomes = data.loc[data['Status'] == "Complete Genome"]    # Select only complete genomes
-        genome_df = complete_genomes.reset_index(drop = True) # reset index from 0
-        genome_df = genome_df.drop(['Status'], axis = 1) # remove the column "Status"
+        reader = pd.read_table(source, usecols=self.column_names, dtype=dtype_data, chunksize=chunksize)
+        if chunksize is None:
+            reader = [reader]
+
+        def select_complete_genomes(data):
+            complete_genomes = data.loc[data['Status'] == "Complete Genome"]    # Select only complete genomes
+            complete_genomes = complete_genomes.drop(['Status'], axis = 1) # remove the column "Status"
+            for col_name in ['Size (Mb)', 'GC%', 'Genes', 'Proteins']:
+                complete_genomes[col_name] = pd.to_numeric(complete_genomes[col_name], errors='coerce')
+            return complete_genomes
+
+        # only the complete genomes of each chunk are kept, so peak memory follows the kept rows
+        chunks = []
+        for data in reader:
+            chunks.append(select_complete_genomes(data))
+            del data
+        if not chunks:
+            # a report with a header but no rows may give no chunk at all
+            chunks.append(select_complete_genomes(pd.DataFrame(columns=self.column_names, dtype=object)))
+
+        genome_df = pd.concat(chunks, ignore_index=True) # reset index from 0
         genome_df = genome_df.rename(columns={"#Organism/Name": "Genome Name"}) # change the first column name
+        return genome_df
+
+    @timed('load_from_ncbi')
+    def load_from_ncbi(self, source=None):
+        genome_df = self.read_complete_genomes(source or self.url, chunksize=self.ingest_chunksize)
  
         genome_df = self.count_chro_plas(genome_df)
         genome_df = self.making_final_df(genome_df)
@@ -262,59 +537,84 @@ class NCBIdata:
         genome_df = genome_df.reset_index()
         return genome_df
 
-    def load(self):
-        self.genome_df = self.load_from_cache()
-        if self.genome_df is None:
-            self.genome_df = self.load_from_ncbi()
-            self.save_to_cache()
+    @timed('load')
+    def load(self, background_refresh=True):
+        # build the first snapshot, or revalidate the current one against NCBI while it is served
+        self.snapshots.refresh(self.load_from_ncbi, background=background_refresh)
+        self.open_snapshot()
+
+    @timed('open_snapshot')
+    def open_snapshot(self):
+        '''
+        load the current snapshot without checking the source; returns False if no snapshot was built yet
+        '''
+        self.snapshot_table = self.load_from_cache()
+        if self.snapshot_table is None:
+            return False
+        self.genome_df = None
         
-        # perform processing for this class
+        # perform processing for this class (reading only the columns it needs)
         self.calc_tax_items()
+        self.stats = SnapshotStats.open(self.snapshot_table.path + '.stats.npz', self.columns, self.stats_columns())
         self.calc_range_for_size_menus()
-        return self.genome_df
+        self.calc_column_index()
+        self.rollup = RollupCube(self.columns, self.desired_ranks)
+        self.clade_index = {}
+        self.sort_orders = {}
+        return True
 
     def calc_tax_items(self):
         for item_text in self.tax_item_texts:
-            self.tax_items[item_text] = list(set(self.genome_df[item_text]))
+            self.tax_items[item_text] = list(set(self.columns([item_text])[item_text]))
             self.tax_items[item_text] = list(filter(None, self.tax_items[item_text]))
             self.tax_items[item_text].sort()
     
+    def get_clade_index(self):
+        '''
+        return {'taxonomy': CompactTaxonomy, 'keys': the clade key of each genome}, built on the first clade filter,
+        so that the taxonomy is only loaded when it is needed
+        '''
+        with self.clade_lock:
+            if not self.clade_index:
+                taxonomy = self.get_clade_taxonomy()
+                clade_keys = taxonomy.clade_keys(self.columns(['TaxID'])['TaxID'])
+                if self.column_index is not None:
+                    self.column_index.add_numeric(CLADE_KEY, clade_keys)
+                self.clade_index.update({'taxonomy': taxonomy, 'keys': clade_keys})
+            return self.clade_index
+
+    def calc_column_index(self):
+        numeric_columns = [menu['col_name'] for menu in self.size_menus.values()]
+        self.column_index = ColumnIndex(self.columns(self.tax_item_texts + numeric_columns), self.tax_item_texts, numeric_columns)
+
+    def stats_columns(self):
+        return [menu['col_name'] for menu in self.size_menus.values()]
+
     def calc_range_for_size_menus(self):
         for title, menu in self.size_menus.items():
-            (min_v, max_v) = self.get_range(self.genome_df, menu['col_name'])
-            menu['range'] = (min_v, max_v)
+            if self.stats is not None:
+                menu['range'] = self.stats.column_range(menu['col_name']) or (0.0, 0.0)
+            else:
+                menu['range'] = self.get_range(self.columns([menu['col_name']]), menu['col_name'])
 
     def get_range(self, df, col_name):
         min_value = float(df[col_name].min())
         max_value = float(df[col_name].max())
         return (min_value, max_value)
 
+    @timed('count_chro_plas')
     def count_chro_plas(self, genome_df):
         '''
         Function to update the final genome_df by adding two columns, i.e., No. of chromosome and No. of plasmid
         :param genome_df:
         :return: the updated genome_df
         '''
-
-        replicons_list = list(genome_df['Replicons'])
-        chromosome_list = []
-        plasmid_list = []
-        word_chromosome = ['chromosome']
-        word_plasmid = ['plasmid']
-        exactMatch_chromosome = re.compile(r'\b%s\b' % '\\b|\\b'.join(word_chromosome), flags=re.IGNORECASE)
-        exactMatch_plasmid = re.compile(r'\b%s\b' % '\\b|\\b'.join(word_plasmid), flags=re.IGNORECASE)
-        for r in replicons_list:
-            no_chromosome = len(exactMatch_chromosome.findall(r))
-            chromosome_list.append(no_chromosome)
-            no_plasmid = len(exactMatch_plasmid.findall(r))
-            plasmid_list.append(no_plasmid)
-        
-        chr_plas_dic = {'Chromosome': chromosome_list, 'Plasmid': plasmid_list}
-        chr_plas_df = pd.DataFrame(chr_plas_dic)
-        genome_df = pd.concat([genome_df, chr_plas_df], axis=1)
+        replicons_df = parse_replicons(genome_df['Replicons'], accessions=False)
+        genome_df = genome_df.assign(Chromosome=replicons_df['Chromosome'], Plasmid=replicons_df['Plasmid'])
         
         return genome_df
     
+    @timed('making_final_df')
     def making_final_df(self, genome_df):
         '''
         Function to make a final genome_df from the genome_df by reordering of columns, changing datatypes, etc...
@@ -327,9 +627,7 @@ class NCBIdata:
         genome_df=genome_df.rename(columns = {'Size (Mb)':'Genome size (Mb)', 'FTP Path':'Genome download (FTP Path)'})
         
         taxID_list = list(set(genome_df['TaxID']))
-        ncbi = NCBITaxa()
-        desired_ranks = ['superkingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
-        lineage_df, missed_taxID = taxID_lineage_df(taxID_list, desired_ranks)
+        lineage_df, missed_taxID = self.lineage_store.lookup(taxID_list, self.get_taxonomy(), workers=self.lineage_workers)
         
         ## Join of two dataframes
         final_genome_df = pd.merge(genome_df, lineage_df, on='TaxID')
@@ -346,14 +644,75 @@ class NCBIdata:
         final_genome_df['Proteins'] = pd.to_numeric(final_genome_df['Proteins'], errors='coerce')
         final_genome_df['Chromosome'] = pd.to_numeric(final_genome_df['Chromosome'], errors='coerce')
         final_genome_df['Plasmid'] = pd.to_numeric(final_genome_df['Plasmid'], errors='coerce')
-        final_genome_df['TaxID'] = final_genome_df['TaxID'].astype(str)
+        final_genome_df['TaxID'] = pd.to_numeric(final_genome_df['TaxID'], errors='coerce')
+
+        ## compact dtypes (categorical ranks, integer TaxID and counts, float32) need complete rows
+        final_genome_df = final_genome_df.dropna()  # remove missing values
+        final_genome_df = apply_schema(final_genome_df)
 
         return final_genome_df
 
+    def new_session(self):
+        '''
+        return a view of the loaded data with its own filters, for one user session;
+        genome_df, tax_items and size_menus are shared with this object and must not be modified
+        '''
+        session = copy.copy(self)
+        session.filters = {}
+        session.filtered_df = None
+        return session
+
+    @property
+    def filtered_df(self):
+        # staged filters are evaluated once, on the first read after they changed
+        if self.filters_changed:
+            self.apply_filter()
+        return self._filtered_df
+
+    @filtered_df.setter
+    def filtered_df(self, filtered_df):
+        self._filtered_df = filtered_df
+        self.filters_changed = filtered_df is None
+
     def setFilter(self, key, value):
+        '''
+        stage a filter; all staged filters are evaluated together by apply_filter
+        '''
         self.filters[key] = value
-        pprint.pprint(self.filters)
-        self.apply_filter()
+        self.filters_changed = True
+
+    def set_rank_filter(self, menu, values):
+        '''
+        stage the same filter as the 'Taxonomic Ranks' sidebar menu
+        :param menu: 'TaxID' or a taxonomic rank, e.g., 'genus'
+        :param values: e.g., ['Escherichia', 'Bacillus']
+        '''
+        if menu not in self.tax_item_texts:
+            raise ValueError('unknown taxonomic rank: {}'.format(menu))
+        if menu == 'TaxID':
+            values = [int(v) for v in values]
+        self.setFilter('Taxonomic Ranks', {'menu': menu, 'values': list(values)})
+
+    def set_clade_filter(self, taxa):
+        '''
+        stage a filter keeping the genomes in the clades of taxa, at any depth of the taxonomy
+        :param taxa: TaxIDs or scientific names, e.g., [1224, 'Bacillus']
+        '''
+        self.setFilter('Clade', {'menu': 'Clade', 'values': list(taxa)})
+
+    def set_range_filter(self, col_name, min_v, max_v):
+        '''
+        stage the same filter as a checked range slider of the sidebar
+        :param col_name: e.g., 'GC%'
+        '''
+        for title, menu in self.size_menus.items():
+            if menu['col_name'] == col_name:
+                filter_item = {k: v for k, v in menu.items()}
+                filter_item['values'] = (min_v, max_v)
+                filter_item['checked'] = True
+                self.setFilter(title, filter_item)
+                return
+        raise ValueError('unknown genome feature: {}'.format(col_name))
 
     def __repr__(self):
         # return pp.pformat(self.filters)
@@ -365,45 +724,204 @@ class NCBIdata:
         return true if filter is set
         """
         for title, filter in self.filters.items():
-            if title == 'Taxonomic Ranks':
+            if title == 'Taxonomic Ranks' or title == 'Clade':
                 if filter['values']: 
                     return True
             elif 'checked' in filter and filter['checked']:
                 return True
+
+    def filter_mask(self):
+        '''
+        return one boolean mask over genome_df combining the taxonomic ranks and all checked ranges
+        '''
+        mask = np.ones(len(self.genome_df), dtype=bool)
+
+        tax_filter = self.filters.get('Taxonomic Ranks')
+        if tax_filter and tax_filter.get('values'):
+            mask &= self.genome_df[tax_filter['menu']].isin(tax_filter['values']).to_numpy()
+
+        for title, filter in self.filters.items():
+            if 'checked' in filter and filter['checked']:
+                values = self.genome_df[filter['col_name']].to_numpy()
+                (min_v, max_v) = filter['values']
+                if values.dtype.kind == 'f':   # compare in the column's precision, as ColumnIndex does
+                    (min_v, max_v) = (values.dtype.type(min_v), values.dtype.type(max_v))
+                mask &= values >= min_v
+                mask &= values <= max_v
+
+        clade_intervals = self.active_filters()[2]
+        if clade_intervals is not None:
+            clade_keys = self.get_clade_index()['keys']
+            in_clades = np.zeros(len(mask), dtype=bool)
+            for (start, end) in clade_intervals:
+                in_clades |= (clade_keys >= start) & (clade_keys <= end)
+            mask &= in_clades
+        return mask
                 
-    def apply_filter(self):
-        # apply Taxonomic Ranks first
-        print('applying filter...')
-        if self.genome_df is not None:
-            self.filtered_df = self.genome_df
-
-            tax_filter = self.filters['Taxonomic Ranks']
-            if tax_filter and ('values' in tax_filter): 
-                print(tax_filter)
-                if tax_filter['values']:
-                    print('applying taxonomic ranks', tax_filter)
-
-                    self.filtered_df = self.genome_df.loc[self.genome_df[tax_filter['menu']].isin(tax_filter['values'])]
-
-                    print('filtered', self.filtered_df.shape)
-                    print(self.filtered_df.tail())
-
-            for title, filter in self.filters.items():
-                if 'checked' in filter and filter['checked']:
-                    col_name = filter['col_name']
-                    filter_values = filter['values']
-                    
-                    self.filtered_df = self.filtered_df.loc[
-                        self.filtered_df[col_name].between(filter_values[0], filter_values[1], inclusive='both') 
-                    ]
-            
-            print('filtered', self.filtered_df.shape)
-            print(self.filtered_df.tail())
+    def active_filters(self):
+        '''
+        return (rank filter, ranges, clade intervals) of the filters in effect: (menu, values) or None,
+        [(col_name, min, max), ...] and the clade key intervals [(start, end), ...] or None
+        '''
+        tax_filter = self.filters.get('Taxonomic Ranks')
+        rank_filter = (tax_filter['menu'], tax_filter['values']) if tax_filter and tax_filter.get('values') else None
+        ranges = [(filter['col_name'], filter['values'][0], filter['values'][1]) for filter in self.filters.values() if filter.get('checked')]
+        clade_filter = self.filters.get('Clade')
+        clade_intervals = self.get_clade_index()['taxonomy'].clade_intervals(clade_filter['values']) if clade_filter and clade_filter.get('values') else None
+        return (rank_filter, ranges, clade_intervals)
+
+    def filter_signature(self):
+        '''
+        return a canonical key of the snapshot and the filters in effect; equal selections get equal keys
+        '''
+        (rank_filter, ranges, clade_intervals) = self.active_filters()
+        if rank_filter is not None:
+            rank_filter = (rank_filter[0], tuple(sorted(set(str(v) for v in rank_filter[1]))))
+        ranges = tuple(sorted((col_name, float(min_v), float(max_v)) for (col_name, min_v, max_v) in ranges))
+        if clade_intervals is not None:
+            clade_intervals = tuple(clade_intervals)
+        return repr((self.snapshot_version, rank_filter, ranges, clade_intervals))
+
+    @timed('filter_positions')
+    def filter_positions(self):
+        '''
+        return the sorted row positions of genome_df selected by all filters, or None if nothing is filtered
+        '''
+        (rank_filter, ranges, clade_intervals) = self.active_filters()
+        if rank_filter is None and not ranges and clade_intervals is None:
+            return None
 
+        if self.column_index is not None:
+            any_ranges = [(CLADE_KEY, clade_intervals)] if clade_intervals is not None else []
+            return self.column_index.select(rank_filter, ranges, any_ranges)
+        return np.flatnonzero(self.filter_mask())
 
-    
+    def selected_positions(self):
+        '''
+        return the row positions selected by the filters (None if nothing is filtered), cached per filter signature
+        '''
+        return self.result_cache.get_or_compute(self.filter_signature(), 'positions', self.filter_positions)
+
+    def selected_count(self):
+        '''
+        return the number of genomes selected by the filters
+        '''
+        positions = self.selected_positions()
+        return self.row_count() if positions is None else len(positions)
 
+    def display_columns(self):
+        '''
+        return the columns of genome_df, without converting it
+        '''
+        if self._genome_df is None and self.snapshot_table is not None:
+            return list(self.snapshot_table.column_names)
+        return list(self._genome_df.columns)
 
-        
-        
+    def sorted_positions(self, sort_by=None, ascending=True):
+        '''
+        Function to order the selected genomes by a column, from the sort order of the whole snapshot
+        :param sort_by: a column, or None for the snapshot order
+        :return: the row positions of the selected genomes in display order, cached per filter signature
+        '''
+        def compute(positions):
+            if sort_by is None:
+                order = np.arange(self.row_count()) if positions is None else positions
+            else:
+                if sort_by not in self.sort_orders:
+                    self.sort_orders[sort_by] = sort_order(self.columns([sort_by])[sort_by])
+                (order, ranks) = self.sort_orders[sort_by]
+                if positions is not None:
+                    # sorting by the precomputed ranks costs the size of the selection, not of the snapshot
+                    order = positions[np.argsort(ranks[positions], kind='stable')]
+            return order if ascending else order[::-1]
+
+        return self.cached_result('order by {} {}'.format(sort_by, 'asc' if ascending else 'desc'), compute)
+
+    def page(self, start, size, sort_by=None, ascending=True):
+        '''
+        Function to get one page of the selected genomes; only its rows are converted
+        :param start: position of the first row of the page in display order
+        :param size: number of rows of the page
+        :param sort_by: a column, or None for the snapshot order
+        :return: a dataframe of the rows of the page, indexed as genome_df
+        '''
+        positions = self.sorted_positions(sort_by, ascending)[start:start + size]
+        if self._genome_df is None and self.snapshot_table is not None:
+            return self.snapshot_table.take(positions)
+        return self._genome_df.iloc[positions]
+
+    def filtered_columns(self, col_names):
+        '''
+        return a dataframe of only the given columns of the selected genomes
+        '''
+        df = self.columns(col_names)
+        positions = self.selected_positions()
+        if positions is None or len(positions) == len(df):
+            return df
+        return df.iloc[positions]
+
+    def cached_result(self, name, compute):
+        '''
+        Function to get a result derived from the selected genomes, cached per filter signature
+        :param name: name of the result, e.g., 'year counts'
+        :param compute: function of the selected row positions (None if nothing is filtered), called only on a cache miss
+        :return: the result
+        '''
+        return self.result_cache.get_or_compute(self.filter_signature(), name, lambda: compute(self.selected_positions()))
+
+    def rank_counts(self, level):
+        '''
+        return the number of selected genomes per TaxID or per taxonomic group, sorted by count
+        :param level: 'TaxID' or a rank, e.g., 'genus' (grouped by superkingdom, ..., genus)
+        '''
+        return self.cached_result(level + ' rollup', lambda positions: self.rollup.counts(level, positions))
+
+    def year_counts(self):
+        '''
+        return the number of selected genomes released per year, indexed by Year
+        '''
+        return self.cached_result('year counts', lambda positions: self.stats.year_counts(positions))
+
+    def correlation(self, col_names=None):
+        '''
+        return the Pearson correlation matrix of the numeric columns (or of col_names) over the selected genomes
+        '''
+        corr_df = self.cached_result('correlation matrix', lambda positions: self.stats.correlation(positions))
+        return corr_df if col_names is None else corr_df.loc[col_names, col_names]
 
+    def filtered_range(self, col_name):
+        '''
+        return (min, max) of a numeric column over the selected genomes, or None if none is selected
+        '''
+        return self.cached_result(col_name + ' range', lambda positions: self.stats.column_range(col_name, positions))
+
+    def changes_since(self, days=None):
+        '''
+        Function to list the genomes added, changed or removed since an earlier snapshot, from the snapshot history
+        :param days: compare with the last snapshot built at least this many days before the current one;
+                     None compares with the previous snapshot
+        :return: a dataframe with a Change column (see SnapshotHistory.diff), or None if the history has no earlier snapshot
+        '''
+        versions = self.history.versions()
+        current = os.path.splitext(self.snapshot_version or '')[0]
+        positions = [i for i, entry in enumerate(versions) if entry['version'] == current]
+        if not positions or positions[0] == 0:
+            return None
+        if days is None:
+            old_version = versions[positions[0] - 1]['version']
+        else:
+            since = datetime.fromisoformat(versions[positions[0]]['built']) - timedelta(days=days)
+            old_version = self.history.version_at(since) or versions[0]['version']
+        return self.result_cache.get_or_compute('history', 'changes since ' + old_version,
+            lambda: self.history.diff(old_version, current))
+
+    def apply_filter(self):
+        with stage('apply_filter', rows_in=self.row_count, selection=self.filter_signature) as record:
+            if self.genome_df is not None:
+                positions = self.selected_positions()
+                if positions is None or len(positions) == self.row_count():
+                    self._filtered_df = self.genome_df
+                else:
+                    self._filtered_df = self.genome_df.iloc[positions]
+                record.rows_out = len(self._filtered_df)
+        self.filters_changed = False
@@ -0,0 +1,82 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def estimate_size(value):
+    '''
+    return the approximate number of bytes held by a cached value
+    '''
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    '''
+    Bounded in-memory cache of filter results (selected rows and the aggregates derived from them),
+    keyed by (filter signature, result name) and evicted least-recently-used first
+    '''
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()   # (signature, name) -> (value, size)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, signature, name, compute):
+        '''
+        Function to get a cached result or compute and cache it
+        :param signature: canonical signature of the filters and the snapshot
+        :param name: name of the result, e.g., 'positions' or 'year counts'
+        :param compute: function called without arguments on a miss
+        :return: the result
+        '''
+        key = (signature, name)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        size = estimate_size(value)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.nbytes += size
+            while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+                (_, (_, evicted_size)) = self.entries.popitem(last=False)
+                self.nbytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.nbytes, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,57 @@
+import threading
+
+import numpy as np
+
+
+class RollupCube:
+    '''
+    Genome counts of a snapshot per TaxID and per taxonomic group for every prefix of the ranks
+    (superkingdom; superkingdom, phylum; ...; superkingdom, ..., species).
+
+    Each level is grouped once, keeping the group of every row; counting a selection is then a bincount
+    of the groups of the selected rows instead of a new groupby.
+    '''
+    def __init__(self, get_columns, rank_columns):
+        '''
+        :param get_columns: function returning a dataframe of the given columns of genome_df
+        :param rank_columns: ['superkingdom', 'phylum', ..., 'species']
+        '''
+        self.get_columns = get_columns
+        self.rank_columns = list(rank_columns)
+        self.levels = {}   # level -> (group of each row, -1 for rows with a missing key; keys of the groups)
+        self.lock = threading.Lock()
+
+    def group_columns(self, level):
+        if level == 'TaxID':
+            return ['TaxID']
+        if level not in self.rank_columns:
+            raise ValueError('unknown taxonomic rank: {}'.format(level))
+        return self.rank_columns[:self.rank_columns.index(level) + 1]
+
+    def level(self, level):
+        with self.lock:
+            if level not in self.levels:
+                columns = self.group_columns(level)
+                grouped = self.get_columns(columns).groupby(columns, observed=True, sort=True)
+                # groups are numbered in key order, the order groupby(...).size() lists them in
+                group_ids = grouped.ngroup().to_numpy().astype(np.int32)
+                keys = grouped.size().index.to_frame(index=False)
+                self.levels[level] = (group_ids, keys)
+            return self.levels[level]
+
+    def counts(self, level, positions=None):
+        '''
+        Function to count the selected genomes per group of a level
+        :param level: 'TaxID' or a rank, e.g., 'genus' (grouped by superkingdom, ..., genus)
+        :param positions: row positions of the selected genomes, or None for all
+        :return: a dataframe of the group columns and Count, sorted by count (ties in key order)
+        '''
+        (group_ids, keys) = self.level(level)
+        if positions is not None:
+            group_ids = group_ids[positions]
+        counts = np.bincount(group_ids[group_ids >= 0], minlength=len(keys))
+        present = np.flatnonzero(counts)
+        table = keys.iloc[present].reset_index(drop=True)
+        table['Count'] = counts[present]
+        order = np.argsort(-counts[present], kind='stable')
+        return table.iloc[order].reset_index(drop=True)
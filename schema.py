@@ -0,0 +1,144 @@
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+RANK_COLUMNS = ['superkingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
+
+## compact dtypes of the final genome_df
+GENOME_DTYPES = {
+    'TaxID': 'int32',
+    'Genome size (Mb)': 'float32',
+    'GC%': 'float32',
+    'Chromosome': 'int16',
+    'Plasmid': 'int16',
+    'Genes': 'int32',
+    'Proteins': 'int32',
+}
+GENOME_DTYPES.update({rank: 'category' for rank in RANK_COLUMNS})
+
+## columns stored in the snapshot as suffixes of one shared prefix
+PREFIX_COLUMNS = ['Genome download (FTP Path)']
+
+
+def apply_schema(genome_df):
+    '''
+    Function to convert the columns of genome_df to their compact dtypes
+    :param genome_df: a genome_df without missing values in the integer columns
+    :return: the converted genome_df
+    '''
+    return genome_df.astype({col_name: dtype for col_name, dtype in GENOME_DTYPES.items() if col_name in genome_df.columns})
+
+
+def common_prefix(values):
+    if len(values) == 0:
+        return ''
+    # the common prefix of all strings is the common prefix of the smallest and the largest one
+    return os.path.commonprefix([values.min(), values.max()])
+
+
+def to_table(genome_df):
+    '''
+    Function to convert genome_df to an arrow table, storing PREFIX_COLUMNS as suffixes with the prefix in the schema metadata
+    '''
+    metadata = {}
+    for col_name in PREFIX_COLUMNS:
+        if col_name in genome_df.columns:
+            prefix = common_prefix(genome_df[col_name])
+            genome_df = genome_df.assign(**{col_name: genome_df[col_name].str.slice(len(prefix))})
+            metadata[('prefix:' + col_name).encode()] = prefix.encode()
+
+    table = pa.Table.from_pandas(genome_df, preserve_index=False)
+    return table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+
+
+def table_prefixes(table):
+    return {key[len(b'prefix:'):].decode(): prefix.decode() for key, prefix in (table.schema.metadata or {}).items() if key.startswith(b'prefix:')}
+
+
+def from_table(table):
+    '''
+    Function to convert an arrow table written by to_table back to genome_df
+    '''
+    genome_df = table.to_pandas()
+    for col_name, prefix in table_prefixes(table).items():
+        genome_df[col_name] = prefix + genome_df[col_name]
+    return genome_df
+
+
+def write_genome_df(genome_df, path):
+    table = to_table(genome_df)
+    # one uncompressed record batch, so that every column can be memory-mapped and viewed without a copy
+    feather.write_feather(table, path, compression='uncompressed', chunksize=max(table.num_rows, 1))
+
+
+def read_table(path):
+    '''
+    return the arrow table of a snapshot, memory-mapped: processes reading the same file share its page cache
+    '''
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+
+def read_genome_df(path):
+    return from_table(read_table(path))
+
+
+class SnapshotTable:
+    '''
+    A memory-mapped snapshot whose columns are converted to pandas on first use and shared afterwards
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.table = read_table(path)
+        self.prefixes = table_prefixes(self.table)
+        self.column_names = [col_name for col_name in self.table.column_names if col_name != 'index']
+        if 'index' in self.table.column_names:
+            self.index = pd.Index(self.table.column('index').to_numpy(), name='index')
+        else:
+            self.index = pd.RangeIndex(self.table.num_rows)
+        self.series = {}
+        self.frame = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def column(self, col_name):
+        '''
+        return a column as a Series; numeric columns are read-only views of the mapped file
+        '''
+        series = self.series.get(col_name)
+        if series is None:
+            with self.lock:
+                series = self.series.get(col_name)
+                if series is None:
+                    series = self.table.column(col_name).to_pandas()
+                    if col_name in self.prefixes:
+                        series = self.prefixes[col_name] + series
+                    series.index = self.index
+                    series.name = col_name
+                    self.series[col_name] = series
+        return series
+
+    def columns(self, col_names):
+        return pd.DataFrame({col_name: self.column(col_name) for col_name in col_names}, copy=False)
+
+    def take(self, positions, col_names=None):
+        '''
+        return the rows at positions as a dataframe, converting only those rows of the mapped file
+        :param col_names: default all the columns of to_pandas()
+        '''
+        col_names = self.column_names if col_names is None else col_names
+        df = self.table.select(col_names).take(pa.array(positions, type=pa.int64())).to_pandas()
+        for col_name in col_names:
+            if col_name in self.prefixes:
+                df[col_name] = self.prefixes[col_name] + df[col_name]
+        df.index = self.index[positions]
+        return df
+
+    def to_pandas(self):
+        if self.frame is None:
+            self.frame = self.columns(self.column_names)
+        return self.frame
@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from email.utils import formatdate
+
+from metrics import stage, timed
+
+logger = logging.getLogger(__name__)
+
+# one build lock per cache directory, shared by every SnapshotManager of the process
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+
+
+def get_build_lock(cache_path):
+    with _build_locks_guard:
+        return _build_locks.setdefault(os.path.abspath(cache_path), threading.Lock())
+
+
+class SnapshotManager:
+    '''
+    Keeps the last good genome_df snapshot in the cache directory and rebuilds it only when the source changed.
+
+    The source (prokaryotes.txt) is checked at most once per check_interval seconds with a conditional request
+    on its ETag/Last-Modified/size. While a rebuild runs in the background the previous snapshot keeps being
+    served; the new snapshot file is written aside and swapped in by atomically replacing snapshot.json.
+    '''
+    def __init__(self, url, cache_path, check_interval=3600, write_snapshot=None, history=None, cache_manager=None):
+        self.url = url
+        self.cache_path = cache_path
+        self.check_interval = check_interval
+        self.write_snapshot = write_snapshot or (lambda genome_df, path: genome_df.to_feather(path))
+        self.state_file = os.path.join(cache_path, 'snapshot.json')
+        self.build_lock = get_build_lock(cache_path)
+        self.build_thread = None
+        self.history = history  # SnapshotHistory recording every published snapshot, or None
+        self.cache_manager = cache_manager  # CacheManager enforcing the budgets of the cache after every publish, or None
+
+    def read_state(self):
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_state(self, state):
+        os.makedirs(self.cache_path, exist_ok=True)
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    def snapshot_file(self):
+        '''
+        return the path of the last good snapshot or None
+        '''
+        filename = self.read_state().get('file')
+        if filename and os.path.exists(os.path.join(self.cache_path, filename)):
+            return os.path.join(self.cache_path, filename)
+        return None
+
+    def version(self):
+        '''
+        return a key that changes whenever a new snapshot is swapped in
+        '''
+        return self.read_state().get('file')
+
+    def is_local_source(self):
+        return '://' not in self.url
+
+    def fetch_source(self, validators):
+        '''
+        Function to fetch the source if it changed since the snapshot was built
+        :param validators: {'etag', 'last_modified', 'size'} recorded with the current snapshot
+        :return: (validators of the source, path of the source file or None if it is unchanged, True if the file is a download)
+        '''
+        if self.is_local_source():
+            stat = os.stat(self.url)
+            new_validators = {'etag': None, 'last_modified': formatdate(stat.st_mtime, usegmt=True), 'size': stat.st_size}
+            if self.same_source(validators, new_validators):
+                return (new_validators, None, False)
+            return (new_validators, self.url, False)
+
+        request = urllib.request.Request(self.url)
+        if validators.get('etag'):
+            request.add_header('If-None-Match', validators['etag'])
+        if validators.get('last_modified'):
+            request.add_header('If-Modified-Since', validators['last_modified'])
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return (validators, None, False)
+            raise
+
+        with response:
+            size = response.headers.get('Content-Length')
+            new_validators = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'size': int(size) if size is not None else None,
+            }
+            # servers ignoring the conditional headers still answer with the same validators
+            if self.same_source(validators, new_validators):
+                return (new_validators, None, False)
+
+            os.makedirs(self.cache_path, exist_ok=True)
+            fd, source_file = tempfile.mkstemp(prefix='prokaryotes-', suffix='.txt.part', dir=self.cache_path)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    shutil.copyfileobj(response, f, 1024 * 1024)
+            except BaseException:
+                os.remove(source_file)   # an interrupted download is never built from
+                raise
+        return (new_validators, source_file, True)
+
+    def same_source(self, old, new):
+        if not old:
+            return False
+        if new.get('etag') and old.get('etag'):
+            return new['etag'] == old['etag']
+        return bool(new.get('last_modified')) and new.get('last_modified') == old.get('last_modified') and new.get('size') == old.get('size')
+
+    @timed('publish')
+    def publish(self, genome_df, validators=None):
+        '''
+        Function to write genome_df as the new snapshot and swap it in atomically
+        :param genome_df: the new snapshot
+        :param validators: validators of the source the snapshot was built from
+        :return: path of the new snapshot
+        '''
+        os.makedirs(self.cache_path, exist_ok=True)
+        built = datetime.now()
+        filename = 'genome_df' + built.strftime("-%Y-%m-%d-%H%M%S-%f") + '.feather'
+        tmp_file = os.path.join(self.cache_path, filename + '.tmp')
+        self.write_snapshot(genome_df.reset_index(drop=('index' in genome_df.columns)), tmp_file)
+        os.replace(tmp_file, os.path.join(self.cache_path, filename))
+
+        state = self.read_state()
+        state.update({'file': filename, 'built': built.isoformat(), 'checked': time.time(), 'source': validators or {}})
+        self.write_state(state)
+
+        if self.history is not None:
+            try:
+                with stage('record_history', rows_in=len(genome_df)):
+                    self.history.record(genome_df, os.path.splitext(filename)[0], built)
+            except Exception:
+                # the snapshot is served without its history entry; the next one is recorded against the last recorded version
+                logger.exception('snapshot history not recorded')
+        if self.cache_manager is not None:
+            with stage('enforce_cache_budget') as record:
+                evicted = self.cache_manager.enforce()
+                record.rows_out = len(evicted)
+            if evicted:
+                logger.info('evicted %d cache artifacts (%d bytes)', len(evicted), sum(artifact['bytes'] for artifact in evicted))
+        return os.path.join(self.cache_path, filename)
+
+    def rebuild(self, build, blocking=True):
+        '''
+        Function to rebuild the snapshot if the source changed
+        :param build: function making genome_df from the path or url of the source
+        :param blocking: wait for a rebuild already running instead of skipping
+        :return: True if a new snapshot was swapped in
+        '''
+        if not self.build_lock.acquire(blocking=blocking):
+            return False
+        try:
+            state = self.read_state()
+            validators = state.get('source', {}) if self.snapshot_file() else {}
+            new_validators, source_file, downloaded = self.fetch_source(validators)
+            if source_file is None:
+                state['checked'] = time.time()
+                self.write_state(state)
+                return False
+
+            try:
+                logger.info('building snapshot from %s', self.url)
+                genome_df = build(source_file)
+                self.publish(genome_df, new_validators)
+            finally:
+                if downloaded:
+                    os.remove(source_file)
+            return True
+        finally:
+            self.build_lock.release()
+
+    def rebuild_in_background(self, build):
+        try:
+            with stage('rebuild_in_background'):   # failures are counted in the errors of this stage
+                self.rebuild(build, blocking=False)
+        except Exception:
+            logger.exception('snapshot rebuild failed, serving the previous snapshot')
+            state = self.read_state()
+            state['checked'] = time.time()
+            self.write_state(state)
+
+    def refresh(self, build, background=True):
+        '''
+        Function to make sure a snapshot exists and to revalidate it against the source when it is due
+        :param build: function making genome_df from the path or url of the source
+        :param background: revalidate in a background thread while the current snapshot is served
+        '''
+        if self.snapshot_file() is None:
+            self.rebuild(build)
+            return
+
+        if time.time() - self.read_state().get('checked', 0) < self.check_interval:
+            return
+
+        if background:
+            if self.build_thread is None or not self.build_thread.is_alive():
+                self.build_thread = threading.Thread(target=self.rebuild_in_background, args=(build,), daemon=True)
+                self.build_thread.start()
+        else:
+            self.rebuild(build)
@@ -0,0 +1,156 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class SnapshotStats:
+    '''
+    Statistics of a snapshot computed once and stored next to it (<snapshot>.stats.npz), from which the year chart,
+    the correlation matrix and the column ranges of any selection are reductions over the selected rows:
+    - the release year of each genome as an integer (0 if its date could not be parsed)
+    - the numeric columns as float64 and their sufficient statistics (pairwise counts, sums, sums of squares and
+      sums of products of the values centered on the column means); these are additive, so a selection of most
+      rows is computed as the totals minus its unselected rows
+    - a quantile sketch of each numeric column: its values at SKETCH_SIZE evenly spaced ranks, min and max included
+    '''
+    ARRAYS = ['columns', 'years', 'values', 'sketch']
+    SKETCH_SIZE = 257
+
+    def __init__(self, arrays):
+        self.columns = [str(col_name) for col_name in arrays['columns']]
+        self.years = arrays['years']
+        self.values = arrays['values']
+        self.sketch = arrays['sketch']
+        self.valid = ~np.isnan(self.values)
+        counts = self.valid.sum(axis=0)
+        self.means = np.nansum(self.values, axis=0) / np.maximum(counts, 1)
+        self.total_sums = self.sums_of(slice(None))
+        self.total_years = self.bincount_years(self.years)
+
+    @classmethod
+    def build(cls, get_columns, numeric_columns, date_column='Release Date'):
+        '''
+        Function to compute the statistics of a snapshot
+        :param get_columns: function returning a dataframe of the given columns of genome_df
+        :param numeric_columns: columns of the correlation matrix and of the sketches
+        :return: SnapshotStats
+        '''
+        df = get_columns([date_column] + list(numeric_columns))
+        years = pd.to_datetime(df[date_column], errors='coerce').dt.year.fillna(0).to_numpy(dtype=np.int16)
+        values = np.column_stack([df[col_name].to_numpy(dtype=np.float64, na_value=np.nan) for col_name in numeric_columns]) if len(numeric_columns) else np.empty((len(df), 0))
+
+        sketch = np.full((len(numeric_columns), cls.SKETCH_SIZE), np.nan)
+        for (i, column) in enumerate(values.T):
+            column = np.sort(column[~np.isnan(column)])
+            if len(column):
+                sketch[i] = column[np.linspace(0, len(column) - 1, cls.SKETCH_SIZE).round().astype(np.int64)]
+        return cls({'columns': np.array(numeric_columns, dtype=str), 'years': years, 'values': values, 'sketch': sketch})
+
+    def save(self, path):
+        tmp_file = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, columns=np.array(self.columns, dtype=str), years=self.years, values=self.values, sketch=self.sketch)
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in cls.ARRAYS})
+
+    @classmethod
+    def open(cls, path, get_columns, numeric_columns):
+        '''
+        Function to load the statistics of a snapshot from path, computing and saving them first if needed
+        :param path: e.g., './cache/genome_df-....feather.stats.npz'
+        '''
+        if os.path.exists(path):
+            try:
+                stats = cls.load(path)
+                if stats.columns == list(numeric_columns):
+                    return stats
+            except (KeyError, ValueError):   # written by a version storing other arrays
+                pass
+        stats = cls.build(get_columns, numeric_columns)
+        stats.save(path)
+        return stats
+
+    def column_position(self, col_name):
+        if col_name not in self.columns:
+            raise ValueError('no statistics of column: {}'.format(col_name))
+        return self.columns.index(col_name)
+
+    def sums_of(self, rows):
+        valid = self.valid[rows].astype(np.float64)
+        x = np.where(self.valid[rows], self.values[rows] - self.means, 0.0)
+        # [i, j]: over the rows where both column i and column j have a value
+        return {'n': valid.T @ valid, 's': x.T @ valid, 'ss': (x * x).T @ valid, 'sp': x.T @ x}
+
+    def sums(self, positions=None):
+        '''
+        return the sufficient statistics of the selected rows: {'n', 's', 'ss', 'sp'}, each a matrix over column pairs
+        '''
+        if positions is None:
+            return self.total_sums
+        if 2 * len(positions) <= len(self.values):
+            return self.sums_of(positions)
+        unselected = np.ones(len(self.values), dtype=bool)
+        unselected[positions] = False
+        rest = self.sums_of(np.flatnonzero(unselected))
+        return {name: self.total_sums[name] - rest[name] for name in self.total_sums}
+
+    def correlation(self, positions=None, col_names=None):
+        '''
+        Function to compute the Pearson correlation matrix of the selected rows, as DataFrame.corr() does
+        (pairwise complete observations; NaN where a column does not vary)
+        :param positions: row positions of the selected genomes, or None for all
+        :param col_names: a subset of the columns, or None for all
+        :return: a dataframe
+        '''
+        sums = self.sums(positions)
+        (n, s, ss, sp) = (sums['n'], sums['s'], sums['ss'], sums['sp'])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = sp - s * s.T / n
+            var = ss - s * s / n   # [i, j]: variance of column i over the rows shared with column j
+            var = np.where(var > 1e-12 * ss, var, np.nan)   # rounding error of a constant column
+            corr = np.clip(cov / np.sqrt(var * var.T), -1.0, 1.0)
+        corr_df = pd.DataFrame(corr, index=self.columns, columns=self.columns)
+        if col_names is not None:
+            corr_df = corr_df.loc[col_names, col_names]
+        return corr_df
+
+    def bincount_years(self, years):
+        return np.bincount(years[years > 0], minlength=1)
+
+    def year_counts(self, positions=None):
+        '''
+        return a dataframe of the number of selected genomes released per year, indexed by Year
+        '''
+        counts = self.total_years if positions is None else self.bincount_years(self.years[positions])
+        years = np.flatnonzero(counts)
+        return pd.DataFrame({'Year': years, 'Count': counts[years]}).set_index('Year')
+
+    def column_range(self, col_name, positions=None):
+        '''
+        return (min, max) of a column over the selected rows, or None if they have no value
+        '''
+        i = self.column_position(col_name)
+        if positions is None:
+            (min_v, max_v) = (self.sketch[i, 0], self.sketch[i, -1])
+        else:
+            column = self.values[positions, i]
+            column = column[self.valid[positions, i]]
+            if len(column) == 0:
+                return None
+            (min_v, max_v) = (column.min(), column.max())
+        return None if np.isnan(min_v) else (float(min_v), float(max_v))
+
+    def quantiles(self, col_name, q, positions=None):
+        '''
+        return the q quantiles of a column: approximated from its sketch for all rows, exact for a selection
+        '''
+        i = self.column_position(col_name)
+        if positions is None:
+            return np.interp(q, np.linspace(0, 1, self.SKETCH_SIZE), self.sketch[i])
+        column = self.values[positions, i]
+        return np.quantile(column[self.valid[positions, i]], q)
@@ -0,0 +1,209 @@
+'''
+Synthetic GENOME_REPORTS/prokaryotes.txt files and a matching NCBI taxdump, for tests and benchmarks without NCBI.
+
+    python -m synthetic --rows 100000 --output ./synthetic
+'''
+import argparse
+import io
+import os
+import tarfile
+
+import numpy as np
+import pandas as pd
+
+PROKARYOTES_HEADER = [
+    '#Organism/Name', 'TaxID', 'BioProject Accession', 'BioProject ID', 'Group', 'SubGroup',
+    'Size (Mb)', 'GC%', 'Replicons', 'WGS', 'Scaffolds', 'Genes', 'Proteins', 'Release Date',
+    'Modify Date', 'Status', 'Center', 'BioSample Accession', 'Assembly Accession', 'Reference',
+    'FTP Path', 'Pubmed ID', 'Strain',
+]
+
+## share of the rows by Status, as in prokaryotes.txt
+STATUS_SHARES = {'Complete Genome': 0.55, 'Chromosome': 0.1, 'Scaffold': 0.2, 'Contig': 0.15}
+
+## children per parent from superkingdom down to species
+RANK_FANOUT = [('phylum', 8), ('class', 3), ('order', 3), ('family', 3), ('genus', 4), ('species', 5)]
+
+
+def _dmp(rows):
+    return ''.join('\t|\t'.join(str(v) for v in row) + '\t|\n' for row in rows).encode()
+
+
+def write_taxdump(dirpath, nodes, merged=()):
+    '''
+    Function to write a taxdump.tar.gz in the NCBI dump format
+    :param dirpath: output directory
+    :param nodes: [(taxid, parent taxid, rank, scientific name), ...]
+    :param merged: [(old taxid, current taxid), ...]
+    :return: the path of taxdump.tar.gz
+    '''
+    members = {
+        'nodes.dmp': _dmp((taxid, parent, rank) for taxid, parent, rank, name in nodes),
+        'names.dmp': _dmp((taxid, name, '', 'scientific name') for taxid, parent, rank, name in nodes),
+        'merged.dmp': _dmp(merged),
+        'delnodes.dmp': b'',
+    }
+    os.makedirs(dirpath, exist_ok=True)
+    path = os.path.join(dirpath, 'taxdump.tar.gz')
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+class SyntheticTaxonomy:
+    '''
+    A random taxonomy of Bacteria and Archaea with the NCBI ranks, strains under some species and merged TaxIDs
+    '''
+    def __init__(self, n_species, seed=0):
+        rng = np.random.default_rng(seed)
+        self.nodes = [(1, 1, 'no rank', 'root'), (131567, 1, 'no rank', 'cellular organisms'),
+                      (2, 131567, 'superkingdom', 'Bacteria'), (2157, 131567, 'superkingdom', 'Archaea')]
+        next_taxid = 3000000
+
+        # grow each rank until the species level holds about n_species taxa
+        scale = (n_species / np.prod([fanout for (rank, fanout) in RANK_FANOUT])) ** (1 / len(RANK_FANOUT))
+        level = [(2, 'Bacteria'), (2157, 'Archaea')]
+        genus_of = {}
+        for (rank, fanout) in RANK_FANOUT:
+            children = []
+            for (parent, parent_name) in level:
+                for i in range(max(1, int(rng.poisson(fanout * scale)))):
+                    name = '{}{}'.format(rank.capitalize(), next_taxid) if rank != 'species' else '{} sp{}'.format(genus_of[parent], next_taxid)
+                    self.nodes.append((next_taxid, parent, rank, name))
+                    if rank == 'genus':
+                        genus_of[next_taxid] = name
+                    children.append((next_taxid, name))
+                    next_taxid += 1
+            level = children
+        self.species = np.array([taxid for (taxid, name) in level], dtype=np.int64)
+        self.species_names = [name for (taxid, name) in level]
+
+        # strains: a third of the species, 1-3 strains each
+        self.strains = {}
+        for (taxid, name) in rng.permutation(np.array(level, dtype=object))[:len(level) // 3]:
+            self.strains[taxid] = []
+            for i in range(int(rng.integers(1, 4))):
+                self.nodes.append((next_taxid, taxid, 'strain', '{} strain {}'.format(name, i)))
+                self.strains[taxid].append(next_taxid)
+                next_taxid += 1
+
+        # merged: old TaxIDs of some species
+        self.merged = [(next_taxid + i, int(taxid)) for (i, taxid) in enumerate(rng.choice(self.species, size=max(1, len(self.species) // 50), replace=False))]
+
+    def write(self, dirpath):
+        return write_taxdump(dirpath, self.nodes, self.merged)
+
+
+def _choice(rng, shares, size):
+    return rng.choice(list(shares), size=size, p=np.array(list(shares.values())) / sum(shares.values()))
+
+
+def synthetic_prokaryotes(taxonomy, n_rows, seed=0, start=0):
+    '''
+    Function to make rows of prokaryotes.txt: a few species hold most genomes, GC% and size vary by species,
+    most genomes have one chromosome and some plasmids, and genomes that are not complete have no replicons
+    :param taxonomy: SyntheticTaxonomy
+    :param start: number of the first row (accessions are numbered from it)
+    :return: a dataframe of the PROKARYOTES_HEADER columns, all strings
+    '''
+    rng = np.random.default_rng((seed, start))
+    n_species = len(taxonomy.species)
+    weights = 1.0 / np.arange(1, n_species + 1) ** 1.1
+    species = rng.choice(n_species, size=n_rows, p=weights / weights.sum())
+    species_rng = np.random.default_rng(seed)
+    species_gc = species_rng.uniform(25, 72, n_species)
+    species_size = species_rng.lognormal(np.log(4), 0.35, n_species)
+
+    taxids = taxonomy.species[species].astype(object)
+    names = np.array(taxonomy.species_names, dtype=object)[species]
+    for (i, species_taxid) in enumerate(taxonomy.species[species]):
+        strains = taxonomy.strains.get(species_taxid)
+        if strains and rng.random() < 0.5:
+            taxids[i] = strains[rng.integers(len(strains))]
+    old_taxids = {new: old for (old, new) in taxonomy.merged}
+    merged_rows = np.flatnonzero(np.isin(taxonomy.species[species], list(old_taxids)) & (rng.random(n_rows) < 0.3))
+    taxids[merged_rows] = [old_taxids[taxonomy.species[species[i]]] for i in merged_rows]
+    taxids[rng.random(n_rows) < 0.002] = 99999999   # unknown to the taxonomy
+
+    status = _choice(rng, STATUS_SHARES, n_rows)
+    complete = status == 'Complete Genome'
+    size = species_size[species] * rng.lognormal(0, 0.1, n_rows)
+    gc = species_gc[species] + rng.normal(0, 1.0, n_rows)
+    genes = np.round(size * 950 * rng.normal(1, 0.03, n_rows)).astype(np.int64)
+    proteins = np.round(genes * rng.uniform(0.9, 0.98, n_rows)).astype(np.int64)
+    chromosomes = np.where(complete, rng.choice([1, 2, 3], size=n_rows, p=[0.9, 0.09, 0.01]), 0)
+    plasmids = np.where(complete, rng.poisson(0.6, n_rows), 0)
+    released = pd.to_datetime('1995-01-01') + pd.to_timedelta((29 * 365 * rng.beta(4, 1.5, n_rows)).astype(np.int64), unit='D')
+    released = released.strftime('%Y/%m/%d')
+
+    rows = np.arange(start, start + n_rows)
+    accessions = ['GCA_{:09d}.1'.format(row) for row in rows]
+    replicons = []
+    for (row, n_chromosomes, n_plasmids) in zip(rows, chromosomes, plasmids):
+        if n_chromosomes == 0:
+            replicons.append('-')
+            continue
+        parts = ['chromosome{}:CP{:06d}.{}'.format('' if n_chromosomes == 1 else ' ' + str(c + 1), row % 1000000, c + 1) for c in range(n_chromosomes)]
+        parts += ['plasmid p{}:CP{:06d}.{}'.format(p + 1, row % 1000000, n_chromosomes + p + 1) for p in range(n_plasmids)]
+        replicons.append('; '.join(parts))
+    missing_genes = rng.random(n_rows) < 0.01
+
+    return pd.DataFrame({
+        '#Organism/Name': names,
+        'TaxID': taxids.astype(str),
+        'BioProject Accession': ['PRJNA{}'.format(row) for row in rows],
+        'BioProject ID': rows.astype(str),
+        'Group': 'Proteobacteria',
+        'SubGroup': 'Gammaproteobacteria',
+        'Size (Mb)': np.char.mod('%.5g', size),
+        'GC%': np.char.mod('%.4g', gc),
+        'Replicons': replicons,
+        'WGS': np.where(complete, '-', 'AAAA01'),
+        'Scaffolds': np.where(complete, '1', '12'),
+        'Genes': np.where(missing_genes, '-', genes.astype(str)),
+        'Proteins': np.where(missing_genes, '-', proteins.astype(str)),
+        'Release Date': released,
+        'Modify Date': released,
+        'Status': status,
+        'Center': 'NCBI',
+        'BioSample Accession': ['SAMN{}'.format(row) for row in rows],
+        'Assembly Accession': accessions,
+        'Reference': '-',
+        'FTP Path': ['ftp://ftp.ncbi.nlm.nih.gov/genomes/all/GCA/{0}/{0}_ASM{1}v1'.format(accession, row) for (accession, row) in zip(accessions, rows)],
+        'Pubmed ID': '-',
+        'Strain': '-',
+    }, columns=PROKARYOTES_HEADER)
+
+
+def write_synthetic(dirpath, n_rows, seed=0, chunk_rows=100000):
+    '''
+    Function to write a synthetic prokaryotes.txt of n_rows rows and its taxdump.tar.gz
+    :param dirpath: output directory
+    :return: (path of prokaryotes.txt, path of taxdump.tar.gz)
+    '''
+    os.makedirs(dirpath, exist_ok=True)
+    taxonomy = SyntheticTaxonomy(n_species=min(max(n_rows // 20, 100), 50000), seed=seed)
+    taxdump_file = taxonomy.write(dirpath)
+    path = os.path.join(dirpath, 'prokaryotes.txt')
+    with open(path, 'w') as f:
+        for start in range(0, n_rows, chunk_rows):
+            df = synthetic_prokaryotes(taxonomy, min(chunk_rows, n_rows - start), seed=seed, start=start)
+            df.to_csv(f, sep='\t', index=False, header=(start == 0))
+    return (path, taxdump_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='synthetic', description='Write a synthetic prokaryotes.txt and taxdump.tar.gz.')
+    parser.add_argument('--rows', type=int, default=10000, help='rows of prokaryotes.txt')
+    parser.add_argument('--output', default='./synthetic', help='output directory')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    for path in write_synthetic(args.output, args.rows, args.seed):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
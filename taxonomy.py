@@ -0,0 +1,351 @@
+import csv
+import io
+import logging
+import os
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+TAXDUMP_URL = 'https://ftp.ncbi.nlm.nih.gov/pub/taxonomy/taxdump.tar.gz'
+
+
+def read_dmp(f, usecols, names):
+    '''
+    Function to read a taxdump .dmp file ('\\t|\\t' separated) with pandas' C parser
+    :param usecols: positions of the fields when the line is split on tabs, e.g., [0, 2, 4]
+    '''
+    return pd.read_csv(f, sep='\t', header=None, usecols=usecols, names=names, quoting=csv.QUOTE_NONE,
+                       dtype=str, keep_default_na=False, na_filter=False, engine='c')
+
+
+def open_taxdump_member(taxdump_file, name):
+    '''
+    return a binary file of a member of taxdump.tar.gz, or of a file in an unpacked taxdump directory
+    '''
+    if os.path.isdir(taxdump_file):
+        path = os.path.join(taxdump_file, name)
+        return open(path, 'rb') if os.path.exists(path) else None
+    with tarfile.open(taxdump_file, 'r:gz') as tar:
+        try:
+            return io.BytesIO(tar.extractfile(name).read())
+        except KeyError:
+            return None
+
+
+def fetch_taxdump(path, url=TAXDUMP_URL):
+    '''
+    Function to download taxdump.tar.gz to path
+    '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    logger.info('downloading %s', url)
+    fd, tmp_file = tempfile.mkstemp(prefix='taxdump-', suffix='.tar.gz.part', dir=os.path.dirname(path) or '.')
+    try:
+        with stage('fetch_taxdump'), os.fdopen(fd, 'wb') as f, urllib.request.urlopen(url) as response:
+            shutil.copyfileobj(response, f, 1024 * 1024)
+        os.replace(tmp_file, path)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return path
+
+
+def nested_intervals(parent):
+    '''
+    Function to number the nodes of a tree in depth-first preorder, children in row order
+    :param parent: row of the parent of each node; roots are their own parent
+    :return: (start, end): the number of each node and the last number in its subtree, so that
+             node y is in the subtree of node x iff start[x] <= start[y] <= end[x]
+    '''
+    n = len(parent)
+    rows = np.arange(n)
+    is_root = parent == rows
+
+    ## depth of every node, walking all nodes up one level at a time
+    depth = np.zeros(n, dtype=np.int32)
+    node = parent.astype(np.int64)
+    active = np.flatnonzero(~is_root)
+    while len(active):
+        depth[active] += 1
+        active = active[~is_root[node[active]]]
+        node[active] = parent[node[active]]
+
+    by_depth = np.argsort(depth, kind='stable')   # rows in depth order, row order within a depth
+    level_offsets = np.concatenate([[0], np.cumsum(np.bincount(depth))])
+    levels = [by_depth[level_offsets[d]:level_offsets[d + 1]] for d in range(len(level_offsets) - 1)]
+
+    ## subtree sizes, from the deepest level up
+    size = np.ones(n, dtype=np.int64)
+    for level in levels[:0:-1]:
+        size += np.bincount(parent[level], weights=size[level], minlength=n).astype(np.int64)
+
+    ## preorder numbers, from the roots down: a child starts after its parent and its preceding siblings' subtrees
+    start = np.zeros(n, dtype=np.int64)
+    if levels:
+        roots = levels[0]
+        start[roots] = np.cumsum(size[roots]) - size[roots]
+    for level in levels[1:]:
+        children = level[np.argsort(parent[level], kind='stable')]
+        preceding = np.cumsum(size[children]) - size[children]
+        first = np.r_[True, parent[children][1:] != parent[children][:-1]]
+        preceding -= np.maximum.accumulate(np.where(first, preceding, 0))
+        start[children] = start[parent[children]] + 1 + preceding
+    return (start.astype(np.int32), (start + size - 1).astype(np.int32))
+
+
+class CompactTaxonomy:
+    '''
+    The NCBI taxonomy as a few NumPy arrays, replacing ete3's SQLite database for lineage lookups.
+
+    Nodes are stored in TaxID order: taxids (sorted), parent (row of the parent node), rank (code into ranks)
+    and the scientific names as one utf-8 buffer sliced by name_offsets. merged_old/merged_new map obsolete
+    TaxIDs to current ones. clade_start/clade_end are the nested-set intervals of the nodes: every node of
+    the clade of x has its clade_start within [clade_start[x], clade_end[x]].
+    '''
+    ARRAYS = ['taxids', 'parent', 'rank', 'ranks', 'name_buffer', 'name_offsets', 'merged_old', 'merged_new', 'clade_start', 'clade_end']
+
+    def __init__(self, arrays, dbfile=None):
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.dbfile = dbfile   # the file the arrays were loaded from; its stamp versions the lineage store
+        self.name_index = None
+
+    @classmethod
+    def from_nodes(cls, nodes, names, merged):
+        '''
+        :param nodes: a dataframe of int taxid, int parent and rank
+        :param names: scientific name of each taxid (a Series indexed by int taxid)
+        :param merged: a dataframe of int old and new taxids
+        :return: CompactTaxonomy
+        '''
+        nodes = nodes.sort_values('taxid', ignore_index=True)
+        taxids = nodes['taxid'].to_numpy(dtype=np.int64)
+        parent = np.searchsorted(taxids, nodes['parent'].to_numpy(dtype=np.int64)).astype(np.int32)
+
+        encoded = [name.encode() for name in names.reindex(taxids, fill_value='')]
+        name_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in encoded], out=name_offsets[1:])
+
+        rank, ranks = pd.factorize(nodes['rank'])
+        merged = merged.sort_values('old')
+        (clade_start, clade_end) = nested_intervals(parent)
+
+        return cls({
+            'taxids': taxids,
+            'parent': parent,
+            'rank': rank.astype(np.int16),
+            'ranks': np.asarray(ranks, dtype=str),
+            'name_buffer': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+            'name_offsets': name_offsets,
+            'merged_old': merged['old'].to_numpy(dtype=np.int64),
+            'merged_new': merged['new'].to_numpy(dtype=np.int64),
+            'clade_start': clade_start,
+            'clade_end': clade_end,
+        })
+
+    @classmethod
+    def from_ete3(cls, dbfile):
+        '''
+        Function to read the taxonomy of an ete3 taxa.sqlite
+        '''
+        db = sqlite3.connect('file:{}?mode=ro'.format(urllib.request.pathname2url(os.path.abspath(dbfile))), uri=True)
+        try:
+            nodes = pd.read_sql_query('SELECT taxid, parent, rank, spname FROM species', db)
+            merged = pd.read_sql_query('SELECT taxid_old AS old, taxid_new AS new FROM merged', db)
+        finally:
+            db.close()
+        # ete3 stores the root without a parent; here the root is its own parent
+        nodes['parent'] = pd.to_numeric(nodes['parent'], errors='coerce').fillna(nodes['taxid']).astype(np.int64)
+        nodes = nodes.astype({'taxid': np.int64})
+        return cls.from_nodes(nodes, nodes.set_index('taxid')['spname'].fillna(''), merged.astype(np.int64))
+
+    @classmethod
+    def from_source(cls, source):
+        if os.path.isdir(source) or tarfile.is_tarfile(source):
+            return cls.from_taxdump(source)
+        return cls.from_ete3(source)
+
+    @classmethod
+    def from_taxdump(cls, taxdump_file):
+        '''
+        Function to ingest nodes.dmp, names.dmp and merged.dmp
+        :param taxdump_file: taxdump.tar.gz or a directory with the unpacked files
+        :return: CompactTaxonomy
+        '''
+        nodes = read_dmp(open_taxdump_member(taxdump_file, 'nodes.dmp'), [0, 2, 4], ['taxid', 'parent', 'rank'])
+        nodes = nodes.astype({'taxid': np.int64, 'parent': np.int64})
+
+        names = read_dmp(open_taxdump_member(taxdump_file, 'names.dmp'), [0, 2, 6], ['taxid', 'name', 'name_class'])
+        names = names.loc[names['name_class'] == 'scientific name'].drop_duplicates('taxid')
+        names = names.set_index(names['taxid'].astype(np.int64))['name']
+
+        merged_file = open_taxdump_member(taxdump_file, 'merged.dmp')
+        merged = read_dmp(merged_file, [0, 2], ['old', 'new']).astype(np.int64) if merged_file is not None else pd.DataFrame({'old': [], 'new': []}, dtype=np.int64)
+
+        return cls.from_nodes(nodes, names, merged)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, **{name: getattr(self, name) for name in self.ARRAYS})
+        os.replace(tmp_file, path)
+        self.dbfile = path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in cls.ARRAYS}, dbfile=path)
+
+    @classmethod
+    def open(cls, path, source):
+        '''
+        Function to load the arrays from path, ingesting source first if path is missing or older
+        :param path: e.g., './cache/taxonomy.npz'
+        :param source: taxdump.tar.gz (downloaded from NCBI if missing), an unpacked taxdump directory or an ete3 taxa.sqlite
+        :return: CompactTaxonomy
+        '''
+        if not os.path.exists(source) and not os.path.exists(path):
+            fetch_taxdump(source)
+        if os.path.exists(path) and (not os.path.exists(source) or os.stat(path).st_mtime >= os.stat(source).st_mtime):
+            try:
+                return cls.load(path)
+            except KeyError:   # written by a version storing fewer arrays
+                pass
+        logger.info('building compact taxonomy from %s', source)
+        with stage('build_compact_taxonomy') as record:
+            taxonomy = cls.from_source(source)
+            taxonomy.save(path)
+            record.rows_out = len(taxonomy)
+        return taxonomy
+
+    def __len__(self):
+        return len(self.taxids)
+
+    def node_rows(self, taxids):
+        '''
+        return the row of each TaxID (given as int or str), following merged TaxIDs; -1 for unknown TaxIDs
+        '''
+        int_ids = pd.to_numeric(pd.Series(list(taxids), dtype=object), errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+        rows = self.find(self.taxids, int_ids)
+        not_found = rows < 0
+        if not_found.any():
+            merged = self.find(self.merged_old, int_ids[not_found])
+            new_rows = np.full(len(merged), -1, dtype=np.int64)
+            new_rows[merged >= 0] = self.find(self.taxids, self.merged_new[merged[merged >= 0]])
+            rows[not_found] = new_rows
+        return rows
+
+    @staticmethod
+    def find(sorted_ids, ids):
+        if len(sorted_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[rows] == ids, rows, -1)
+
+    def names(self, rows):
+        return [bytes(self.name_buffer[self.name_offsets[row]:self.name_offsets[row + 1]]).decode() for row in rows]
+
+    def taxon_rows(self, taxa):
+        '''
+        return the rows of taxa given as TaxIDs or scientific names; unknown taxa are left out
+        '''
+        taxa = list(taxa)
+        is_taxid = [isinstance(taxon, (int, np.integer)) or str(taxon).strip().isdigit() for taxon in taxa]
+        rows = self.node_rows([taxon for taxon, taxid in zip(taxa, is_taxid) if taxid])
+        names = [str(taxon).strip() for taxon, taxid in zip(taxa, is_taxid) if not taxid]
+        if names:
+            # names are decoded only when a taxon is first looked up by name
+            if self.name_index is None:
+                self.name_index = pd.Index(self.names(range(len(self))))
+            rows = np.concatenate([rows, self.name_index.get_indexer_for(names)])
+        return np.unique(rows[rows >= 0])
+
+    def clade_intervals(self, taxa):
+        '''
+        return the sorted, disjoint clade_start intervals [(start, end), ...] covering the clades of taxa
+        '''
+        rows = self.taxon_rows(taxa)
+        intervals = []
+        for row in rows[np.argsort(self.clade_start[rows])]:
+            (start, end) = (int(self.clade_start[row]), int(self.clade_end[row]))
+            if intervals and start <= intervals[-1][1]:   # a clade nested in the previous one
+                continue
+            intervals.append((start, end))
+        return intervals
+
+    def clade_keys(self, taxids):
+        '''
+        return the clade_start of the node of each TaxID, -1 for unknown TaxIDs
+        '''
+        rows = self.node_rows(taxids)
+        return np.where(rows >= 0, self.clade_start[np.maximum(rows, 0)], -1).astype(np.int32)
+
+    def lineage_rows(self, rows, desired_ranks):
+        '''
+        Function to find, for each node, its nearest ancestor (or itself) at each desired rank, walking all nodes up at once
+        :param rows: node rows, -1 for none
+        :return: {rank: ancestor rows, -1 where the lineage has no node at the rank}
+        '''
+        rank_codes = {rank: np.flatnonzero(self.ranks == rank) for rank in desired_ranks}
+        rank_codes = {rank: codes[0] for rank, codes in rank_codes.items() if len(codes)}
+        found = {rank: np.full(len(rows), -1, dtype=np.int64) for rank in desired_ranks}
+        node = np.asarray(rows, dtype=np.int64).copy()
+        active = np.flatnonzero(node >= 0)
+        while len(active):
+            current = node[active]
+            current_rank = self.rank[current]
+            for rank, code in rank_codes.items():
+                hit = (current_rank == code) & (found[rank][active] < 0)
+                found[rank][active[hit]] = current[hit]
+            parent = self.parent[current]
+            moving = parent != current   # the root is its own parent
+            node[active] = parent
+            active = active[moving]
+        return found
+
+    def resolve_desired_ranks(self, taxids, desired_ranks):
+        '''
+        Function to get taxonomical information of many taxIDs as a few array operations
+        :param taxids: e.g., ['257', '562']
+        :param desired_ranks: taxonimical ranks
+        :return: lineage_df: a dataframe of taxids and their taxonomical information, missed_taxID: number of taxids not found
+        '''
+        taxids = list(taxids)
+        rows = self.node_rows(taxids)
+        lineage_df = pd.DataFrame({'TaxID': pd.Series(taxids, dtype=object)})
+        for rank, ancestors in self.lineage_rows(rows, desired_ranks).items():
+            ## names are decoded once per distinct node
+            unique_rows, inverse = np.unique(ancestors, return_inverse=True)
+            unique_names = np.array(self.names(np.maximum(unique_rows, 0)), dtype=object)
+            unique_names[unique_rows < 0] = '<not present>'
+            column = unique_names[inverse] if len(rows) else np.empty(0, dtype=object)
+            column[rows < 0] = None
+            lineage_df[rank] = column
+        missed_taxID = int((rows < 0).sum())
+        return (lineage_df, missed_taxID)
+
+
+_taxonomies = {}
+_taxonomies_lock = threading.Lock()
+
+
+def open_compact_taxonomy(path, source):
+    '''
+    return the CompactTaxonomy of path, loaded once per process and shared (its arrays are only read)
+    '''
+    with _taxonomies_lock:
+        key = os.path.abspath(path)
+        taxonomy = _taxonomies.get(key)
+        if taxonomy is None or not os.path.exists(path) or (os.path.exists(source) and os.stat(source).st_mtime > os.stat(path).st_mtime):
+            taxonomy = _taxonomies[key] = CompactTaxonomy.open(path, source)
+        return taxonomy
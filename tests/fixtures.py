@@ -0,0 +1,125 @@
+import os
+from contextlib import contextmanager
+
+import synthetic
+from synthetic import PROKARYOTES_HEADER
+
+## a tiny NCBI taxonomy: (taxid, parent taxid, rank, scientific name)
+TAXDUMP_NODES = [
+    (1, 1, 'no rank', 'root'),
+    (131567, 1, 'no rank', 'cellular organisms'),
+    (2, 131567, 'superkingdom', 'Bacteria'),
+    (1224, 2, 'phylum', 'Proteobacteria'),
+    (1236, 1224, 'class', 'Gammaproteobacteria'),
+    (91347, 1236, 'order', 'Enterobacterales'),
+    (543, 91347, 'family', 'Enterobacteriaceae'),
+    (561, 543, 'genus', 'Escherichia'),
+    (562, 561, 'species', 'Escherichia coli'),
+    (83333, 562, 'strain', 'Escherichia coli K-12'),
+    (1239, 2, 'phylum', 'Firmicutes'),
+    (91061, 1239, 'class', 'Bacilli'),
+    (1385, 91061, 'order', 'Bacillales'),
+    (186817, 1385, 'family', 'Bacillaceae'),
+    (1386, 186817, 'genus', 'Bacillus'),
+    (1423, 1386, 'species', 'Bacillus subtilis'),
+    (1428, 1386, 'species', 'Bacillus thuringiensis'),
+    (2157, 131567, 'superkingdom', 'Archaea'),
+    (28890, 2157, 'phylum', 'Euryarchaeota'),
+    (183963, 28890, 'class', 'Halobacteria'),
+    (2235, 183963, 'order', 'Halobacteriales'),
+    (1963268, 2235, 'family', 'Haloarculaceae'),
+    (2237, 1963268, 'genus', 'Haloarcula'),
+]
+
+## old taxid -> current taxid
+TAXDUMP_MERGED = [
+    (12345, 562),
+]
+
+DESIRED_RANKS = ['superkingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
+
+## (name, taxid, size, gc, replicons, genes, proteins, release date, status, assembly)
+PROKARYOTES_ROWS = [
+    ('Escherichia coli', '562', '4.64', '50.8', 'chromosome:NC_000913.3/U00096.3', '4494', '4298', '2001/10/15', 'Complete Genome', 'GCA_000005845.2'),
+    ('Escherichia coli', '562', '5.5', '50.5', 'chromosome:NZ_CP009072.1/CP009072.1; plasmid pO157:NZ_CP009073.1/CP009073.1', '5400', '5100', '2014/08/01', 'Complete Genome', 'GCA_000732965.1'),
+    ('Escherichia coli K-12', '83333', '4.6', '50.8', 'chromosome:NC_000913.3/U00096.3', '4400', '4200', '2013/09/26', 'Complete Genome', 'GCA_000801205.1'),
+    ('Escherichia coli', '12345', '4.9', '50.6', 'chromosome:CP000001.1', '4700', '4500', '2016/02/02', 'Complete Genome', 'GCA_000010245.1'),
+    ('Bacillus subtilis', '1423', '4.2', '43.5', 'chromosome:NC_000964.3/AL009126.3', '4400', '4200', '2002/01/01', 'Complete Genome', 'GCA_000009045.1'),
+    ('Bacillus thuringiensis', '1428', '6.3', '35.2', 'chromosome:CP010000.1; plasmid p1:CP010001.1; plasmid p2:CP010002.1', '6300', '6000', '2015/05/05', 'Complete Genome', 'GCA_000008505.1'),
+    ('Bacillus subtilis', '1423', '4.1', '43.4', '-', '4300', '4100', '2019/01/01', 'Scaffold', 'GCA_900000001.1'),
+    ('Haloarcula sp.', '2237', '3.9', '62.1', 'chromosome I:CP020001.1; chromosome II:CP020002.1', '3900', '3800', '2017/07/07', 'Complete Genome', 'GCA_002000001.1'),
+    ('Unknown bacterium', '99999999', '2.0', '40.0', 'chromosome:CP030001.1', '2000', '1900', '2018/08/08', 'Complete Genome', 'GCA_003000001.1'),
+    ('Bacillus thuringiensis', '1428', '6.0', '35.0', '-', '6000', '5800', '2020/02/02', 'Contig', 'GCA_900000002.1'),
+]
+
+
+def write_taxdump(dirpath, nodes=TAXDUMP_NODES, merged=TAXDUMP_MERGED):
+    '''
+    Function to write the tiny taxonomy as taxdump.tar.gz
+    :param dirpath: output directory
+    :return: the path of taxdump.tar.gz
+    '''
+    return synthetic.write_taxdump(dirpath, nodes, merged)
+
+
+@contextmanager
+def working_directory(path):
+    old_cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(old_cwd)
+
+
+def build_ncbitaxa(dirpath):
+    '''
+    Function to build an ete3 NCBITaxa database from the synthetic taxdump
+    :param dirpath: directory for taxdump.tar.gz, taxa.sqlite and ete3's temporary files
+    :return: NCBITaxa
+    '''
+    from ete3 import NCBITaxa
+
+    taxdump_file = write_taxdump(dirpath)
+    with working_directory(dirpath):
+        return NCBITaxa(dbfile=os.path.join(dirpath, 'taxa.sqlite'), taxdump_file=taxdump_file)
+
+
+def prokaryotes_text(rows=PROKARYOTES_ROWS):
+    '''
+    Function to render rows in the layout of GENOME_REPORTS/prokaryotes.txt
+    '''
+    lines = ['\t'.join(PROKARYOTES_HEADER)]
+    for i, (name, taxid, size, gc, replicons, genes, proteins, release, status, assembly) in enumerate(rows):
+        ftp = 'ftp://ftp.ncbi.nlm.nih.gov/genomes/all/GCA/{0}/{0}_ASM{1}v1'.format(assembly, i)
+        values = {
+            '#Organism/Name': name, 'TaxID': taxid, 'BioProject Accession': 'PRJNA%d' % i,
+            'BioProject ID': str(i), 'Group': 'Proteobacteria', 'SubGroup': 'Gammaproteobacteria',
+            'Size (Mb)': size, 'GC%': gc, 'Replicons': replicons, 'WGS': '-', 'Scaffolds': '1',
+            'Genes': genes, 'Proteins': proteins, 'Release Date': release, 'Modify Date': release,
+            'Status': status, 'Center': 'NCBI', 'BioSample Accession': 'SAMN%d' % i,
+            'Assembly Accession': assembly, 'Reference': '-', 'FTP Path': ftp, 'Pubmed ID': '-', 'Strain': '-',
+        }
+        lines.append('\t'.join(values[column] for column in PROKARYOTES_HEADER))
+    return '\n'.join(lines) + '\n'
+
+
+def write_prokaryotes(path, rows=PROKARYOTES_ROWS):
+    with open(path, 'w') as f:
+        f.write(prokaryotes_text(rows))
+    return path
+
+
+def load_ncbi_data(dirpath, rows=PROKARYOTES_ROWS):
+    '''
+    Function to build and load an NCBIdata snapshot from the synthetic prokaryotes.txt and taxdump
+    :param dirpath: directory for the fixture files and the cache
+    :return: NCBIdata
+    '''
+    from ncbi import NCBIdata
+
+    source = write_prokaryotes(os.path.join(dirpath, 'prokaryotes.txt'), rows)
+    ncbi_data = NCBIdata(cache_path=os.path.join(dirpath, 'cache'), url=source)
+    ncbi_data.taxdb_file = build_ncbitaxa(dirpath).dbfile
+    ncbi_data.load()
+    return ncbi_data
@@ -0,0 +1,62 @@
+import io
+import json
+import os
+import unittest
+import tempfile
+
+import pandas as pd
+
+import benchmark
+from ncbi import NCBIdata
+from synthetic import PROKARYOTES_HEADER, SyntheticTaxonomy, synthetic_prokaryotes, write_synthetic
+
+
+class TestSynthetic(unittest.TestCase):
+    def test_prokaryotes(self):
+        taxonomy = SyntheticTaxonomy(n_species=200)
+        df = synthetic_prokaryotes(taxonomy, 5000)
+        self.assertEqual(list(df.columns), PROKARYOTES_HEADER)
+        self.assertEqual(len(df), 5000)
+        self.assertTrue(df.equals(synthetic_prokaryotes(taxonomy, 5000)))   # the same rows for the same seed
+        self.assertEqual(df['Assembly Accession'].nunique(), 5000)
+        self.assertTrue((df.loc[df['Status'] != 'Complete Genome', 'Replicons'] == '-').all())
+        # a few species hold most genomes
+        self.assertGreater(df['#Organism/Name'].value_counts().iloc[:20].sum(), len(df) / 4)
+
+    def test_pipeline(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            (source, taxdump_file) = write_synthetic(tmpdir, 3000)
+            ncbi_data = NCBIdata(cache_path=os.path.join(tmpdir, 'cache'), url=source)
+            ncbi_data.taxdump_file = taxdump_file
+            genome_df = ncbi_data.load_from_ncbi()
+            n_complete = (pd.read_table(source, usecols=['Status'])['Status'] == 'Complete Genome').sum()
+            self.assertGreater(len(genome_df), 0.9 * n_complete)   # all but unknown TaxIDs and missing genes
+            self.assertEqual(set(genome_df['superkingdom']), {'Bacteria', 'Archaea'})
+            self.assertFalse((genome_df['species'] == '<not present>').any())
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run_and_compare(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'results.json')
+            self.assertEqual(benchmark.main(['--rows', '2000', '--repeat', '1', '--workdir', tmpdir, '--output', output]), 0)
+            with open(output) as f:
+                results = json.load(f)
+            stages = [result['stage'] for result in results['results']]
+            self.assertEqual(stages[:5], ['ingest', 'count_chro_plas', 'taxonomy', 'making_final_df', 'publish_and_open_snapshot'])
+            self.assertIn('apply_filter', stages)
+            self.assertTrue(all(result['peak_mb'] > 0 for result in results['results']))
+
+            slower = {**results, 'results': [{**result, 'seconds': result['seconds'] / 10} for result in results['results']]}
+            (rows, regressions) = benchmark.compare(slower, results)
+            self.assertEqual(len(rows), len(stages))
+            self.assertEqual(len(regressions), len(stages))
+            self.assertEqual(benchmark.compare(results, results)[1], [])
+
+            stdout = io.StringIO()
+            self.assertEqual(benchmark.main(['--rows', '2000', '--repeat', '1', '--no-memory', '--workdir', tmpdir, '--compare', output, '--threshold', '1000'], stdout), 0)
+            self.assertEqual(len(stdout.getvalue().splitlines()), len(stages))
+
+
+if __name__ == '__main__':
+    unittest.main()
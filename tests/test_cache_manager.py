@@ -0,0 +1,167 @@
+import io
+import os
+import time
+import unittest
+import tempfile
+
+from cache_backend import DiskCache
+from cache_manager import CacheManager, artifact_category
+import cpgminer
+from tests.fixtures import load_ncbi_data
+
+DAY = 24 * 3600
+
+
+class TestCacheManager(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_path = self.tmpdir.name
+        self.now = time.time()
+        # (relative path, bytes, days since last use)
+        self.files = [
+            ('snapshot.json', 10, 0),
+            ('genome_df-20260101.feather', 1000, 40),
+            ('genome_df-20260101.feather.stats.npz', 100, 40),
+            ('genome_df-20260201.feather', 1000, 20),
+            ('genome_df-20260301.feather', 1000, 1),
+            ('genome_df-20260301.feather.stats.npz', 100, 1),
+            ('original.feather', 500, 35),
+            ('step1.feather', 500, 2),
+            ('lineage.feather', 300, 90),
+            ('taxonomy.npz', 300, 90),
+            ('history/history.json', 10, 90),
+            ('functions/a.pickle', 200, 31),
+            ('functions/b.pickle', 200, 3),
+            ('genome_df-20260401.feather.tmp', 50, 0),
+            ('old.tmp', 50, 2),
+        ]
+        for (relative_path, size, days) in self.files:
+            self.write(relative_path, size, days)
+        self.write('snapshot.json', 0, 0, content='{"file": "genome_df-20260201.feather"}')
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def write(self, relative_path, size, days, content=None, root=None):
+        path = os.path.join(root or self.cache_path, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content if content is not None else 'x' * size)
+        os.utime(path, (self.now - days * DAY, self.now - days * DAY))
+        return path
+
+    def remaining(self):
+        return sorted(os.path.relpath(os.path.join(dirpath, f), self.cache_path).replace(os.sep, '/')
+                      for (dirpath, _, filenames) in os.walk(self.cache_path) for f in filenames)
+
+    def test_categories(self):
+        self.assertEqual(artifact_category('genome_df-20260101.feather.stats.npz'), 'snapshot')
+        self.assertEqual(artifact_category('genome_df-20260401.feather.tmp'), 'temporary')
+        self.assertEqual(artifact_category('prokaryotes-k2j4.txt.part'), 'temporary')
+        self.assertEqual(artifact_category('taxdump-8fz1.tar.gz.part'), 'temporary')
+        self.assertEqual(artifact_category('step3.feather'), 'intermediate')
+        self.assertEqual(artifact_category('taxonomy-ete3.npz'), 'taxonomy')
+        self.assertEqual(artifact_category('history/delta-v1.feather'), 'history')
+        self.assertEqual(artifact_category('functions/0123.pickle'), 'functions')
+        self.assertEqual(artifact_category('notes.txt'), 'other')
+
+    def test_artifacts(self):
+        artifacts = {artifact['key']: artifact for artifact in CacheManager(self.cache_path).artifacts(self.now)}
+        # a snapshot and its statistics are one artifact
+        self.assertEqual(artifacts['genome_df-20260101.feather']['bytes'], 1100)
+        self.assertEqual(len(artifacts['genome_df-20260101.feather']['paths']), 2)
+        self.assertNotIn('genome_df-20260101.feather.stats.npz', artifacts)
+        # the current snapshot and the latest one are pinned, young temporary files too
+        pinned = sorted(key for (key, artifact) in artifacts.items() if artifact['pinned'])
+        self.assertEqual(pinned, ['genome_df-20260201.feather', 'genome_df-20260301.feather', 'genome_df-20260401.feather.tmp',
+                                  'history/history.json', 'lineage.feather', 'snapshot.json', 'taxonomy.npz'])
+
+        usage_df = CacheManager(self.cache_path).usage(self.now)
+        self.assertEqual(usage_df.loc['snapshot', 'files'], 5)
+        self.assertEqual(usage_df.loc['snapshot', 'bytes'], 3200)
+        self.assertEqual(usage_df.loc['snapshot', 'pinned_bytes'], 2100)
+        self.assertEqual(usage_df.index[0], 'snapshot')
+
+    def test_age_budget(self):
+        evicted = CacheManager(self.cache_path).enforce(now=self.now)
+        self.assertEqual([artifact['key'] for artifact in evicted], ['genome_df-20260101.feather', 'original.feather', 'functions/a.pickle'])
+        self.assertNotIn('genome_df-20260101.feather.stats.npz', self.remaining())
+        self.assertIn('lineage.feather', self.remaining())
+        # with a budget of a day, the temporary file of two days is evicted as well
+        evicted = CacheManager(self.cache_path, max_age=DAY).enforce(now=self.now)
+        self.assertEqual([artifact['key'] for artifact in evicted], ['functions/b.pickle', 'step1.feather', 'old.tmp'])
+
+    def test_byte_budget(self):
+        total = sum(size for (_, size, _) in self.files)
+        manager = CacheManager(self.cache_path, max_bytes=total - 1200, max_age=None)
+        evicted = manager.enforce(now=self.now, dry_run=True)
+        # least recently used first, until the budget is met
+        self.assertEqual([artifact['key'] for artifact in evicted], ['genome_df-20260101.feather', 'original.feather'])
+        self.assertEqual(len(self.remaining()), len(self.files))
+        self.assertEqual(len(manager.enforce(now=self.now)), 2)
+        self.assertEqual(len(self.remaining()), len(self.files) - 3)
+        # pinned artifacts are never evicted, even over budget
+        evicted = CacheManager(self.cache_path, max_bytes=0, max_age=None).enforce(now=self.now)
+        self.assertEqual(self.remaining(), ['genome_df-20260201.feather', 'genome_df-20260301.feather', 'genome_df-20260301.feather.stats.npz',
+                                            'genome_df-20260401.feather.tmp', 'history/history.json', 'lineage.feather', 'snapshot.json', 'taxonomy.npz'])
+
+    def test_interrupted_downloads_and_unknown_files(self):
+        self.write('prokaryotes-old.txt.part', 400, 3)
+        self.write('taxdump-new.tar.gz.part', 400, 0)
+        self.write('notes.txt', 100, 60)
+        manager = CacheManager(self.cache_path, max_age=DAY)
+        artifacts = {artifact['key']: artifact for artifact in manager.artifacts(self.now)}
+        self.assertFalse(artifacts['notes.txt']['pinned'])
+        # a download younger than temporary_age may still be in progress
+        self.assertTrue(artifacts['taxdump-new.tar.gz.part']['pinned'])
+        evicted = [artifact['key'] for artifact in manager.enforce(now=self.now)]
+        self.assertIn('prokaryotes-old.txt.part', evicted)
+        self.assertIn('notes.txt', evicted)
+        self.assertIn('taxdump-new.tar.gz.part', self.remaining())
+
+    def test_extra_paths(self):
+        with tempfile.TemporaryDirectory() as streamlit_path:
+            self.write('old.memo', 100, 60, root=streamlit_path)
+            self.write('new.memo', 100, 0, root=streamlit_path)
+            manager = CacheManager(self.cache_path, extra_paths={'streamlit': streamlit_path})
+            self.assertEqual(manager.usage(self.now).loc['streamlit', 'files'], 2)
+            self.assertIn('streamlit:old.memo', [artifact['key'] for artifact in manager.enforce(now=self.now)])
+            self.assertEqual(os.listdir(streamlit_path), ['new.memo'])
+
+    def test_disk_cache_hit_marks_use(self):
+        disk_cache = DiskCache(os.path.join(self.cache_path, 'functions'))
+        square = disk_cache.wrap(lambda x: x * x)
+        self.assertEqual(square(3), 9)
+        (path,) = [os.path.join(self.cache_path, 'functions', f) for f in os.listdir(os.path.join(self.cache_path, 'functions'))
+                   if f not in ('a.pickle', 'b.pickle')]
+        os.utime(path, (self.now - 40 * DAY, self.now - 40 * DAY))
+        self.assertEqual(square(3), 9)
+        self.assertGreater(os.path.getmtime(path), self.now - DAY)
+
+    def test_cli(self):
+        stdout = io.StringIO()
+        self.assertEqual(cpgminer.main(['cache', '--cache', self.cache_path, '--max-age-days', '30', '--dry-run'], stdout), 0)
+        self.assertIn('would evict original.feather (500 bytes)', stdout.getvalue())
+        self.assertIn('original.feather', self.remaining())
+        stdout = io.StringIO()
+        self.assertEqual(cpgminer.main(['cache', '--cache', self.cache_path, '--max-bytes', '1K', '--max-age-days', '1000'], stdout), 0)
+        self.assertIn('evicted genome_df-20260101.feather (1,100 bytes)', stdout.getvalue())
+        self.assertEqual(cpgminer.parse_size('1.5G'), 3 * 2 ** 29)
+        self.assertEqual(cpgminer.parse_size('500mb'), 500 * 2 ** 20)
+
+
+class TestPublishEnforcesBudget(unittest.TestCase):
+    def test_previous_snapshot_evicted(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ncbi_data = load_ncbi_data(tmpdir)
+            first_snapshot = ncbi_data.snapshots.read_state()['file']
+            ncbi_data.cache_manager.max_bytes = 0
+            ncbi_data.snapshots.publish(ncbi_data.genome_df.iloc[:5])
+            ncbi_data.open_snapshot()
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, 'cache', first_snapshot)))
+            self.assertEqual(len(ncbi_data.genome_df), 5)
+            self.assertTrue(os.path.exists(os.path.join(tmpdir, 'cache', 'history', 'history.json')))
+
+
+if __name__ == '__main__':
+    unittest.main()
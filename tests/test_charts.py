@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from charts import MAX_BOX_OUTLIERS, box_statistics, boxplot_maker, density_bins, linear_fit, scatterplot_maker
+
+
+class TestCharts(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(0)
+        n = 100000
+        self.df = pd.DataFrame({
+            'GC%': rng.normal(50, 10, n).astype(np.float32),
+            'Genes': rng.lognormal(8, 0.5, n),
+            'Chromosome': rng.integers(1, 4, n).astype(np.int16),
+            'superkingdom': np.where(rng.random(n) < 0.1, 'Archaea', 'Bacteria'),
+        })
+
+    def test_box_statistics(self):
+        values = np.array([1, 2, 3, 4, 5, 6, 7, 8, 40, -30, np.nan])
+        box = box_statistics(values)
+        self.assertEqual((box['q1'], box['median'], box['q3']), (2.25, 4.5, 6.75))
+        self.assertEqual((box['lowerfence'], box['upperfence']), (1, 8))
+        self.assertEqual(box['outliers'].tolist(), [-30, 40])
+        self.assertEqual(box['count'], 10)
+        self.assertIsNone(box_statistics([np.nan]))
+
+        box = box_statistics(self.df['Genes'], max_outliers=100)
+        self.assertEqual(len(box['outliers']), 100)
+        self.assertGreater(box['n_outliers'], 100)
+        genes = self.df['Genes'].to_numpy()
+        self.assertIn(genes.max(), box['outliers'])   # the extremes are always drawn
+        self.assertIn(genes[genes > box['upperfence']].min(), box['outliers'])
+
+    def test_linear_fit(self):
+        (slope, intercept, r2) = linear_fit(self.df['GC%'], self.df['Genes'])
+        expected = stats.linregress(self.df['GC%'].astype(np.float64), self.df['Genes'])
+        self.assertAlmostEqual(slope, expected.slope)
+        self.assertAlmostEqual(intercept, expected.intercept, places=6)
+        self.assertAlmostEqual(r2, expected.rvalue ** 2)
+        self.assertIsNone(linear_fit([1, 1], [2, 3]))
+
+    def test_density_bins(self):
+        (x_centers, y_centers, counts) = density_bins(self.df['GC%'], self.df['Genes'], bins=50)
+        self.assertEqual(counts.shape, (50, 50))
+        self.assertEqual(counts.sum(), len(self.df))
+        self.assertEqual(len(x_centers), 50)
+
+    def test_payload_is_bounded(self):
+        fig = boxplot_maker.__wrapped__('Genes', self.df)
+        self.assertEqual(len(fig.data[1].y), MAX_BOX_OUTLIERS)
+        self.assertLess(len(fig.to_json()), 50000)
+
+        fig = scatterplot_maker.__wrapped__(['GC%', 'Genes'], self.df.iloc[:1000])
+        self.assertEqual({trace.type for trace in fig.data}, {'scattergl', 'scatter'})
+        fig = scatterplot_maker.__wrapped__(['GC%', 'Genes'], self.df)
+        self.assertEqual([trace.type for trace in fig.data], ['heatmap', 'scatter'])
+        self.assertLess(len(fig.to_json()), 200000)
+
+        fig = scatterplot_maker.__wrapped__(['GC%', 'Genes', 'Chromosome'], self.df)
+        self.assertLessEqual(sum(len(trace.x) for trace in fig.data), 5000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from column_index import ColumnIndex
+
+
+class TestColumnIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(7)
+        n = 2000
+        self.df = pd.DataFrame({
+            'genus': rng.choice(['Escherichia', 'Bacillus', 'Haloarcula', 'Vibrio', None], n),
+            'GC%': np.round(rng.uniform(25, 75, n), 1),
+            'Plasmid': rng.integers(0, 6, n).astype(float),
+        })
+        self.df.loc[rng.choice(n, 50, replace=False), 'GC%'] = np.nan
+        self.index = ColumnIndex(self.df, ['genus'], ['GC%', 'Plasmid'])
+
+    def expected(self, genera=None, ranges=()):
+        mask = np.ones(len(self.df), dtype=bool)
+        if genera is not None:
+            mask &= self.df['genus'].isin(genera).to_numpy()
+        for (col_name, min_v, max_v) in ranges:
+            mask &= self.df[col_name].between(min_v, max_v).to_numpy()
+        return np.flatnonzero(mask)
+
+    def test_select_matches_masks(self):
+        cases = [
+            (None, []),
+            (['Bacillus'], []),
+            (['Vibrio', 'Escherichia', 'Unknown'], [('GC%', 40.0, 60.0)]),
+            (None, [('GC%', 30.0, 31.0), ('Plasmid', 1.0, 2.0)]),
+            (['Haloarcula'], [('Plasmid', 0.0, 0.0), ('GC%', 25.0, 75.0)]),
+            (['Unknown'], [('GC%', 40.0, 60.0)]),
+            (None, [('GC%', 60.0, 40.0)]),
+        ]
+        for genera, ranges in cases:
+            rank_filter = ('genus', genera) if genera is not None else None
+            np.testing.assert_array_equal(self.index.select(rank_filter, ranges), self.expected(genera, ranges))
+
+    def test_any_ranges(self):
+        gc_ranges = [(30.0, 35.0), (50.0, 50.5), (70.0, 80.0)]
+        in_any = np.zeros(len(self.df), dtype=bool)
+        for (min_v, max_v) in gc_ranges:
+            in_any |= self.df['GC%'].between(min_v, max_v).to_numpy()
+
+        np.testing.assert_array_equal(self.index.select(None, [], [('GC%', gc_ranges)]), np.flatnonzero(in_any))
+        expected = np.flatnonzero(in_any & self.df['genus'].isin(['Bacillus']).to_numpy())
+        np.testing.assert_array_equal(self.index.select(('genus', ['Bacillus']), [], [('GC%', gc_ranges)]), expected)
+        self.assertEqual(len(self.index.select(None, [('Plasmid', 1.0, 2.0)], [('GC%', [])])), 0)
+
+    def test_missing_values_are_not_selected(self):
+        positions = self.index.select(None, [('GC%', -np.inf, np.inf)])
+        self.assertEqual(len(positions), len(self.df) - 50)
+        self.assertEqual(len(self.index.select(('genus', [None]))), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import io
+import os
+import subprocess
+import sys
+import unittest
+import tempfile
+
+import pandas as pd
+
+import cpgminer
+from cache_backend import DiskCache, MemoryCache, cache_data, set_cache_backend
+from tests.fixtures import build_ncbitaxa, write_prokaryotes
+
+
+class TestCpgminer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.cache_path = os.path.join(cls.tmpdir.name, 'cache')
+        cls.source = write_prokaryotes(os.path.join(cls.tmpdir.name, 'prokaryotes.txt'))
+        cls.taxdb_file = build_ncbitaxa(cls.tmpdir.name).dbfile
+        cls.build_output = cls.run_cli(['build', '--cache', cls.cache_path, '--url', cls.source, '--taxdb', cls.taxdb_file])
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        set_cache_backend(None)
+        cls.tmpdir.cleanup()
+
+    @staticmethod
+    def run_cli(argv):
+        stdout = io.StringIO()
+        cpgminer.main(argv, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_build(self):
+        self.assertIn('new snapshot built', self.build_output)
+        self.assertFalse(cpgminer.build(self.cache_path, self.source, self.taxdb_file))
+        self.assertTrue(cpgminer.build(self.cache_path, self.source, self.taxdb_file, force=True))
+
+    def test_select(self):
+        ncbi_data = cpgminer.open_snapshot(self.cache_path)
+        genome_df = cpgminer.select(ncbi_data, rank='genus', values=['Escherichia'], ranges={'GC%': (50.6, 60)}, columns=['GC%', 'genus'])
+        self.assertEqual(list(genome_df.columns), ['GC%', 'genus'])
+        self.assertEqual(len(genome_df), 3)
+
+        ncbi_data = cpgminer.open_snapshot(self.cache_path)
+        self.assertEqual(len(cpgminer.select(ncbi_data, rank='TaxID', values=['1423', '1428'])), 2)
+        with self.assertRaises(ValueError):
+            cpgminer.select(ncbi_data, ranges={'Size': (0, 1)})
+        with self.assertRaises(FileNotFoundError):
+            cpgminer.open_snapshot(os.path.join(self.tmpdir.name, 'empty'))
+
+    def test_query_counts(self):
+        output = self.run_cli(['query', '--cache', self.cache_path, '--rank', 'superkingdom', '--values', 'Bacteria', '--count-by', 'genus'])
+        counts = pd.read_csv(io.StringIO(output), sep='\t')
+        self.assertEqual(counts['genus'].tolist(), ['Escherichia', 'Bacillus'])
+        self.assertEqual(counts['Count'].tolist(), [4, 2])
+
+    def test_query_clade(self):
+        output = self.run_cli(['query', '--cache', self.cache_path, '--taxdb', self.taxdb_file, '--clade', 'Firmicutes', '561', '--columns', 'TaxID'])
+        self.assertEqual(sorted(pd.read_csv(io.StringIO(output), sep='\t')['TaxID']), [562, 562, 1423, 1428, 12345, 83333])
+
+    def test_export(self):
+        output = os.path.join(self.tmpdir.name, 'bacillus.parquet')
+        self.run_cli(['export', '--cache', self.cache_path, '--rank', 'genus', '--values', 'Bacillus', '--output', output])
+        genome_df = pd.read_parquet(output)
+        self.assertEqual(set(genome_df['species']), {'Bacillus subtilis', 'Bacillus thuringiensis'})
+
+    def test_import_without_streamlit(self):
+        code = 'import sys, cpgminer; print("streamlit" in sys.modules)'
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+        self.assertEqual(result.stdout.strip(), 'False')
+
+
+class TestCacheBackend(unittest.TestCase):
+    def tearDown(self) -> None:
+        set_cache_backend(None)
+
+    def test_memory_cache_ignores_underscore_arguments(self):
+        calls = []
+
+        @cache_data
+        def square(x, _log=None):
+            calls.append(x)
+            return x * x
+
+        set_cache_backend(MemoryCache())
+        self.assertEqual(square(3, _log='a'), 9)
+        self.assertEqual(square(3, _log='b'), 9)
+        self.assertEqual(square(x=4), 16)
+        self.assertEqual(calls, [3, 4])
+
+    def test_disk_cache_hashes_dataframes(self):
+        calls = []
+
+        @cache_data
+        def total(df):
+            calls.append(len(df))
+            return int(df['a'].sum())
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            set_cache_backend(DiskCache(tmpdir))
+            self.assertEqual(total(pd.DataFrame({'a': [1, 2]})), 3)
+            self.assertEqual(total(pd.DataFrame({'a': [1, 2]})), 3)
+            self.assertEqual(total(pd.DataFrame({'a': [1, 3]})), 4)
+            set_cache_backend(DiskCache(tmpdir))
+            self.assertEqual(total(pd.DataFrame({'a': [1, 3]})), 4)
+        self.assertEqual(calls, [2, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
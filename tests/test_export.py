@@ -0,0 +1,77 @@
+import gzip
+import io
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from export import EXPORT_FORMATS, export_file, format_of, iter_export
+
+
+def read_export(data, file_format):
+    if file_format == 'parquet':
+        return pd.read_parquet(io.BytesIO(data))
+    if file_format.endswith('.gz'):
+        data = gzip.decompress(data)
+    return pd.read_csv(io.BytesIO(data), sep='\t' if file_format.startswith('tsv') else ',')
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self) -> None:
+        n = 1000
+        self.df = pd.DataFrame({
+            'Genome Name': ['genome %d' % i for i in range(n)],
+            'GC%': np.linspace(25, 75, n).astype(np.float32),
+            'Plasmid': np.arange(n, dtype=np.int16) % 4,
+            'genus': pd.Categorical(np.where(np.arange(n) % 3, 'Bacillus', 'Escherichia')),
+        })
+
+    def test_round_trip_in_chunks(self):
+        for file_format in EXPORT_FORMATS:
+            chunks = list(iter_export(self.df, file_format, chunk_rows=128))
+            self.assertGreater(len(chunks), 1)
+            exported = read_export(b''.join(chunks), file_format)
+            self.assertEqual(exported['Genome Name'].tolist(), self.df['Genome Name'].tolist())
+            self.assertEqual(exported['Plasmid'].tolist(), self.df['Plasmid'].tolist())
+            self.assertEqual(exported['genus'].astype(str).tolist(), self.df['genus'].astype(str).tolist())
+
+    def test_empty_and_spooled(self):
+        exported = read_export(export_file(self.df.iloc[:0], 'tsv.gz').read(), 'tsv.gz')
+        self.assertEqual(list(exported.columns), list(self.df.columns))
+        self.assertEqual(len(exported), 0)
+
+        f = export_file(self.df, 'csv', chunk_rows=100, max_memory=1024)
+        self.assertTrue(f._rolled)   # larger than max_memory: written to disk, not held in memory
+        self.assertEqual(len(read_export(f.read(), 'csv')), len(self.df))
+
+    def test_format_of(self):
+        self.assertEqual(format_of('genome.tsv.gz'), 'tsv.gz')
+        self.assertEqual(format_of('genome.parquet'), 'parquet')
+        self.assertEqual(format_of('genome.txt'), 'csv')
+
+
+class TestExportButton(unittest.TestCase):
+    def test_download(self):
+        import streamlit as st
+        import main
+
+        df = pd.DataFrame({'Genome Name': ['a', 'b'], 'GC%': [50.5, 40.0]})
+        for file_format in EXPORT_FORMATS:
+            with mock.patch.object(st, 'button', return_value=True), \
+                 mock.patch.object(st, 'download_button', wraps=st.download_button) as download_button:
+                main.export_button(lambda: df, 'genome', 'genome_export_' + file_format, file_format=file_format)
+            (label, data) = download_button.call_args.args
+            self.assertIsInstance(data, bytes)
+            self.assertEqual(download_button.call_args.kwargs['file_name'], 'genome.' + file_format)
+            exported = read_export(data, file_format)
+            self.assertEqual(exported['Genome Name'].tolist(), ['a', 'b'])
+
+        # nothing is exported until the user asks for it
+        with mock.patch.object(st, 'download_button') as download_button:
+            main.export_button(lambda: self.fail('exported without a click'), 'genome', 'genome_export_unclicked', file_format='csv')
+        download_button.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
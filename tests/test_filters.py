@@ -0,0 +1,136 @@
+import unittest
+import tempfile
+from unittest import mock
+import numpy as np
+import pandas as pd
+
+from tests.fixtures import load_ncbi_data
+
+
+class TestFilters(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.ncbi = load_ncbi_data(cls.tmpdir.name)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.tmpdir.cleanup()
+
+    def test_sessions_share_data_but_not_filters(self):
+        session1 = self.ncbi.new_session()
+        session2 = self.ncbi.new_session()
+        session1.setFilter('Taxonomic Ranks', {'menu': 'genus', 'values': ['Bacillus']})
+        session2.setFilter('Taxonomic Ranks', {'menu': 'genus', 'values': []})
+
+        self.assertIs(session1.genome_df, self.ncbi.genome_df)
+        self.assertIs(session1.tax_items, session2.tax_items)
+        self.assertEqual(session1.filtered_df.shape[0], 2)
+        self.assertEqual(session2.filtered_df.shape[0], 7)
+        self.assertEqual(self.ncbi.filters, {})
+        self.assertIs(self.ncbi.filtered_df, self.ncbi.genome_df)
+
+    def set_sidebar_filters(self, session, menu, values, ranges):
+        session.setFilter('Taxonomic Ranks', {'menu': menu})
+        session.setFilter('Taxonomic Ranks', {'menu': menu, 'values': values})
+        for title, menu_item in self.ncbi.size_menus.items():
+            filter_item = {k: v for k, v in menu_item.items()}
+            filter_item['values'] = ranges.get(title, menu_item['range'])
+            filter_item['checked'] = title in ranges
+            session.setFilter(title, filter_item)
+
+    def test_staged_filters_are_evaluated_once(self):
+        session = self.ncbi.new_session()
+        with mock.patch.object(session, 'filter_positions', wraps=session.filter_positions) as filter_positions:
+            self.set_sidebar_filters(session, 'genus', ['Escherichia', 'Bacillus'], {'GC%': (40.0, 51.0), 'Genome Size': (4.5, 10.0)})
+            self.assertEqual(filter_positions.call_count, 0)
+            filtered_df = session.filtered_df
+            session.filtered_df
+            self.assertEqual(filter_positions.call_count, 1)
+
+        expected = self.ncbi.genome_df
+        expected = expected.loc[expected['genus'].isin(['Escherichia', 'Bacillus'])]
+        expected = expected.loc[expected['Genome size (Mb)'].between(4.5, 10.0)]
+        expected = expected.loc[expected['GC%'].between(40.0, 51.0)]
+        self.assertEqual(list(filtered_df.index), list(expected.index))
+        self.assertEqual(filtered_df.shape[0], 4)
+
+    def test_unchecked_ranges_are_ignored(self):
+        session = self.ncbi.new_session()
+        self.set_sidebar_filters(session, 'TaxID', [], {})
+        self.assertIs(session.filtered_df, self.ncbi.genome_df)
+
+        session.setFilter('Number of Plasmids', dict(self.ncbi.size_menus['Number of Plasmids'], values=(1.0, 2.0), checked=True))
+        self.assertEqual(sorted(session.filtered_df['Plasmid']), [1, 2])
+
+    def test_filter_results_are_shared_by_signature(self):
+        session1 = self.ncbi.new_session()
+        session2 = self.ncbi.new_session()
+        self.set_sidebar_filters(session1, 'genus', ['Escherichia', 'Bacillus'], {'GC%': (40.0, 51.0)})
+        self.set_sidebar_filters(session2, 'genus', ['Bacillus', 'Escherichia'], {'GC%': (40, 51)})
+        self.assertEqual(session1.filter_signature(), session2.filter_signature())
+
+        hits = self.ncbi.result_cache.stats()['hits']
+        session1.filtered_df
+        session2.filtered_df
+        self.assertEqual(self.ncbi.result_cache.stats()['hits'], hits + 1)
+
+        genus = self.ncbi.columns(['genus'])['genus']
+        counts = session1.cached_result('genus counts', lambda positions: genus.iloc[positions].value_counts(sort=False).loc[lambda counts: counts > 0])
+        self.assertIs(session2.cached_result('genus counts', lambda positions: None), counts)
+        # the sections' results go through the same cache
+        self.assertIs(session2.year_counts(), session1.year_counts())
+        self.assertEqual(counts.to_dict(), {'Escherichia': 4, 'Bacillus': 1})
+
+        session2.setFilter('Taxonomic Ranks', {'menu': 'genus', 'values': ['Bacillus']})
+        self.assertNotEqual(session1.filter_signature(), session2.filter_signature())
+
+    def test_clade_filter(self):
+        session = self.ncbi.new_session()
+        cases = [
+            (['1236'], {'Escherichia'}, 4),              # a class, by TaxID
+            (['Bacillus'], {'Bacillus'}, 2),             # a genus, by name
+            ([2, 'Bacillus', 'Firmicutes'], {'Escherichia', 'Bacillus'}, 6),   # nested clades
+            ([131567], {'Escherichia', 'Bacillus', 'Haloarcula'}, 7),         # an unranked node
+            (['83333'], {'Escherichia'}, 1),             # a strain below the species
+            (['Unknown taxon'], set(), 0),
+        ]
+        for taxa, genera, n_rows in cases:
+            session.set_clade_filter(taxa)
+            self.assertEqual(set(session.filtered_df['genus']), genera)
+            self.assertEqual(session.filtered_df.shape[0], n_rows)
+            np.testing.assert_array_equal(session.filter_positions(), np.flatnonzero(session.filter_mask()))
+
+        session.set_clade_filter(['Bacteria'])
+        session.setFilter('GC%', dict(self.ncbi.size_menus['GC%'], values=(40.0, 51.0), checked=True))
+        self.assertEqual(session.filtered_df.shape[0], 5)
+        session.set_clade_filter(['Archaea'])
+        self.assertEqual(session.filtered_df.shape[0], 0)
+
+    def test_pages(self):
+        session = self.ncbi.new_session()
+        genome_df = self.ncbi.genome_df
+        session.set_rank_filter('genus', ['Escherichia', 'Haloarcula'])
+        filtered_df = session.filtered_df
+        self.assertEqual(session.selected_count(), len(filtered_df))
+        self.assertEqual(session.display_columns(), list(genome_df.columns))
+
+        # pages of the snapshot order, of an ascending and of a descending sort, by numbers and by categories
+        pages = [session.page(start, 2) for start in range(0, 6, 2)]
+        pd.testing.assert_frame_equal(pd.concat(pages), filtered_df)
+        self.assertEqual(len(pages[-1]), 1)
+        for (col_name, ascending) in [('GC%', True), ('Genome size (Mb)', False), ('species', True), ('genus', False)]:
+            expected = filtered_df.sort_values(col_name, ascending=ascending, kind='stable')
+            page_df = pd.concat([session.page(start, 2, col_name, ascending) for start in range(0, 6, 2)])
+            self.assertEqual(page_df[col_name].astype(str).tolist(), expected[col_name].astype(str).tolist())
+            self.assertEqual(sorted(page_df.index), sorted(filtered_df.index))
+        self.assertEqual(session.page(10, 2).shape, (0, genome_df.shape[1]))
+
+        # the sort orders of the snapshot are computed once and shared by the sessions
+        self.assertIn('GC%', self.ncbi.sort_orders)
+        whole = self.ncbi.new_session().page(0, 100, 'GC%')
+        self.assertEqual(whole['GC%'].tolist(), sorted(genome_df['GC%']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import unittest
+import tempfile
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from history import HISTORY_KEY, SnapshotHistory
+from tests.fixtures import load_ncbi_data
+
+
+def genome_table(keys, gc, genus):
+    return pd.DataFrame({
+        'index': np.arange(len(keys)),
+        HISTORY_KEY: ['https://ftp/' + key for key in keys],
+        'GC%': np.array(gc, dtype=np.float32),
+        'genus': pd.Categorical(genus),
+    })
+
+
+class TestSnapshotHistory(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.history = SnapshotHistory(os.path.join(self.tmpdir.name, 'history'), keyframe_interval=2)
+        self.tables = {
+            'v1': genome_table(['a', 'b', 'c'], [50.1, 40.2, 60.3], ['Escherichia', 'Bacillus', 'Haloarcula']),
+            'v2': genome_table(['d', 'c', 'a', 'b'], [55.0, 60.3, 50.1, 41.0], ['Bacillus', 'Haloarcula', 'Escherichia', 'Bacillus']),   # d added, b changed, reordered
+            'v3': genome_table(['d', 'a', 'e'], [55.0, 50.1, 30.0], ['Bacillus', 'Escherichia', 'Clostridium']),   # b and c removed, e added
+            'v4': genome_table(['d', 'a', 'e'], [55.0, 50.5, 30.0], ['Bacillus', 'Escherichia', 'Clostridium']),   # a changed
+        }
+        for (day, (version, genome_df)) in enumerate(self.tables.items(), start=1):
+            self.history.record(genome_df, version, datetime(2026, 1, day, 12))
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def expected(self, version):
+        return self.tables[version].drop(columns=['index']).sort_values(HISTORY_KEY).reset_index(drop=True)
+
+    def test_reconstruct(self):
+        self.assertEqual([entry['full'] for entry in self.history.versions()], [True, False, True, False])
+        for version in self.tables:
+            pd.testing.assert_frame_equal(self.history.table(version), self.expected(version), check_categorical=False)
+        self.assertEqual(self.history.table('v3')['genus'].dtype, 'category')
+        self.assertEqual(self.history.table('v2', keys=['https://ftp/b'])['GC%'].tolist(), [np.float32(41.0)])
+
+    def test_deltas(self):
+        summary_df = self.history.summary()
+        self.assertEqual(summary_df[['rows', 'added', 'changed', 'removed']].values.tolist(), [[3, 3, 0, 0], [4, 1, 1, 0], [3, 1, 0, 2], [3, 0, 1, 0]])
+        # only the hashes of the latest version are kept
+        self.assertEqual(sorted(f for f in os.listdir(self.history.path) if f.startswith('hashes')), ['hashes-v4.feather'])
+
+    def test_diff(self):
+        def changes(old_version, new_version=None):
+            diff_df = self.history.diff(old_version, new_version)
+            return {(key[len('https://ftp/'):], change) for (key, change) in zip(diff_df[HISTORY_KEY], diff_df['Change'])}
+
+        self.assertEqual(changes('v1', 'v2'), {('d', 'added'), ('b', 'changed')})
+        self.assertEqual(changes('v1'), {('d', 'added'), ('e', 'added'), ('a', 'changed'), ('b', 'removed'), ('c', 'removed')})
+        self.assertEqual(changes('v2', 'v3'), {('e', 'added'), ('b', 'removed'), ('c', 'removed')})
+        self.assertEqual(changes('v4'), set())
+        # removed rows keep their last values, changed rows have their new ones
+        diff_df = self.history.diff('v1').set_index(HISTORY_KEY)
+        self.assertEqual(diff_df.loc['https://ftp/b', 'GC%'], np.float32(41.0))
+        self.assertEqual(diff_df.loc['https://ftp/a', 'GC%'], np.float32(50.5))
+        with self.assertRaises(ValueError):
+            self.history.diff('v3', 'v1')
+        with self.assertRaises(KeyError):
+            self.history.diff('v0')
+
+    def test_version_at(self):
+        self.assertEqual(self.history.version_at(date(2026, 1, 2)), 'v2')
+        self.assertEqual(self.history.version_at(datetime(2026, 1, 2, 6)), 'v1')
+        self.assertIsNone(self.history.version_at(date(2025, 12, 31)))
+
+    def test_without_hashes_file(self):
+        os.remove(self.history.hashes_file('v4'))
+        self.history.record(self.tables['v1'], 'v5', datetime(2026, 1, 5))
+        self.assertEqual(self.history.versions()[-1]['added'], 2)
+        self.assertEqual(self.history.versions()[-1]['removed'], 2)
+        pd.testing.assert_frame_equal(self.history.table('v5'), self.expected('v1'), check_categorical=False)
+
+
+class TestWhatsNew(unittest.TestCase):
+    def test_changes_since(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ncbi_data = load_ncbi_data(tmpdir)
+            self.assertIsNone(ncbi_data.changes_since())
+
+            genome_df = ncbi_data.genome_df.copy()
+            genome_df.loc[genome_df['genus'] == 'Haloarcula', 'Genes'] = 4000
+            genome_df = genome_df[genome_df['species'] != 'Bacillus thuringiensis']
+            ncbi_data.snapshots.publish(genome_df)
+            ncbi_data.open_snapshot()
+
+            changes_df = ncbi_data.changes_since()
+            self.assertEqual(sorted(changes_df['Change']), ['changed', 'removed'])
+            self.assertEqual(set(changes_df['genus']), {'Haloarcula', 'Bacillus'})
+            pd.testing.assert_frame_equal(ncbi_data.changes_since(days=30), changes_df)
+
+
+if __name__ == '__main__':
+    unittest.main()
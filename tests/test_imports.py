@@ -0,0 +1,43 @@
+import os
+import re
+import subprocess
+import sys
+import unittest
+
+## seconds `import main` may take on top of streamlit and pandas, which every start needs (CPGMINER_IMPORT_BUDGET overrides it)
+IMPORT_BUDGET = float(os.environ.get('CPGMINER_IMPORT_BUDGET', 0.3))
+
+## imported only by the sections and pipeline stages using them (streamlit itself loads plotly's lazy graph_objects)
+LAZY_MODULES = ['ete3', 'matplotlib', 'seaborn', 'scipy', 'plotly.express', 'statsmodels']
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_in_subprocess(module, preload=()):
+    '''
+    Function to import a module in a new interpreter
+    :param preload: modules imported first, not counted in the import time
+    :return: (cumulative import time of the module in seconds, the LAZY_MODULES it loaded)
+    '''
+    code = 'import sys\n{}import {}\nprint(" ".join(m for m in {!r} if m in sys.modules))'.format(
+        ''.join('import {}\n'.format(m) for m in preload), module, LAZY_MODULES)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, cwd=REPO_PATH)
+    if result.returncode != 0:
+        raise AssertionError(result.stderr)
+    microseconds = re.search(r'^import time:\s+\d+ \|\s+(\d+) \| {}$'.format(re.escape(module)), result.stderr, re.MULTILINE)
+    return (int(microseconds.group(1)) / 1e6, result.stdout.split())
+
+
+class TestImports(unittest.TestCase):
+    def test_main_cold_start(self):
+        (seconds, loaded) = import_in_subprocess('main', preload=['streamlit', 'pandas'])
+        self.assertEqual(loaded, [])
+        self.assertLess(seconds, IMPORT_BUDGET)
+
+    def test_cli_cold_start(self):
+        (seconds, loaded) = import_in_subprocess('cpgminer')
+        self.assertEqual(loaded, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import unittest
+import tempfile
+from unittest import mock
+import numpy as np
+import pandas as pd
+
+from ncbi import NCBIdata, parse_replicons
+from tests.fixtures import build_ncbitaxa, write_prokaryotes
+
+
+class TestIngest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = write_prokaryotes(os.path.join(self.tmpdir.name, 'prokaryotes.txt'))
+        self.ncbi = NCBIdata(cache_path=os.path.join(self.tmpdir.name, 'cache'), url=self.source)
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def test_chunked_read_matches_full_read(self):
+        full_df = self.ncbi.read_complete_genomes(self.source)
+        for chunksize in [1, 3, 100]:
+            chunked_df = self.ncbi.read_complete_genomes(self.source, chunksize=chunksize)
+            pd.testing.assert_frame_equal(chunked_df, full_df)
+
+    def test_header_only_report(self):
+        with open(self.source) as f:
+            header = f.readline()
+        with open(self.source, 'w') as f:
+            f.write(header)
+        full_df = self.ncbi.read_complete_genomes(self.source)
+        self.assertEqual(full_df.shape[0], 0)
+        self.assertEqual(full_df.columns[0], 'Genome Name')
+        pd.testing.assert_frame_equal(self.ncbi.read_complete_genomes(self.source, chunksize=2), full_df)
+        # some pandas versions give no chunk at all for a file without rows
+        with mock.patch('ncbi.pd.read_table', return_value=iter([])):
+            pd.testing.assert_frame_equal(self.ncbi.read_complete_genomes(self.source, chunksize=2), full_df)
+
+    def test_only_complete_genomes_are_kept(self):
+        genome_df = self.ncbi.read_complete_genomes(self.source, chunksize=2)
+
+        self.assertEqual(genome_df.shape[0], 8)
+        self.assertNotIn('Status', genome_df.columns)
+        self.assertEqual(genome_df.columns[0], 'Genome Name')
+        self.assertEqual(list(genome_df.index), list(range(8)))
+        self.assertTrue(pd.api.types.is_numeric_dtype(genome_df['Genes']))
+        self.assertAlmostEqual(genome_df['GC%'].iloc[0], 50.8)
+
+    def test_load_from_ncbi(self):
+        self.ncbi.ingest_chunksize = 4
+        self.ncbi.taxdb_file = build_ncbitaxa(self.tmpdir.name).dbfile
+        genome_df = self.ncbi.load_from_ncbi()
+
+        # the complete genome of an unknown taxID is dropped
+        self.assertEqual(genome_df.shape[0], 7)
+        self.assertEqual(sorted(genome_df['Chromosome'].tolist()), [1, 1, 1, 1, 1, 1, 2])
+        self.assertEqual(sorted(genome_df['Plasmid'].tolist()), [0, 0, 0, 0, 0, 1, 2])
+        self.assertEqual(set(genome_df['genus']), {'Escherichia', 'Bacillus', 'Haloarcula'})
+
+    def test_count_chro_plas(self):
+        genome_df = pd.DataFrame({'Replicons': [
+            'chromosome:NC_000913.3/U00096.3',
+            'chromosome I:CP020001.1; chromosome II:CP020002.1; plasmid pA:CP020003.1',
+            'Chromosome:CP1.1; plasmidX:CP2.1',
+            np.nan,
+            '-',
+        ]}, index=[10, 11, 12, 13, 14])
+        genome_df = self.ncbi.count_chro_plas(genome_df)
+
+        self.assertEqual(genome_df['Chromosome'].tolist(), [1, 2, 1, 0, 0])
+        self.assertEqual(genome_df['Plasmid'].tolist(), [0, 1, 0, 0, 0])
+        self.assertEqual(list(genome_df.index), [10, 11, 12, 13, 14])
+
+    def test_parse_replicons_accessions(self):
+        replicons_df = parse_replicons(pd.Series([
+            'chromosome:NZ_CP009072.1/CP009072.1; plasmid pO157:NZ_CP009073.1/CP009073.1',
+            None,
+        ]))
+        self.assertEqual(replicons_df['Accessions'].tolist(), [['NZ_CP009072.1/CP009072.1', 'NZ_CP009073.1/CP009073.1'], []])
+
+
+if __name__ == '__main__':
+    unittest.main()
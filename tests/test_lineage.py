@@ -0,0 +1,155 @@
+import os
+import socket
+import unittest
+import tempfile
+import warnings
+from unittest import mock
+import pandas as pd
+
+import metrics
+from ncbi import NCBIdata, LineageStore, resolve_desired_ranks, resolve_desired_ranks_parallel
+from tests.fixtures import DESIRED_RANKS, build_ncbitaxa
+
+
+class TestLineage(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.ncbi = build_ncbitaxa(cls.tmpdir.name)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.ncbi.db.close()
+        cls.tmpdir.cleanup()
+
+    def get_lineage_one_by_one(self, taxid):
+        '''
+        the per-taxID lookup the batch resolver replaces
+        '''
+        lineage_list = [taxid]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            lineage = self.ncbi.get_lineage(taxid)
+        ranks2lineage = dict((rank, node) for (node, rank) in self.ncbi.get_rank(lineage).items())
+        for rank in DESIRED_RANKS:
+            node = ranks2lineage.get(rank)
+            lineage_list.append(self.ncbi.get_taxid_translator([node])[node] if node else '<not present>')
+        return lineage_list
+
+    def test_batch_matches_single_lookups(self):
+        taxids = ['562', '83333', '1423', '1428', '2237', '12345']
+        lineage_df, missed = resolve_desired_ranks(taxids, DESIRED_RANKS, ncbi=self.ncbi)
+
+        self.assertEqual(missed, 0)
+        self.assertEqual(list(lineage_df.columns), ['TaxID'] + DESIRED_RANKS)
+        for i, taxid in enumerate(taxids):
+            self.assertEqual(lineage_df.iloc[i].tolist(), self.get_lineage_one_by_one(taxid))
+
+    def test_missed_taxids(self):
+        lineage_df, missed = resolve_desired_ranks(['562', '99999999', 'abc', ''], DESIRED_RANKS, ncbi=self.ncbi, chunk_size=1)
+
+        self.assertEqual(missed, 3)
+        self.assertEqual(lineage_df.shape, (4, 8))
+        self.assertEqual(lineage_df.loc[0, 'species'], 'Escherichia coli')
+        self.assertTrue(lineage_df.iloc[1:, 1:].isna().all().all())
+        self.assertEqual(lineage_df.dropna().shape[0], 1)
+
+    def test_parallel_matches_sequential(self):
+        taxids = ['562', '83333', '1423', '99999999', '1428', '2237', '12345', '562', 'abc']
+        lineage_df, missed = resolve_desired_ranks(taxids, DESIRED_RANKS, ncbi=self.ncbi)
+        parallel_df, parallel_missed = resolve_desired_ranks_parallel(taxids, DESIRED_RANKS, self.ncbi.dbfile, workers=2, chunk_size=2)
+
+        self.assertEqual(parallel_missed, missed)
+        self.assertTrue(parallel_df.equals(lineage_df))
+
+    def test_parallel_with_metrics_port(self):
+        # workers inherit the environment of the dashboard: importing ncbi must not serve the metrics port again
+        with socket.socket() as sock:
+            sock.bind(('', 0))
+            sock.listen()
+            with mock.patch.dict(os.environ, {metrics.PORT_ENV: str(sock.getsockname()[1])}):
+                parallel_df, parallel_missed = resolve_desired_ranks_parallel(['562', '1423', '99999999'], DESIRED_RANKS, self.ncbi.dbfile, workers=2, chunk_size=1)
+        self.assertEqual(parallel_missed, 1)
+        self.assertEqual(parallel_df.set_index('TaxID').loc['1423', 'genus'], 'Bacillus')
+
+    def test_making_final_df(self):
+        ncbi_data = NCBIdata(cache_path=self.tmpdir.name)
+        ncbi_data.taxdb_file = self.ncbi.dbfile
+        genome_df = pd.DataFrame({
+            'Genome Name': ['a', 'b', 'c'],
+            'TaxID': ['562', '2237', '99999999'],
+            'Size (Mb)': ['4.6', '3.9', '2.0'],
+            'GC%': ['50.8', '62.1', '40.0'],
+            'Replicons': ['chromosome:A', 'chromosome:B', 'chromosome:C'],
+            'Chromosome': [1, 1, 1],
+            'Plasmid': [0, 0, 0],
+            'Genes': ['1', '2', '3'],
+            'Proteins': ['1', '2', '3'],
+            'Release Date': ['2001/10/15', '2017/07/07', '2018/08/08'],
+            'FTP Path': ['ftp://a', 'ftp://b', 'ftp://c'],
+        })
+        final_df = ncbi_data.making_final_df(genome_df)
+
+        self.assertEqual(final_df.shape[0], 2)
+        self.assertEqual(final_df.loc[final_df['TaxID'] == 2237, 'species'].iloc[0], '<not present>')
+        self.assertEqual(final_df['Genome download (FTP Path)'].tolist(), ['https://a', 'https://b'])
+        self.assertEqual(final_df['TaxID'].dtype, 'int32')
+        self.assertEqual(final_df['genus'].dtype, 'category')
+        self.assertEqual(final_df['Plasmid'].dtype, 'int16')
+        self.assertEqual(final_df['Genes'].dtype, 'int32')
+        self.assertEqual(final_df['Proteins'].dtype, 'int32')
+        self.assertEqual(final_df['GC%'].dtype, 'float32')
+
+
+class TestLineageStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.ncbi = build_ncbitaxa(self.tmpdir.name)
+        self.store = LineageStore(os.path.join(self.tmpdir.name, 'cache', 'lineage.feather'), DESIRED_RANKS)
+
+    def tearDown(self) -> None:
+        self.ncbi.db.close()
+        self.tmpdir.cleanup()
+
+    def lookup(self, taxids):
+        with mock.patch('ncbi.resolve_desired_ranks', wraps=resolve_desired_ranks) as resolver:
+            lineage_df, missed = self.store.lookup(taxids, self.ncbi)
+        resolved = [taxid for call in resolver.call_args_list for taxid in call.args[0]]
+        return lineage_df, missed, sorted(resolved)
+
+    def test_only_new_taxids_are_resolved(self):
+        lineage_df, missed, resolved = self.lookup(['562', '1423', '99999999'])
+        self.assertEqual(resolved, ['1423', '562', '99999999'])
+        self.assertEqual(missed, 1)
+        self.assertEqual(lineage_df.shape, (3, 8))
+
+        lineage_df, missed, resolved = self.lookup(['562', '1423', '99999999', '2237'])
+        self.assertEqual(resolved, ['2237'])
+        self.assertEqual(missed, 1)
+        self.assertEqual(set(lineage_df['TaxID']), {'562', '1423', '99999999', '2237'})
+        self.assertEqual(lineage_df.set_index('TaxID').loc['1423', 'genus'], 'Bacillus')
+
+        lineage_df, missed, resolved = self.lookup(['562'])
+        self.assertEqual(resolved, [])
+        self.assertEqual(lineage_df.shape, (1, 8))
+
+    def test_parallel_lookup(self):
+        self.store.parallel_min_taxids = 0
+        with mock.patch('ncbi.resolve_desired_ranks_parallel', wraps=resolve_desired_ranks_parallel) as resolver:
+            lineage_df, missed = self.store.lookup(['562', '1423', '99999999'], self.ncbi, workers=2)
+        self.assertEqual(sorted(resolver.call_args.args[0]), ['1423', '562', '99999999'])
+        self.assertEqual(missed, 1)
+        self.assertEqual(lineage_df.set_index('TaxID').loc['1423', 'genus'], 'Bacillus')
+
+    def test_taxonomy_update_invalidates_store(self):
+        self.lookup(['562', '1423'])
+        stat = os.stat(self.ncbi.dbfile)
+        os.utime(self.ncbi.dbfile, (stat.st_atime, stat.st_mtime + 86400))
+
+        lineage_df, missed, resolved = self.lookup(['562', '1423'])
+        self.assertEqual(resolved, ['1423', '562'])
+        self.assertEqual(missed, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
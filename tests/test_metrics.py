@@ -0,0 +1,147 @@
+import io
+import json
+import os
+import unittest
+import tempfile
+import tracemalloc
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+
+import cpgminer
+import metrics
+from metrics import NULL_STAGE, StageMetrics, set_metrics, stage, timed
+from tests.fixtures import load_ncbi_data
+
+
+@timed('double')
+def double(df):
+    return pd.concat([df, df])
+
+
+class TestStageMetrics(unittest.TestCase):
+    def tearDown(self) -> None:
+        set_metrics(None)
+
+    def test_off(self):
+        def rows_in():
+            raise AssertionError('rows_in is only counted while metrics are on')
+
+        with stage('off', rows_in=rows_in) as record:
+            record.rows_out = 3
+        self.assertIs(stage('off'), NULL_STAGE)
+        self.assertEqual(len(double(pd.DataFrame({'a': [1, 2]}))), 4)
+
+    def test_stages(self):
+        stage_metrics = StageMetrics()
+        set_metrics(stage_metrics)
+        double(pd.DataFrame({'a': [1, 2, 3]}))
+        double(pd.DataFrame({'a': [1]}))
+        with stage('select', rows_in=lambda: 10, selection=lambda: 'genus=Bacillus') as record:
+            record.rows_out = 4
+        with self.assertRaises(ValueError):
+            with stage('select', rows_in=10, selection='genus=Escherichia'):
+                raise ValueError()
+
+        summary = {stage['stage']: stage for stage in stage_metrics.summary()}
+        self.assertEqual(list(summary), ['double', 'select'])
+        self.assertEqual((summary['double']['calls'], summary['double']['rows_in'], summary['double']['rows_out']), (2, 1, 2))
+        self.assertEqual((summary['select']['calls'], summary['select']['errors']), (2, 1))
+        self.assertGreaterEqual(summary['double']['seconds_total'], summary['double']['seconds_max'])
+        self.assertIsNone(summary['double']['peak_bytes'])
+        self.assertEqual({(group['stage'], group['selection']) for group in stage_metrics.by_selection()},
+                         {('double', None), ('select', 'genus=Bacillus'), ('select', 'genus=Escherichia')})
+        self.assertEqual(stage_metrics.events[-1]['error'], 'ValueError')
+
+    def test_memory(self):
+        stage_metrics = StageMetrics(memory=True)
+        set_metrics(stage_metrics)
+        with stage('outer'):
+            with stage('inner'):
+                inner = np.ones(2 ** 20)   # 8 MB
+            del inner
+            outer = np.ones(2 ** 18)   # 2 MB
+        summary = {stage['stage']: stage for stage in stage_metrics.summary()}
+        self.assertGreaterEqual(summary['inner']['peak_bytes'], 8 * 2 ** 20)
+        # the peak of a nested stage is a peak of the stage around it
+        self.assertGreaterEqual(summary['outer']['peak_bytes'], summary['inner']['peak_bytes'])
+        self.assertLess(summary['outer']['peak_bytes'], 12 * 2 ** 20)
+        set_metrics(None)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_formats(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            stage_metrics = StageMetrics(os.path.join(tmpdir, 'metrics.prom'))
+            set_metrics(stage_metrics)
+            double(pd.DataFrame({'a': [1, 2, 3]}))
+            metrics.write_metrics()
+            with open(os.path.join(tmpdir, 'metrics.prom')) as f:
+                text = f.read()
+            self.assertIn('# TYPE cpgminer_stage_seconds_total counter', text)
+            self.assertIn('cpgminer_stage_calls{stage="double"} 1', text)
+            self.assertIn('cpgminer_stage_rows_out{stage="double"} 6', text)
+            self.assertNotIn('cpgminer_stage_peak_bytes{', text)
+
+            stage_metrics.write(os.path.join(tmpdir, 'metrics.json'))
+            with open(os.path.join(tmpdir, 'metrics.json')) as f:
+                results = json.load(f)
+            self.assertEqual(results['stages'][0]['rows_in'], 3)
+            self.assertEqual(len(results['events']), 1)
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['metrics.json', 'metrics.prom'])
+
+    def test_environment_and_server(self):
+        stage_metrics = metrics.configure_from_environment({metrics.PORT_ENV: '0', metrics.MEMORY_ENV: '1'})
+        self.assertIsNone(stage_metrics.path)
+        self.assertTrue(stage_metrics.memory)
+        double(pd.DataFrame({'a': [1, 2, 3]}))
+        port = metrics.serve(0).server_address[1]
+        with urlopen('http://localhost:{}/metrics'.format(port)) as response:
+            self.assertIn('cpgminer_stage_calls{stage="double"} 1', response.read().decode())
+        with urlopen('http://localhost:{}/metrics.json'.format(port)) as response:
+            self.assertEqual(json.load(response)['stages'][0]['stage'], 'double')
+
+
+class TestPipelineMetrics(unittest.TestCase):
+    def tearDown(self) -> None:
+        set_metrics(None)
+
+    def test_pipeline_stages(self):
+        stage_metrics = StageMetrics()
+        set_metrics(stage_metrics)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ncbi_data = load_ncbi_data(tmpdir)
+            session = ncbi_data.new_session()
+            session.set_rank_filter('genus', ['Bacillus'])
+            filtered_df = session.filtered_df
+
+            summary = {stage['stage']: stage for stage in stage_metrics.summary()}
+            for name in ['load', 'publish', 'load_from_ncbi', 'read_complete_genomes', 'count_chro_plas', 'making_final_df', 'open_snapshot', 'apply_filter', 'filter_positions']:
+                self.assertIn(name, summary)
+            self.assertEqual(summary['making_final_df']['rows_out'], ncbi_data.row_count())
+            self.assertEqual(summary['apply_filter']['rows_in'], ncbi_data.row_count())
+            self.assertEqual(summary['apply_filter']['rows_out'], len(filtered_df))
+            self.assertIn('Bacillus', stage_metrics.events[-1]['selection'])
+
+            # a failed background rebuild is logged and counted as an error of its stage
+            ncbi_data.snapshots.url = ncbi_data.url
+            os.utime(ncbi_data.url, (0, 0))
+            def failing_build(source):
+                raise ValueError('bad row')
+            with self.assertLogs('snapshot', 'ERROR') as logs:
+                ncbi_data.snapshots.rebuild_in_background(failing_build)
+            self.assertIn('ValueError: bad row', logs.output[0])
+            rebuild = {stage['stage']: stage for stage in stage_metrics.summary()}['rebuild_in_background']
+            self.assertEqual((rebuild['errors'], rebuild['last_error']), (1, 'ValueError: bad row'))
+
+            output = os.path.join(tmpdir, 'metrics.json')
+            stdout = io.StringIO()
+            self.assertEqual(cpgminer.main(['--metrics', output, 'query', '--cache', ncbi_data.cache_path, '--rank', 'genus', '--values', 'Bacillus'], stdout), 0)
+            with open(output) as f:
+                stages = [stage['stage'] for stage in json.load(f)['stages']]
+            self.assertIn('open_snapshot', stages)
+            self.assertIsNone(metrics.get_metrics())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+
+from result_cache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = ResultCache()
+        calls = []
+        compute = lambda: calls.append(1) or np.arange(10)
+
+        cache.get_or_compute('a', 'positions', compute)
+        cache.get_or_compute('a', 'positions', compute)
+        cache.get_or_compute('a', 'year counts', compute)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 2)
+        self.assertEqual(cache.stats()['bytes'], 2 * np.arange(10).nbytes)
+
+    def test_lru_eviction_by_entries(self):
+        cache = ResultCache(max_entries=2)
+        cache.get_or_compute('a', 'positions', lambda: 1)
+        cache.get_or_compute('b', 'positions', lambda: 2)
+        cache.get_or_compute('a', 'positions', lambda: 1)   # 'a' becomes the most recent
+        cache.get_or_compute('c', 'positions', lambda: 3)
+
+        self.assertEqual(list(cache.entries), [('a', 'positions'), ('c', 'positions')])
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_eviction_by_bytes(self):
+        cache = ResultCache(max_bytes=3000)
+        cache.get_or_compute('a', 'positions', lambda: np.zeros(200))
+        cache.get_or_compute('b', 'positions', lambda: np.zeros(200))
+        self.assertEqual(list(cache.entries), [('b', 'positions')])
+        self.assertLessEqual(cache.stats()['bytes'], 3000)
+
+        # a result larger than the whole budget is returned but not kept
+        value = cache.get_or_compute('c', 'positions', lambda: np.zeros(1000))
+        self.assertEqual(len(value), 1000)
+        self.assertEqual(list(cache.entries), [('b', 'positions')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import tempfile
+from unittest import mock
+
+from ncbi import count_tableMaker_groupby
+from tests.fixtures import load_ncbi_data
+
+
+class TestRollupCube(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.ncbi = load_ncbi_data(cls.tmpdir.name)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.tmpdir.cleanup()
+
+    def assert_same_table(self, counts, expected):
+        key_columns = list(expected.columns[:-1])
+        self.assertEqual(list(counts.columns), list(expected.columns))
+        self.assertTrue((counts['Count'].diff().dropna() <= 0).all())
+        self.assertEqual(sorted(map(tuple, counts.astype(str).values)), sorted(map(tuple, expected.astype(str).values)))
+        self.assertEqual(list(counts.dtypes[key_columns]), list(expected.dtypes[key_columns]))
+
+    def test_matches_groupby(self):
+        for genera in ([], ['Escherichia', 'Haloarcula']):
+            session = self.ncbi.new_session()
+            session.set_rank_filter('genus', genera)
+            for rank in ['Phylum', 'Class', 'Order', 'Family', 'Genus', 'Species']:
+                expected = count_tableMaker_groupby(rank, session.filtered_df)
+                self.assert_same_table(session.rank_counts(rank.lower()), expected)
+
+    def test_taxid_and_superkingdom(self):
+        session = self.ncbi.new_session()
+        session.set_range_filter('GC%', 45.0, 70.0)
+        counts = session.rank_counts('TaxID')
+        self.assertEqual(dict(zip(counts['TaxID'], counts['Count'])), session.filtered_df['TaxID'].value_counts().to_dict())
+        self.assertEqual(counts['TaxID'].iloc[0], 562)
+
+        counts = session.rank_counts('superkingdom')
+        self.assertEqual(counts.values.tolist(), [['Bacteria', 4], ['Archaea', 1]])
+        with self.assertRaises(ValueError):
+            session.rank_counts('strain')
+
+    def test_levels_are_grouped_once(self):
+        ncbi_data = load_ncbi_data(self.tmpdir.name)
+        with mock.patch.object(ncbi_data.rollup, 'get_columns', wraps=ncbi_data.rollup.get_columns) as get_columns:
+            for genera in (['Bacillus'], ['Escherichia'], []):
+                session = ncbi_data.new_session()
+                session.set_rank_filter('genus', genera)
+                session.rank_counts('genus')
+            self.assertEqual(get_columns.call_count, 1)
+        self.assertEqual(session.rank_counts('genus')['Count'].tolist(), [4, 2, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import unittest
+import tempfile
+import numpy as np
+import pyarrow.feather as feather
+
+from schema import read_genome_df, write_genome_df
+from tests.fixtures import load_ncbi_data
+
+
+class TestSchema(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.ncbi = load_ncbi_data(self.tmpdir.name)
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def test_snapshot_round_trip(self):
+        path = os.path.join(self.tmpdir.name, 'genome_df.feather')
+        genome_df = self.ncbi.genome_df.reset_index()
+        write_genome_df(genome_df, path)
+
+        table = feather.read_table(path)
+        self.assertEqual(table.schema.metadata[b'prefix:Genome download (FTP Path)'], b'https://ftp.ncbi.nlm.nih.gov/genomes/all/GCA/GCA_00')
+        self.assertTrue(table.column('Genome download (FTP Path)')[0].as_py().startswith('0005845.2/'))
+        self.assertTrue(str(table.schema.field('genus').type).startswith('dictionary'))
+
+        loaded_df = read_genome_df(path)
+        self.assertTrue(loaded_df.equals(genome_df))
+        self.assertEqual(list(loaded_df.dtypes), list(genome_df.dtypes))
+
+    def test_loaded_dtypes(self):
+        genome_df = self.ncbi.genome_df
+        self.assertEqual(genome_df['TaxID'].dtype, 'int32')
+        self.assertEqual(genome_df['Chromosome'].dtype, 'int16')
+        self.assertEqual(genome_df['Genes'].dtype, 'int32')
+        self.assertEqual(genome_df['species'].dtype, 'category')
+        self.assertEqual(self.ncbi.tax_items['TaxID'], [562, 1423, 1428, 2237, 12345, 83333])
+        self.assertIn('Bacillus', self.ncbi.tax_items['genus'])
+
+    def test_columns_are_read_lazily(self):
+        snapshot_table = self.ncbi.snapshot_table
+        self.assertIsNone(snapshot_table.frame)
+        self.assertNotIn('Genome Name', snapshot_table.series)
+
+        gc = self.ncbi.columns(['GC%'])['GC%']
+        self.assertTrue(np.shares_memory(self.ncbi.columns(['GC%'])['GC%'].to_numpy(), gc.to_numpy()))
+        # numeric columns are views of the memory-mapped file, not copies
+        self.assertFalse(gc.to_numpy().flags.writeable)
+        self.assertNotIn('Genome Name', snapshot_table.series)
+
+        genome_df = self.ncbi.genome_df
+        self.assertIs(self.ncbi.genome_df, genome_df)
+        self.assertEqual(genome_df.index.name, 'index')
+        self.assertTrue(genome_df['Genome download (FTP Path)'].str.startswith('https://').all())
+
+    def test_filtered_columns(self):
+        self.ncbi.setFilter('Taxonomic Ranks', {'menu': 'genus', 'values': ['Bacillus']})
+        filtered_df = self.ncbi.filtered_columns(['GC%', 'genus'])
+        self.assertEqual(list(filtered_df.columns), ['GC%', 'genus'])
+        self.assertEqual(set(filtered_df['genus']), {'Bacillus'})
+        np.testing.assert_array_equal(filtered_df.index, self.ncbi.filtered_df.index)
+
+    def test_pages_are_read_lazily(self):
+        snapshot_table = self.ncbi.snapshot_table
+        self.ncbi.setFilter('Taxonomic Ranks', {'menu': 'genus', 'values': ['Escherichia']})
+        page_df = self.ncbi.page(1, 2, 'GC%', ascending=False)
+        # the rows of the page are taken from the mapped file without converting its columns
+        self.assertIsNone(snapshot_table.frame)
+        self.assertNotIn('Genome Name', snapshot_table.series)
+        self.assertNotIn('Genome download (FTP Path)', snapshot_table.series)
+        expected = self.ncbi.filtered_df.sort_values('GC%', ascending=False, kind='stable')
+        self.assertEqual(page_df['GC%'].tolist(), expected['GC%'].tolist()[1:3])
+        self.assertEqual(page_df.dtypes.to_dict(), expected.dtypes.to_dict())
+        self.assertTrue(page_df['Genome download (FTP Path)'].str.startswith('https://').all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import hashlib
+import threading
+import unittest
+from unittest import mock
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ncbi import NCBIdata
+from tests.fixtures import PROKARYOTES_ROWS, build_ncbitaxa, prokaryotes_text
+
+
+class ProkaryotesHandler(BaseHTTPRequestHandler):
+    '''
+    stand-in for the NCBI server: serves server.body with an ETag and answers conditional requests with 304
+    '''
+    def do_GET(self):
+        server = self.server
+        etag = '"%s"' % hashlib.md5(server.body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            server.requests.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        server.requests.append(200)
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', server.last_modified)
+        self.send_header('Content-Length', str(len(server.body)))
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.taxdb_file = build_ncbitaxa(self.tmpdir.name).dbfile
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ProkaryotesHandler)
+        self.server.body = prokaryotes_text().encode()
+        self.server.last_modified = 'Mon, 01 Jan 2024 00:00:00 GMT'
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/prokaryotes.txt' % self.server.server_address[1]
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def new_ncbi_data(self):
+        ncbi_data = NCBIdata(cache_path=os.path.join(self.tmpdir.name, 'cache'), url=self.url)
+        ncbi_data.taxdb_file = self.taxdb_file
+        return ncbi_data
+
+    def test_first_load_builds_snapshot(self):
+        ncbi_data = self.new_ncbi_data()
+        ncbi_data.load()
+
+        self.assertEqual(ncbi_data.row_count(), 7)
+        self.assertEqual(self.server.requests, [200])
+        state = ncbi_data.snapshots.read_state()
+        self.assertEqual(state['source']['size'], len(self.server.body))
+        self.assertTrue(state['source']['etag'])
+        self.assertEqual([f for f in os.listdir(ncbi_data.cache_path) if f.endswith('.part')], [])
+
+        # a second session within the check interval neither requests nor rebuilds
+        self.new_ncbi_data().load()
+        self.assertEqual(self.server.requests, [200])
+
+    def test_unchanged_source_is_not_rebuilt(self):
+        ncbi_data = self.new_ncbi_data()
+        ncbi_data.load()
+        snapshot_file = ncbi_data.get_cache_filename()
+
+        rebuilt = ncbi_data.snapshots.rebuild(ncbi_data.load_from_ncbi)
+        self.assertFalse(rebuilt)
+        self.assertEqual(self.server.requests, [200, 304])
+        self.assertEqual(ncbi_data.get_cache_filename(), snapshot_file)
+
+    def test_changed_source_is_rebuilt_in_background(self):
+        ncbi_data = self.new_ncbi_data()
+        ncbi_data.load()
+        old_snapshot_file = ncbi_data.get_cache_filename()
+
+        new_row = ('Bacillus subtilis', '1423', '4.0', '43.0', 'chromosome:CP040001.1', '4000', '3900', '2023/03/03', 'Complete Genome', 'GCA_004000001.1')
+        self.server.body = prokaryotes_text(PROKARYOTES_ROWS + [new_row]).encode()
+        self.server.last_modified = 'Tue, 02 Jan 2024 00:00:00 GMT'
+
+        release_build = threading.Event()
+        def slow_build(source):
+            release_build.wait(10)
+            return ncbi_data.load_from_ncbi(source)
+
+        ncbi_data.snapshots.check_interval = 0
+        ncbi_data.snapshots.refresh(slow_build, background=True)
+
+        # the previous snapshot is served while the rebuild runs
+        self.assertEqual(ncbi_data.get_cache_filename(), old_snapshot_file)
+        self.assertEqual(len(self.new_ncbi_data().load_from_cache()), 7)
+
+        release_build.set()
+        ncbi_data.snapshots.build_thread.join(10)
+
+        self.assertNotEqual(ncbi_data.get_cache_filename(), old_snapshot_file)
+        self.assertEqual(len(ncbi_data.load_from_cache()), 8)
+
+    def test_interrupted_download_is_removed(self):
+        ncbi_data = self.new_ncbi_data()
+        def interrupted_copy(response, f, length):
+            f.write(response.read(100))
+            raise TimeoutError('read timed out')
+
+        with mock.patch('snapshot.shutil.copyfileobj', side_effect=interrupted_copy):
+            with self.assertRaises(TimeoutError):
+                ncbi_data.snapshots.rebuild(ncbi_data.load_from_ncbi)
+        self.assertEqual(os.listdir(ncbi_data.cache_path), [])
+
+    def test_local_source(self):
+        source = os.path.join(self.tmpdir.name, 'prokaryotes.txt')
+        with open(source, 'wb') as f:
+            f.write(self.server.body)
+        ncbi_data = NCBIdata(cache_path=os.path.join(self.tmpdir.name, 'cache'), url=source)
+        ncbi_data.taxdb_file = self.taxdb_file
+        ncbi_data.load()
+
+        self.assertFalse(ncbi_data.snapshots.rebuild(ncbi_data.load_from_ncbi))
+        os.utime(source, (0, 0))
+        self.assertTrue(ncbi_data.snapshots.rebuild(ncbi_data.load_from_ncbi))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import unittest
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from charts import barchart_maker
+from snapshot_stats import SnapshotStats
+from tests.fixtures import load_ncbi_data
+
+
+class TestSnapshotStats(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.ncbi = load_ncbi_data(cls.tmpdir.name)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.tmpdir.cleanup()
+
+    def sessions(self):
+        # nothing selected, a few rows, most rows (computed from the unselected rows) and no row
+        for (rank, values, ranges) in [(None, [], []), ('genus', ['Bacillus'], []), ('superkingdom', ['Bacteria'], []),
+                                       (None, [], [('GC%', 45.0, 70.0)]), ('genus', ['Nothing'], [])]:
+            session = self.ncbi.new_session()
+            if rank is not None:
+                session.set_rank_filter(rank, values)
+            for range_filter in ranges:
+                session.set_range_filter(*range_filter)
+            yield session
+
+    def test_year_counts(self):
+        for session in self.sessions():
+            expected = barchart_maker.__wrapped__(session.filtered_columns(['Release Date']), 'Release Date').sort_index()
+            year_counts = session.year_counts()
+            self.assertEqual(year_counts.index.tolist(), expected.index.tolist())
+            self.assertEqual(year_counts['Count'].tolist(), expected['Count'].tolist())
+
+    def test_correlation(self):
+        columns = self.ncbi.stats_columns()
+        for session in self.sessions():
+            expected = session.filtered_columns(columns).corr()
+            pd.testing.assert_frame_equal(session.correlation(), expected, check_exact=False, atol=1e-9)
+        self.assertEqual(list(session.correlation(['GC%', 'Genes']).columns), ['GC%', 'Genes'])
+        # identifiers are not genome features
+        self.assertEqual(columns, ['Genome size (Mb)', 'GC%', 'Chromosome', 'Plasmid', 'Genes', 'Proteins'])
+
+    def test_ranges(self):
+        for session in self.sessions():
+            df = session.filtered_columns(['GC%'])
+            expected = (float(df['GC%'].min()), float(df['GC%'].max())) if len(df) else None
+            self.assertEqual(session.filtered_range('GC%'), expected)
+
+        gc = self.ncbi.columns(['GC%'])['GC%']
+        self.assertEqual(self.ncbi.size_menus['GC%']['range'], (float(gc.min()), float(gc.max())))
+        # the range of all rows is read from the sketch and selects every genome
+        session = self.ncbi.new_session()
+        session.set_range_filter('GC%', *self.ncbi.size_menus['GC%']['range'])
+        self.assertEqual(len(session.selected_positions()), self.ncbi.row_count())
+
+    def test_sketch(self):
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({'Release Date': ['2001/10/15', 'unknown'] * 5000, 'x': rng.normal(size=10000)})
+        stats = SnapshotStats.build(lambda col_names: df[col_names], ['x'])
+        self.assertEqual(stats.year_counts()['Count'].to_dict(), {2001: 5000})
+        q = [0.1, 0.5, 0.9]
+        np.testing.assert_allclose(stats.quantiles('x', q), np.quantile(df['x'], q), atol=0.02)
+        np.testing.assert_allclose(stats.quantiles('x', q, positions=np.arange(100)), np.quantile(df['x'][:100], q))
+        with self.assertRaises(ValueError):
+            stats.quantiles('y', q)
+
+    def test_stored_with_snapshot(self):
+        path = self.ncbi.snapshot_table.path + '.stats.npz'
+        self.assertTrue(os.path.exists(path))
+        stats = SnapshotStats.open(path, None, self.ncbi.stats_columns())   # loaded, not computed again
+        np.testing.assert_array_equal(stats.years, self.ncbi.stats.years)
+        self.assertEqual(stats.years.dtype, np.int16)
+
+
+if __name__ == '__main__':
+    unittest.main()
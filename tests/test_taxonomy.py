@@ -0,0 +1,86 @@
+import os
+import tarfile
+import unittest
+import tempfile
+import numpy as np
+
+from ncbi import NCBIdata, resolve_desired_ranks
+from taxonomy import CompactTaxonomy, nested_intervals
+from tests.fixtures import DESIRED_RANKS, build_ncbitaxa, write_prokaryotes, write_taxdump
+
+
+class TestCompactTaxonomy(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.ncbi = build_ncbitaxa(cls.tmpdir.name)
+        cls.taxdump_file = os.path.join(cls.tmpdir.name, 'taxdump.tar.gz')
+        cls.taxonomy = CompactTaxonomy.from_taxdump(cls.taxdump_file)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.ncbi.db.close()
+        cls.tmpdir.cleanup()
+
+    def test_matches_ete3(self):
+        taxids = ['562', '83333', '1423', '1428', '2237', '12345', '99999999', 'abc', '', '562', 2237]
+        lineage_df, missed = resolve_desired_ranks(taxids, DESIRED_RANKS, ncbi=self.taxonomy)
+        expected_df, expected_missed = resolve_desired_ranks(taxids, DESIRED_RANKS, ncbi=self.ncbi)
+
+        self.assertEqual(missed, expected_missed)
+        self.assertEqual(lineage_df.values.tolist(), expected_df.values.tolist())
+        self.assertEqual(list(lineage_df.columns), list(expected_df.columns))
+        self.assertEqual(lineage_df.loc[6, 'genus'], None)
+        self.assertEqual(lineage_df.loc[4, 'species'], '<not present>')
+
+    def test_clade_intervals(self):
+        rows = self.taxonomy.node_rows(['2', '561', '562', '83333', '1423', '2157'])
+        (bacteria, escherichia, coli, k12, subtilis, archaea) = [(self.taxonomy.clade_start[row], self.taxonomy.clade_end[row]) for row in rows]
+        self.assertTrue(bacteria[0] < escherichia[0] < coli[0] < k12[0] <= k12[1] <= coli[1] <= escherichia[1] <= bacteria[1])
+        self.assertTrue(bacteria[0] <= subtilis[0] <= bacteria[1])
+        self.assertFalse(archaea[0] <= coli[0] <= archaea[1])
+        self.assertEqual(self.taxonomy.clade_intervals(['Bacteria', 561, '1423', 'Unknown']), [bacteria])
+
+    def test_nested_intervals_match_ancestors(self):
+        rng = np.random.default_rng(3)
+        parent = (np.arange(300) * rng.random(300)).astype(np.int64)
+        parent[[0, 7]] = [0, 7]   # two roots
+        (start, end) = nested_intervals(parent)
+        self.assertEqual(sorted(start), list(range(300)))
+        for y in range(300):
+            ancestors = {y}
+            node = y
+            while parent[node] != node:
+                node = parent[node]
+                ancestors.add(node)
+            self.assertEqual(set(np.flatnonzero((start <= start[y]) & (start[y] <= end))), ancestors)
+
+    def test_save_and_unpacked_taxdump(self):
+        path = os.path.join(self.tmpdir.name, 'cache', 'taxonomy.npz')
+        self.taxonomy.save(path)
+        loaded = CompactTaxonomy.open(path, self.taxdump_file)
+        self.assertEqual(loaded.dbfile, path)
+        self.assertEqual(len(loaded), len(self.taxonomy))
+
+        taxdump_dir = os.path.join(self.tmpdir.name, 'taxdump')
+        with tarfile.open(self.taxdump_file) as tar:
+            tar.extractall(taxdump_dir)
+        unpacked = CompactTaxonomy.from_taxdump(taxdump_dir)
+        for name in CompactTaxonomy.ARRAYS:
+            self.assertEqual(getattr(unpacked, name).tolist(), getattr(loaded, name).tolist())
+
+    def test_build_without_ete3_database(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = write_prokaryotes(os.path.join(tmpdir, 'prokaryotes.txt'))
+            ncbi_data = NCBIdata(cache_path=os.path.join(tmpdir, 'cache'), url=source)
+            ncbi_data.taxdump_file = write_taxdump(tmpdir)
+            ncbi_data.load()
+
+            self.assertIsInstance(ncbi_data.get_taxonomy(), CompactTaxonomy)
+            self.assertTrue(os.path.exists(os.path.join(tmpdir, 'cache', 'taxonomy.npz')))
+            self.assertEqual(ncbi_data.row_count(), 7)
+            self.assertEqual(ncbi_data.tax_items['genus'], ['Bacillus', 'Escherichia', 'Haloarcula'])
+
+
+if __name__ == '__main__':
+    unittest.main()